@@ -36,22 +36,11 @@ def create_app(config_class=Config):
     migrate.init_app(app, db)
     mail.init_app(app)
 
-    from app import tasks
+    from app.email import mail_dispatcher
+    mail_dispatcher.init_app(app)
 
-    if not scheduler.get_jobs():
-        # --- AGENDAMENTO FINAL APLICADO AQUI ---
-        # Executa a tarefa toda segunda-feira, às 8:00 da manhã.
-        scheduler.add_job(
-            func=tasks.gerar_relatorio_semanal, 
-            trigger='cron', 
-            day_of_week='mon', 
-            hour=8, 
-            id='relatorio_semanal_job', 
-            args=[app]
-        )
-        
-    if not scheduler.running:
-        scheduler.start()
+    # Importados para registar os handlers do outbox.
+    from app import nfe_batch, tasks
 
     from .routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
@@ -61,4 +50,30 @@ def create_app(config_class=Config):
     def load_user(user_id):
         return User.query.get(int(user_id))
 
+    @app.cli.command('recalcular-custos')
+    def recalcular_custos():
+        """Recalcula do zero o custo de todas as receitas, incluindo sub-receitas."""
+        from .costing import recalculate_user_recipes
+        total = 0
+        for (user_id,) in db.session.query(User.id).all():
+            total += recalculate_user_recipes(user_id)
+        User.query.update({User.dashboard_version: User.dashboard_version + 1}, synchronize_session=False)
+        db.session.commit()
+        print(f"{total} receitas recalculadas.")
+
     return app
+
+def start_scheduler(app):
+    """Agenda as tarefas periódicas. Corre apenas no processo do worker, nunca nos processos web."""
+    from app import tasks
+    if not scheduler.get_jobs():
+        # Executa a tarefa toda segunda-feira, às 8:00 da manhã.
+        scheduler.add_job(
+            func=tasks.agendar_relatorio_semanal,
+            trigger='cron',
+            id='relatorio_semanal_job',
+            args=[app],
+            **tasks.RELATORIO_SEMANAL_CRON
+        )
+    if not scheduler.running:
+        scheduler.start()
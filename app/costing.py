@@ -0,0 +1,512 @@
+# Arquivo: app/costing.py
+
+import logging
+from collections import defaultdict
+from datetime import datetime
+import numpy as np
+from sqlalchemy import case, func
+from app import db
+from app.models import Ingredient, PriceHistory, Recipe, RecipeIngredient
+from app.units import (COUNT, UNITS, UnitConversionError, base_unit_for, convert, convert_array, normalize_unit,
+                       to_grams_array)
+
+logger = logging.getLogger(__name__)
+
+# --- FUNÇÕES DE CÁLCULO DE CUSTO ---
+def calculate_base_price(package_price, package_quantity, package_unit):
+    """Preço por unidade base (g, ml ou un) de um pacote. Lança UnitConversionError para unidades desconhecidas."""
+    base_unit = base_unit_for(package_unit)
+    if package_quantity == 0: return 0, base_unit
+    return package_price / convert(package_quantity, package_unit, base_unit), base_unit
+
+def ingredient_cost_basis(ingredient):
+    """Tudo o que determina o custo de uma linha: (preço base, unidade base, densidade, peso por unidade)."""
+    return (ingredient.base_price, ingredient.base_unit, ingredient.density, ingredient.unit_weight_g)
+
+def calculate_line_cost(base_price, base_unit, quantity, unit_used, density=None, unit_weight_g=None):
+    """Custo de uma linha de receita a partir do preço base do ingrediente."""
+    if not base_price: return 0
+    return base_price * convert(quantity, unit_used, base_unit, density, unit_weight_g)
+
+def calculate_ingredient_cost_in_recipe(ingredient, quantity, unit_used):
+    if not ingredient: return 0
+    try:
+        return calculate_line_cost(ingredient.base_price, ingredient.base_unit, quantity, unit_used,
+                                   ingredient.density, ingredient.unit_weight_g)
+    except UnitConversionError as e:
+        logger.warning("Linha sem custo para '%s': %s", ingredient.name, e)
+        return 0
+
+def line_costs_array(bases, quantities, units_used):
+    """
+    Custo de várias linhas de uma só vez. `bases` é uma lista de ingredient_cost_basis().
+    Linhas com unidades incompatíveis resultam em NaN.
+    """
+    if not bases:
+        return np.zeros(0)
+    prices, base_units, densities, unit_weights = zip(*bases)
+    prices = np.nan_to_num(np.asarray(prices, dtype=float))
+    return prices * convert_array(quantities, units_used, base_units, densities, unit_weights)
+
+# --- SUB-RECEITAS ---
+class RecipeCycleError(ValueError):
+    pass
+
+def recipe_cost_state(recipe):
+    """O que determina o custo de uma receita usada como sub-receita: (custo total, peso total g, rendimento, perda %)."""
+    return (recipe.total_cost or 0, recipe.total_weight_g, recipe.yield_quantity, recipe.loss_percentage)
+
+def sub_recipe_line(state, quantity, unit_used):
+    """
+    Devolve (custo, peso_g) de `quantity` `unit_used` de uma sub-receita no estado `state`.
+    Em massa ou volume usa o peso final (peso total descontada a perda); em unidades usa o rendimento.
+    """
+    total_cost, total_weight_g, yield_quantity, loss_percentage = state
+    usable_weight = (total_weight_g or 0) * (1 - (loss_percentage or 0) / 100)
+    unit = normalize_unit(unit_used)
+    if unit in UNITS and UNITS[unit][0] != COUNT:
+        if usable_weight <= 0:
+            raise UnitConversionError('a sub-receita não tem peso calculado; use-a em unidades do rendimento.')
+        grams = convert(quantity, unit, 'g', density=1.0)
+        return total_cost * grams / usable_weight, grams
+    if not yield_quantity or yield_quantity <= 0:
+        raise UnitConversionError('a sub-receita não tem rendimento definido.')
+    portions = convert(quantity, unit, 'un')
+    return total_cost * portions / yield_quantity, usable_weight * portions / yield_quantity
+
+def recipe_line_cost(item):
+    """Custo de uma linha já gravada (RecipeIngredient), seja ingrediente ou sub-receita."""
+    if item.sub_recipe_id:
+        try:
+            return sub_recipe_line(recipe_cost_state(item.sub_recipe), item.quantity, item.unit_used)[0]
+        except UnitConversionError as e:
+            logger.warning("Linha sem custo para a sub-receita '%s': %s", item.sub_recipe.name, e)
+            return 0
+    return calculate_ingredient_cost_in_recipe(item.ingredient, item.quantity, item.unit_used)
+
+class RecipeCostGraph:
+    """
+    Grafo de dependências (receita -> sub-receitas) de todas as receitas de um utilizador.
+    Receitas e linhas são carregadas em duas consultas; o custo de cada nó é calculado uma única
+    vez (memoização) e os ciclos são detetados durante o percurso.
+    """
+    def __init__(self, user_id):
+        self.recipes = {r.id: r for r in Recipe.query.filter_by(user_id=user_id)}
+        rows = db.session.query(
+            RecipeIngredient.recipe_id, RecipeIngredient.sub_recipe_id, RecipeIngredient.quantity,
+            RecipeIngredient.unit_used, Ingredient.base_price, Ingredient.base_unit,
+            Ingredient.density, Ingredient.unit_weight_g
+        ).outerjoin(Ingredient, RecipeIngredient.ingredient_id == Ingredient.id
+        ).filter(RecipeIngredient.recipe_id.in_(list(self.recipes.keys()))).all() if self.recipes else []
+        self.lines = defaultdict(list)
+        for recipe_id, sub_recipe_id, quantity, unit_used, *basis in rows:
+            self.lines[recipe_id].append((sub_recipe_id, quantity, unit_used, tuple(basis)))
+        self._totals = {}
+
+    def total(self, recipe_id, _path=()):
+        """(custo total, peso total g) da receita, com as sub-receitas calculadas recursivamente."""
+        if recipe_id in self._totals:
+            return self._totals[recipe_id]
+        if recipe_id in _path:
+            raise RecipeCycleError(f'A receita "{self.recipes[recipe_id].name}" depende de si mesma.')
+        path = _path + (recipe_id,)
+
+        ingredient_lines = [line for line in self.lines[recipe_id] if line[0] is None]
+        total_cost, total_weight_g = 0.0, 0.0
+        if ingredient_lines:
+            _, quantities, units_used, bases = zip(*ingredient_lines)
+            total_cost += float(np.nansum(line_costs_array(list(bases), quantities, units_used)))
+            total_weight_g += float(to_grams_array(quantities, units_used,
+                                                   [b[2] for b in bases], [b[3] for b in bases]).sum())
+        for sub_recipe_id, quantity, unit_used, _ in self.lines[recipe_id]:
+            if sub_recipe_id is None or sub_recipe_id not in self.recipes:
+                continue
+            sub = self.recipes[sub_recipe_id]
+            sub_cost, sub_weight = self.total(sub_recipe_id, path)
+            try:
+                cost, weight = sub_recipe_line((sub_cost, sub_weight, sub.yield_quantity, sub.loss_percentage),
+                                               quantity, unit_used)
+            except UnitConversionError:
+                continue
+            total_cost += cost
+            total_weight_g += weight
+
+        self._totals[recipe_id] = (total_cost, total_weight_g)
+        return self._totals[recipe_id]
+
+def recalculate_user_recipes(user_id):
+    """Recalcula do zero o custo de todas as receitas do utilizador. O commit fica a cargo de quem chama."""
+    graph = RecipeCostGraph(user_id)
+    mappings = []
+    for recipe_id, recipe in graph.recipes.items():
+        total_cost, total_weight_g = graph.total(recipe_id)
+        mappings.append({
+            'id': recipe_id, 'total_cost': total_cost, 'total_weight_g': total_weight_g,
+            'sale_price': total_cost * (1 + (recipe.profit_margin or 0) / 100),
+            'cost_per_serving': total_cost / recipe.yield_quantity if recipe.yield_quantity and recipe.yield_quantity > 0 else 0,
+        })
+    db.session.bulk_update_mappings(Recipe, mappings)
+    return len(mappings)
+
+# --- CUSTEIO DE RECEITAS ---
+def parse_recipe_form_lines(form):
+    """
+    Lê do formulário as linhas selecionadas como (id, quantidade, unidade).
+    Devolve (linhas_de_ingredientes, linhas_de_sub_receitas).
+    """
+    def read(ids_field, prefix):
+        lines = []
+        for item_id in form.getlist(ids_field):
+            if not str(item_id).isdigit():
+                continue
+            quantity = form.get(f'{prefix}quantity_{item_id}', '').replace(',', '.').strip()
+            lines.append((int(item_id), quantity, form.get(f'{prefix}unit_{item_id}')))
+        return lines
+    return read('ingredient_ids', ''), read('subrecipe_ids', 'sub_')
+
+def _parse_quantity(quantity, name):
+    if quantity is None or quantity == '':
+        raise ValueError(f'Informe a quantidade para "{name}".')
+    try:
+        return float(quantity)
+    except ValueError:
+        raise ValueError(f'Quantidade inválida para "{name}".')
+
+def price_recipe_lines(user_id, lines, sub_recipe_lines=(), recipe_id=None):
+    """
+    Custeia as linhas (id, quantidade, unidade) de ingredientes e de sub-receitas de uma receita.
+    Todos os ingredientes são carregados numa única consulta restrita ao utilizador e as linhas
+    são custeadas numa só passagem. `recipe_id` (na edição) serve para recusar ciclos entre receitas.
+    Devolve (linhas_custeadas, custo_total, peso_total_g).
+    Lança ValueError com uma mensagem para o utilizador se uma linha for inválida.
+    """
+    ingredient_ids = {ing_id for ing_id, _, _ in lines}
+    ingredients = {}
+    if ingredient_ids:
+        ingredients = {i.id: i for i in Ingredient.query.filter(
+            Ingredient.user_id == user_id, Ingredient.id.in_(ingredient_ids))}
+
+    resolved = []
+    for ing_id, quantity, unit_used in lines:
+        ingredient = ingredients.get(ing_id)
+        if ingredient is None:
+            raise ValueError('Um dos ingredientes selecionados não foi encontrado.')
+        resolved.append((ingredient, _parse_quantity(quantity, ingredient.name), unit_used))
+
+    priced_lines, total_cost, total_weight_g = [], 0.0, 0.0
+    if resolved:
+        used_ingredients, quantities, units_used = zip(*resolved)
+        bases = [ingredient_cost_basis(i) for i in used_ingredients]
+        costs = line_costs_array(bases, quantities, units_used)
+        for ingredient, quantity, unit_used, cost in zip(used_ingredients, quantities, units_used, costs):
+            if np.isnan(cost):
+                # Repete a conversão escalar só para obter a mensagem de erro exata.
+                try:
+                    calculate_line_cost(ingredient.base_price or 1, ingredient.base_unit, quantity, unit_used,
+                                        ingredient.density, ingredient.unit_weight_g)
+                except UnitConversionError as e:
+                    raise ValueError(f'"{ingredient.name}": {e}')
+                raise ValueError(f'Não foi possível calcular o custo de "{ingredient.name}".')
+        weights = to_grams_array(quantities, units_used,
+                                 [i.density for i in used_ingredients], [i.unit_weight_g for i in used_ingredients])
+        priced_lines = [
+            {'ingredient_id': ingredient.id, 'quantity': quantity, 'unit_used': unit_used, 'cost': float(cost)}
+            for ingredient, quantity, unit_used, cost in zip(used_ingredients, quantities, units_used, costs)
+        ]
+        total_cost, total_weight_g = float(costs.sum()), float(weights.sum())
+
+    if sub_recipe_lines:
+        sub_ids = {sub_id for sub_id, _, _ in sub_recipe_lines}
+        if recipe_id is not None and (recipe_id in sub_ids or sub_ids & dependent_recipe_ids([recipe_id])):
+            raise RecipeCycleError('Uma receita não pode usar, direta ou indiretamente, a si mesma como sub-receita.')
+        sub_recipes = {r.id: r for r in Recipe.query.filter(Recipe.user_id == user_id, Recipe.id.in_(sub_ids))}
+        for sub_id, quantity, unit_used in sub_recipe_lines:
+            sub = sub_recipes.get(sub_id)
+            if sub is None:
+                raise ValueError('Uma das sub-receitas selecionadas não foi encontrada.')
+            quantity = _parse_quantity(quantity, sub.name)
+            try:
+                cost, weight = sub_recipe_line(recipe_cost_state(sub), quantity, unit_used)
+            except UnitConversionError as e:
+                raise ValueError(f'"{sub.name}": {e}')
+            priced_lines.append({'sub_recipe_id': sub_id, 'quantity': quantity, 'unit_used': unit_used, 'cost': cost})
+            total_cost += cost
+            total_weight_g += weight
+
+    return priced_lines, total_cost, total_weight_g
+
+def save_recipe_costing(recipe, priced_lines, total_cost, total_weight_g, previous_state=None):
+    """
+    Grava o custeio na receita e substitui as suas linhas por um INSERT em lote.
+    Na edição, `previous_state` (recipe_cost_state() antes das alterações) permite atualizar
+    as receitas que usam esta como sub-receita. O commit fica a cargo de quem chama.
+    """
+    recipe.total_cost = total_cost
+    recipe.total_weight_g = total_weight_g
+    recipe.sale_price = total_cost * (1 + (recipe.profit_margin or 0) / 100)
+    recipe.cost_per_serving = total_cost / recipe.yield_quantity if recipe.yield_quantity and recipe.yield_quantity > 0 else 0
+
+    if recipe.id is None:
+        db.session.flush()
+    else:
+        RecipeIngredient.query.filter_by(recipe_id=recipe.id).delete(synchronize_session=False)
+
+    db.session.bulk_insert_mappings(RecipeIngredient, [
+        {'recipe_id': recipe.id, 'ingredient_id': line.get('ingredient_id'), 'sub_recipe_id': line.get('sub_recipe_id'),
+         'quantity': line['quantity'], 'unit_used': line['unit_used']}
+        for line in priced_lines
+    ])
+
+    if previous_state is not None and previous_state != recipe_cost_state(recipe):
+        db.session.flush()
+        deltas = cascade_cost_deltas({}, edited={recipe.id: (previous_state, recipe_cost_state(recipe))})
+        if deltas:
+            apply_cost_deltas(deltas)
+
+# --- IMPORTAÇÃO DE PREÇOS EM LOTE ---
+def base_prices_array(prices, quantities, units):
+    """
+    Versão vetorial de calculate_base_price: devolve (preços base, unidades base).
+    Lança UnitConversionError na primeira unidade desconhecida.
+    """
+    base_units = [base_unit_for(unit) for unit in units]
+    factors = convert_array(quantities, units, base_units)
+    prices = np.asarray(prices, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        base_prices = np.where(factors > 0, prices / factors, 0.0)
+    return base_prices, base_units
+
+def purchase_unit_error(unit):
+    """Motivo pelo qual uma compra em `unit` não pode ser convertida para a unidade base ('SC', 'LATA'...), ou None."""
+    try:
+        base_unit_for(unit)
+    except UnitConversionError as e:
+        return str(e)
+    return None
+
+def apply_purchase_prices(user_id, lines):
+    """
+    Aplica de uma vez os preços de compra de uma nota fiscal. `lines` é uma lista de
+    (ingredient_id, preço, quantidade, unidade); linhas de ingredientes de outros utilizadores são ignoradas.
+    Os ingredientes vêm numa única consulta, os preços base são calculados vetorialmente, os ingredientes
+    são atualizados num UPDATE em lote, o histórico é gravado num INSERT em lote e as receitas afetadas são
+    recalculadas na mesma passagem. Se o mesmo ingrediente aparecer em várias linhas, vale a última.
+    Linhas numa unidade sem conversão (ver purchase_unit_error) são ignoradas, sem impedir as restantes; quem
+    chama deve validá-las antes para as mostrar ao utilizador.
+    O commit fica a cargo de quem chama. Devolve o número de linhas aplicadas.
+    """
+    ids = {ingredient_id for ingredient_id, _, _, _ in lines}
+    if not ids:
+        return 0
+    current = {row[0]: tuple(row[1:]) for row in db.session.query(
+        Ingredient.id, Ingredient.base_price, Ingredient.base_unit, Ingredient.density, Ingredient.unit_weight_g
+    ).filter(Ingredient.user_id == user_id, Ingredient.id.in_(ids))}
+    lines = [line for line in lines if line[0] in current]
+    convertible = [line for line in lines if not purchase_unit_error(line[3])]
+    if len(convertible) < len(lines):
+        logger.warning("Compras sem unidade convertível ignoradas: %s",
+                       [(line[0], line[3]) for line in lines if purchase_unit_error(line[3])])
+        lines = convertible
+    if not lines:
+        return 0
+
+    ingredient_ids, prices, quantities, units = zip(*lines)
+    base_prices, base_units = base_prices_array(prices, quantities, units)
+
+    updates = {}
+    for ingredient_id, price, quantity, unit, base_price, base_unit in zip(
+            ingredient_ids, prices, quantities, units, base_prices.tolist(), base_units):
+        updates[ingredient_id] = {'id': ingredient_id, 'package_price': price, 'package_quantity': quantity,
+                                  'package_unit': unit, 'base_price': base_price, 'base_unit': base_unit}
+    db.session.bulk_update_mappings(Ingredient, list(updates.values()))
+
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(PriceHistory, [
+        {'ingredient_id': ingredient_id, 'price': price, 'quantity': quantity, 'unit': unit, 'recorded_at': now}
+        for ingredient_id, price, quantity, unit in lines
+    ])
+
+    price_changes = {}
+    for ingredient_id, update in updates.items():
+        _, _, density, unit_weight_g = current[ingredient_id]
+        price_changes[ingredient_id] = (current[ingredient_id],
+                                        (update['base_price'], update['base_unit'], density, unit_weight_g))
+    propagate_price_changes(price_changes)
+    return len(lines)
+
+# --- PROPAGAÇÃO DE CUSTOS ---
+def recipe_usages_by_ingredient(ingredient_ids):
+    """
+    Índice reverso ingrediente -> linhas de receita que o utilizam.
+    Devolve {ingredient_id: [(recipe_id, quantity, unit_used), ...]} numa única consulta.
+    """
+    usages = defaultdict(list)
+    if not ingredient_ids:
+        return usages
+    rows = db.session.query(
+        RecipeIngredient.ingredient_id, RecipeIngredient.recipe_id,
+        RecipeIngredient.quantity, RecipeIngredient.unit_used
+    ).filter(RecipeIngredient.ingredient_id.in_(list(ingredient_ids))).all()
+    for ingredient_id, recipe_id, quantity, unit_used in rows:
+        usages[ingredient_id].append((recipe_id, quantity, unit_used))
+    return usages
+
+def propagate_price_changes(price_changes):
+    """
+    Atualiza o custo das receitas afetadas por mudanças de preço base.
+
+    `price_changes` mapeia ingredient_id -> (base_antiga, base_nova), ambas no formato de ingredient_cost_basis().
+    Só as receitas que usam esses ingredientes são recalculadas: a diferença de custo (e de peso, se a densidade
+    ou o peso por unidade mudaram) de cada linha é somada por receita e aplicada com um único UPDATE em lote.
+    O commit fica a cargo de quem chama.
+    Devolve o número de receitas atualizadas.
+    """
+    changes = {ing_id: change for ing_id, change in price_changes.items() if change[0] != change[1]}
+    if not changes:
+        return 0
+
+    usage_rows = [(ingredient_id, recipe_id, quantity, unit_used)
+                  for ingredient_id, usages in recipe_usages_by_ingredient(changes.keys()).items()
+                  for recipe_id, quantity, unit_used in usages]
+    if not usage_rows:
+        return 0
+
+    ingredient_ids, recipe_ids, quantities, units_used = zip(*usage_rows)
+    old_costs = line_costs_array([changes[i][0] for i in ingredient_ids], quantities, units_used)
+    new_costs = line_costs_array([changes[i][1] for i in ingredient_ids], quantities, units_used)
+    if np.isnan(new_costs).any():
+        logger.warning("Ingredientes %s deixaram de ser convertíveis em algumas receitas; essas linhas passam a custar 0.",
+                       sorted({ingredient_ids[i] for i in np.flatnonzero(np.isnan(new_costs))}))
+    line_deltas = np.nan_to_num(new_costs) - np.nan_to_num(old_costs)
+    weight_deltas = (to_grams_array(quantities, units_used, [changes[i][1][2] for i in ingredient_ids],
+                                    [changes[i][1][3] for i in ingredient_ids]) -
+                     to_grams_array(quantities, units_used, [changes[i][0][2] for i in ingredient_ids],
+                                    [changes[i][0][3] for i in ingredient_ids]))
+
+    deltas = defaultdict(lambda: (0.0, 0.0))
+    for recipe_id, cost_delta, weight_delta in zip(recipe_ids, line_deltas.tolist(), weight_deltas.tolist()):
+        deltas[recipe_id] = (deltas[recipe_id][0] + cost_delta, deltas[recipe_id][1] + weight_delta)
+
+    deltas = cascade_cost_deltas({recipe_id: delta for recipe_id, delta in deltas.items() if any(delta)})
+    if not deltas:
+        return 0
+
+    apply_cost_deltas(deltas)
+    return len(deltas)
+
+def _downstream_edges(recipe_ids):
+    """
+    Linhas (receita, sub-receita, quantidade, unidade) de todas as receitas que usam `recipe_ids`,
+    direta ou indiretamente. Uma consulta por nível do grafo.
+    """
+    edges, seen, frontier = [], set(recipe_ids), set(recipe_ids)
+    while frontier:
+        rows = db.session.query(
+            RecipeIngredient.recipe_id, RecipeIngredient.sub_recipe_id,
+            RecipeIngredient.quantity, RecipeIngredient.unit_used
+        ).filter(RecipeIngredient.sub_recipe_id.in_(list(frontier))).all()
+        edges.extend(rows)
+        frontier = {row[0] for row in rows} - seen
+        seen |= frontier
+    return edges
+
+def dependent_recipe_ids(recipe_ids):
+    """Receitas que usam `recipe_ids` como sub-receita, direta ou indiretamente."""
+    return {parent_id for parent_id, _, _, _ in _downstream_edges(recipe_ids)}
+
+def _topological_order(nodes, edges):
+    """Ordena os nós de forma que cada sub-receita venha antes das receitas que a usam."""
+    pending = {node: 0 for node in nodes}
+    parents_of = defaultdict(list)
+    for parent_id, child_id, _, _ in edges:
+        pending[parent_id] += 1
+        parents_of[child_id].append(parent_id)
+    ready = [node for node, count in pending.items() if count == 0]
+    order = []
+    while ready:
+        node = ready.pop()
+        order.append(node)
+        for parent_id in parents_of[node]:
+            pending[parent_id] -= 1
+            if pending[parent_id] == 0:
+                ready.append(parent_id)
+    if len(order) < len(pending):
+        raise RecipeCycleError('Foi encontrado um ciclo entre sub-receitas.')
+    return order
+
+def _shift_state(state, cost_delta, weight_delta):
+    total_cost, total_weight_g, yield_quantity, loss_percentage = state
+    if weight_delta:
+        total_weight_g = (total_weight_g or 0) + weight_delta
+    return (total_cost + cost_delta, total_weight_g, yield_quantity, loss_percentage)
+
+def _sub_recipe_line_or_zero(state, quantity, unit_used, node, parent_id):
+    """sub_recipe_line() de uma linha a jusante; como em RecipeCostGraph, uma linha sem conversão conta 0."""
+    try:
+        return sub_recipe_line(state, quantity, unit_used)
+    except UnitConversionError as e:
+        logger.warning("Sub-receita %s sem custo na receita %s: %s", node, parent_id, e)
+        return 0.0, 0.0
+
+def cascade_cost_deltas(deltas, edited=None):
+    """
+    Estende `deltas` ({recipe_id: (variação do custo total, variação do peso total g)}) às receitas a jusante,
+    isto é, às que usam as receitas alteradas como sub-receita. `edited` ({recipe_id: (estado_antigo, estado_novo)})
+    cobre receitas cujo rendimento, peso ou perda também mudaram. O peso segue pelo grafo como o custo, porque
+    as receitas acima usam o peso das de baixo para custear as linhas em gramas. Só os nós a jusante são
+    visitados, em ordem topológica. Devolve o dicionário completo de variações.
+    """
+    edited = edited or {}
+    deltas = {recipe_id: tuple(delta) for recipe_id, delta in deltas.items()}
+    seeds = set(deltas) | set(edited)
+    edges = _downstream_edges(seeds)
+    if not edges:
+        return {recipe_id: delta for recipe_id, delta in deltas.items() if any(delta)}
+
+    nodes = seeds | {parent_id for parent_id, _, _, _ in edges}
+    states = {r.id: recipe_cost_state(r) for r in Recipe.query.filter(Recipe.id.in_(list(nodes - set(edited))))}
+    usages_of = defaultdict(list)
+    for parent_id, child_id, quantity, unit_used in edges:
+        usages_of[child_id].append((parent_id, quantity, unit_used))
+
+    for node in _topological_order(nodes, edges):
+        cost_delta, weight_delta = deltas.get(node, (0.0, 0.0))
+        if node in edited:
+            old_state, new_state = edited[node]
+            new_state = _shift_state(new_state, cost_delta, weight_delta)
+        elif cost_delta or weight_delta:
+            old_state = states[node]
+            new_state = _shift_state(old_state, cost_delta, weight_delta)
+        else:
+            continue
+        for parent_id, quantity, unit_used in usages_of[node]:
+            old_cost, old_weight = _sub_recipe_line_or_zero(old_state, quantity, unit_used, node, parent_id)
+            new_cost, new_weight = _sub_recipe_line_or_zero(new_state, quantity, unit_used, node, parent_id)
+            parent_cost, parent_weight = deltas.get(parent_id, (0.0, 0.0))
+            deltas[parent_id] = (parent_cost + new_cost - old_cost, parent_weight + new_weight - old_weight)
+    return {recipe_id: delta for recipe_id, delta in deltas.items() if any(delta)}
+
+def apply_cost_deltas(deltas):
+    """
+    Soma `deltas` ({recipe_id: (delta do custo, delta do peso g)}) ao custo e ao peso totais e recalcula preço de
+    venda e custo por porção num só UPDATE.
+    """
+    cost_deltas = {recipe_id: cost for recipe_id, (cost, _) in deltas.items() if cost}
+    weight_deltas = {recipe_id: weight for recipe_id, (_, weight) in deltas.items() if weight}
+    new_total = Recipe.total_cost + case(cost_deltas, value=Recipe.id, else_=0) if cost_deltas else Recipe.total_cost
+    values = {
+        Recipe.total_cost: new_total,
+        Recipe.sale_price: new_total * (1 + func.coalesce(Recipe.profit_margin, 0) / 100.0),
+        Recipe.cost_per_serving: case((Recipe.yield_quantity > 0, new_total / Recipe.yield_quantity), else_=0),
+    }
+    if weight_deltas:
+        values[Recipe.total_weight_g] = case(
+            (Recipe.id.in_(list(weight_deltas)),
+             func.coalesce(Recipe.total_weight_g, 0) + case(weight_deltas, value=Recipe.id, else_=0)),
+            else_=Recipe.total_weight_g)
+    db.session.query(Recipe).filter(Recipe.id.in_(list(deltas.keys()))).update(values, synchronize_session=False)
+
+    # As receitas já carregadas na sessão passam a ler os valores novos da base de dados.
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, Recipe) and obj.id in deltas:
+            db.session.expire(obj)
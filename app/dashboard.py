@@ -0,0 +1,272 @@
+# Arquivo: app/dashboard.py
+
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.orm import aliased
+from app import db, metrics
+from app.models import Ingredient, PriceHistory, Recipe, User
+from app.text import normalize_name
+
+ALERT_THRESHOLD = 0.10
+ALERT_WINDOW = timedelta(minutes=30)
+
+# Lucro de uma receita: receitas sem preço de venda contam 0.
+recipe_profit = Recipe.profit
+
+def period_bounds(period, now=None):
+    """Devolve (period, início, fim, início anterior, fim anterior) para '7d', 'month' ou '30d' (padrão)."""
+    end_date = now or datetime.utcnow()
+    if period == '7d':
+        start_date = end_date - timedelta(days=7)
+    elif period == 'month':
+        start_date = end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    else:
+        start_date = end_date - timedelta(days=30)
+        period = '30d'
+    prev_end_date = start_date - timedelta(seconds=1)
+    prev_start_date = prev_end_date - (end_date - start_date)
+    return period, start_date, end_date, prev_start_date, prev_end_date
+
+def _change(current, previous):
+    return ((current - previous) / previous) * 100 if previous > 0 else 0
+
+def period_kpis(user_id, start_date, end_date, prev_start_date, prev_end_date):
+    """Lucro e número de receitas criadas no período e no anterior, numa única consulta agregada."""
+    in_current = Recipe.created_at.between(start_date, end_date)
+    in_previous = Recipe.created_at.between(prev_start_date, prev_end_date)
+    row = db.session.query(
+        func.coalesce(func.sum(case((in_current, recipe_profit), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((in_previous, recipe_profit), else_=0.0)), 0.0),
+        func.count(case((in_current, Recipe.id))),
+        func.count(case((in_previous, Recipe.id))),
+    ).filter(
+        Recipe.user_id == user_id,
+        Recipe.created_at.between(prev_start_date, end_date)
+    ).one()
+    current_profit, prev_profit, current_count, prev_count = row
+    return {
+        'total_profit': {'value': current_profit, 'change': _change(current_profit, prev_profit)},
+        'recipes_created': {'value': current_count, 'change': _change(current_count, prev_count)},
+    }
+
+def top_recipes(user_id, start_date=None, end_date=None, order_by='profit', limit=3):
+    """
+    As `limit` receitas do período com maior lucro (order_by='profit'), maior custo ('cost') ou maior
+    preço de venda ('sale'). Sem datas, considera todas as receitas do utilizador.
+    """
+    key = {'cost': Recipe.total_cost, 'sale': func.coalesce(Recipe.sale_price, 0)}.get(order_by, recipe_profit)
+    query = db.session.query(
+        Recipe.id, Recipe.name, Recipe.total_cost, Recipe.sale_price, recipe_profit.label('profit')
+    ).filter(Recipe.user_id == user_id)
+    if start_date is not None:
+        query = query.filter(Recipe.created_at.between(start_date, end_date))
+    return query.order_by(key.desc(), Recipe.id).limit(limit).all()
+
+def trend_ingredient(user_id):
+    """Ingrediente com o maior preço base, usado no gráfico de tendência de custo."""
+    return Ingredient.query.filter_by(user_id=user_id).order_by(Ingredient.base_price.desc(), Ingredient.id).first()
+
+def recent_cost_alerts(user_id, now=None, window=ALERT_WINDOW, by_purchase=False):
+    """
+    Ingredientes alertados na janela indicada (por padrão, os últimos 30 minutos) cujo preço por unidade subiu mais de 10% entre as duas
+    últimas compras. Com by_purchase=True a janela aplica-se à data da última compra e não ao último alerta por
+    e-mail, para incluir as subidas vindas de NF-e e as que não chegaram ao limite do e-mail (15%).
+    Devolve (id, nome, aumento em %) numa única consulta: as duas últimas entradas do histórico de cada
+    ingrediente vêm de ROW_NUMBER() OVER (PARTITION BY ingredient_id ORDER BY recorded_at DESC).
+    """
+    now = now or datetime.utcnow()
+    unit_price = PriceHistory.price / PriceHistory.quantity
+    alerted = [] if by_purchase else [Ingredient.last_alerted_at >= now - window]
+    ranked = db.session.query(
+        PriceHistory.ingredient_id,
+        PriceHistory.recorded_at,
+        case((PriceHistory.quantity > 0, unit_price)).label('unit_price'),
+        func.row_number().over(
+            partition_by=PriceHistory.ingredient_id,
+            order_by=(PriceHistory.recorded_at.desc(), PriceHistory.id)
+        ).label('position')
+    ).join(Ingredient, PriceHistory.ingredient_id == Ingredient.id).filter(
+        Ingredient.user_id == user_id, *alerted
+    ).subquery()
+    latest = aliased(ranked)
+    previous = aliased(ranked)
+
+    purchased = [latest.c.recorded_at >= now - window] if by_purchase else []
+    rows = db.session.query(
+        Ingredient.id, Ingredient.name, latest.c.unit_price, previous.c.unit_price
+    ).join(latest, (latest.c.ingredient_id == Ingredient.id) & (latest.c.position == 1)
+    ).join(previous, (previous.c.ingredient_id == Ingredient.id) & (previous.c.position == 2)
+    ).filter(
+        previous.c.unit_price > 0,
+        latest.c.unit_price > previous.c.unit_price * (1 + ALERT_THRESHOLD),
+        *purchased
+    ).order_by(Ingredient.name).all()
+    return [(ingredient_id, name, (latest_price / previous_price - 1) * 100)
+            for ingredient_id, name, latest_price, previous_price in rows]
+
+def build_dashboard_snapshot(user_id, period):
+    """KPIs, listas de topo e séries dos gráficos do período, só com dados simples (sem objetos ORM)."""
+    period, start_date, end_date, prev_start_date, prev_end_date = period_bounds(period)
+    chart_recipes = [dict(row._mapping) for row in top_recipes(user_id, start_date, end_date, order_by='profit', limit=7)]
+    top_3_costly = [dict(row._mapping) for row in top_recipes(user_id, start_date, end_date, order_by='cost', limit=3)]
+
+    trend = trend_ingredient(user_id)
+    trend_labels, trend_data = [], []
+    if trend:
+        price_history = PriceHistory.query.filter(
+            PriceHistory.ingredient_id == trend.id,
+            PriceHistory.recorded_at.between(start_date, end_date)
+        ).order_by(PriceHistory.recorded_at.asc()).all()
+        trend_labels = [h.recorded_at.strftime('%d/%m') for h in price_history]
+        trend_data = [round(h.price / h.quantity, 2) for h in price_history if h.quantity > 0]
+
+    return {
+        'active_period': period,
+        'recipe_count': db.session.query(func.count(Recipe.id)).filter(Recipe.user_id == user_id).scalar(),
+        'ingredient_count': db.session.query(func.count(Ingredient.id)).filter(Ingredient.user_id == user_id).scalar(),
+        'kpis': period_kpis(user_id, start_date, end_date, prev_start_date, prev_end_date),
+        'most_profitable_recipe': chart_recipes[0] if chart_recipes else None,
+        'top_3_profitable': chart_recipes[:3],
+        'top_3_costly': top_3_costly,
+        'trend_ingredient': {'id': trend.id, 'name': trend.name} if trend else None,
+        'trend_labels': trend_labels,
+        'trend_data': trend_data,
+        'chart_labels': [r['name'] for r in chart_recipes],
+        'chart_data_profit': [round(r['profit'], 2) for r in chart_recipes],
+        'chart_data_cost': [round(r['total_cost'], 2) for r in chart_recipes],
+    }
+
+# --- LISTAS DAS ABAS (paginação por cursor) ---
+LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE = 50, 100
+
+# Ordenação -> (chave, decrescente). Cada chave tem um índice (user_id, chave[, id]), por isso cada página
+# é uma leitura do índice a partir do cursor, sem OFFSET: a página 100 custa o mesmo que a primeira.
+RECIPE_LIST_SORTS = {
+    'name': (Recipe.normalized_name, False),
+    'cost_desc': (Recipe.total_cost, True),
+    'cost_asc': (Recipe.total_cost, False),
+    'profit_desc': (Recipe.profit, True),
+}
+INGREDIENT_LIST_SORTS = {
+    'name': (Ingredient.name, False),
+    'price_desc': (Ingredient.base_price, True),
+    'price_asc': (Ingredient.base_price, False),
+}
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """[valor da chave, id] do último item da página anterior, ou None se o cursor for inválido."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) and len(values) == 2 and isinstance(values[1], int) else None
+
+def keyset_page(query, model, key, descending, after=None, limit=LIST_PAGE_SIZE):
+    """
+    Uma página de `query` ordenada por (key, id), a começar depois do cursor `after`.
+    Devolve (linhas, cursor da página seguinte ou None). A consulta deve trazer a chave na coluna 'sort_key'.
+    """
+    position = decode_cursor(after) if after else None
+    # Um cursor de outra ordenação (texto numa chave numérica ou o contrário) recomeça do início.
+    if position is not None and isinstance(position[0], str) != (key.type.python_type is str):
+        position = None
+    if position is not None:
+        last = tuple_(key, model.id)
+        query = query.filter(last < tuple_(*position) if descending else last > tuple_(*position))
+    order = (key.desc(), model.id.desc()) if descending else (key.asc(), model.id.asc())
+    rows = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = encode_cursor([rows[limit - 1].sort_key, rows[limit - 1].id]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def recipe_list_page(user_id, search=None, sort='name', after=None, limit=LIST_PAGE_SIZE):
+    """Receitas da aba do dashboard: procura pelo nome sem acentos, ordenação e cursor. Devolve (linhas, cursor)."""
+    key, descending = RECIPE_LIST_SORTS.get(sort, RECIPE_LIST_SORTS['name'])
+    query = db.session.query(
+        Recipe.id, Recipe.name, Recipe.total_cost, Recipe.sale_price, key.label('sort_key')
+    ).filter(Recipe.user_id == user_id)
+    if search and normalize_name(search):
+        query = query.filter(Recipe.normalized_name.contains(normalize_name(search), autoescape=True))
+    return keyset_page(query, Recipe, key, descending, after, limit)
+
+def ingredient_list_page(user_id, search=None, sort='name', after=None, limit=LIST_PAGE_SIZE):
+    """Ingredientes da aba do dashboard, com procura, ordenação e cursor. Devolve (linhas, cursor)."""
+    key, descending = INGREDIENT_LIST_SORTS.get(sort, INGREDIENT_LIST_SORTS['name'])
+    query = db.session.query(
+        Ingredient.id, Ingredient.name, Ingredient.package_price, Ingredient.package_quantity,
+        Ingredient.package_unit, Ingredient.base_price, Ingredient.base_unit, key.label('sort_key')
+    ).filter(Ingredient.user_id == user_id)
+    if search and search.strip():
+        query = query.filter(func.lower(Ingredient.name).contains(search.strip().lower(), autoescape=True))
+    return keyset_page(query, Ingredient, key, descending, after, limit)
+
+class DashboardSnapshotCache:
+    """
+    LRU em memória com os snapshots do dashboard, por (utilizador, período, versão).
+    A versão vem de User.dashboard_version, incrementada a cada escrita que afeta o dashboard, por isso
+    a invalidação vale para todos os processos. O TTL cobre a janela do período, que anda com o relógio.
+    """
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            # Versões antigas do mesmo utilizador nunca mais serão lidas.
+            user_id, _, version = key
+            for old_key in [k for k in self._entries if k[0] == user_id and k[2] != version]:
+                del self._entries[old_key]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+snapshot_cache = DashboardSnapshotCache()
+
+def dashboard_snapshot(user, period):
+    """Snapshot do dashboard vindo do cache; reconstruído na hora se a versão do utilizador mudou ou expirou."""
+    period = period_bounds(period)[0]
+    snapshot_cache.max_entries = current_app.config.get('DASHBOARD_CACHE_SIZE', snapshot_cache.max_entries)
+    snapshot_cache.ttl_seconds = current_app.config.get('DASHBOARD_CACHE_TTL', snapshot_cache.ttl_seconds)
+    key = (user.id, period, user.dashboard_version or 0)
+    snapshot = snapshot_cache.get(key)
+    if snapshot is not None:
+        metrics.increment('dashboard_cache_hits')
+        return snapshot
+    metrics.increment('dashboard_cache_misses')
+    with metrics.timed('dashboard_snapshot_rebuild'):
+        snapshot = build_dashboard_snapshot(user.id, period)
+    snapshot_cache.set(key, snapshot)
+    return snapshot
+
+def invalidate_dashboard(user_id):
+    """Marca o dashboard do utilizador como desatualizado; vai na mesma transação da escrita."""
+    User.query.filter_by(id=user_id).update(
+        {User.dashboard_version: func.coalesce(User.dashboard_version, 0) + 1}, synchronize_session=False)
+    metrics.increment('dashboard_cache_invalidations')
@@ -1,15 +1,154 @@
+import logging
+import os
+import queue
+import threading
+import time
 from flask import current_app, render_template, url_for
 from flask_mail import Message
-from app import mail
-from threading import Thread
+from app import mail, metrics, outbox
 
-def send_async_email(app, msg):
-    """Função para ser executada em uma thread separada para não bloquear a aplicação."""
-    with app.app_context():
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Balde de tokens partilhado pelos workers: no máximo `rate` envios por segundo (0 desliga o limite)."""
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class MailDispatcher:
+    """
+    Envio de e-mails em segundo plano com um número fixo de workers e uma fila limitada.
+    Cada worker abre uma ligação SMTP (mail.connect()) e reaproveita-a para as mensagens seguintes
+    enquanto houver fila, fechando-a ao fim de MAIL_IDLE_TIMEOUT segundos sem trabalho.
+    Com a fila cheia, submit() espera (backpressure) ou, com block=False, descarta e devolve False.
+    """
+    def __init__(self):
+        self.app = None
+        self._queue = None
+        self._workers = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('MAIL_WORKERS', 2)
+        self.idle_timeout = app.config.get('MAIL_IDLE_TIMEOUT', 5.0)
+        self.limiter = RateLimiter(app.config.get('MAIL_RATE_LIMIT', 0))
+        self._queue = queue.Queue(maxsize=app.config.get('MAIL_QUEUE_SIZE', 1000))
+
+    def _ensure_workers(self):
+        # Os workers são criados no processo que envia (depois do fork do gunicorn), não no master.
+        with self._lock:
+            if self._pid == os.getpid() and all(w.is_alive() for w in self._workers):
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._workers = []
+            self._pid = os.getpid()
+            self._workers = [w for w in self._workers if w.is_alive()]
+            for n in range(len(self._workers), self.workers):
+                worker = threading.Thread(target=self._run, name=f'mail-worker-{n}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, msg, block=True, timeout=None, on_done=None):
+        """
+        Põe a mensagem na fila. Devolve False se foi descartada por a fila estar cheia.
+        `on_done(erro)` é chamado pelo worker depois do envio, com None em caso de sucesso.
+        """
+        self._ensure_workers()
+        try:
+            self._queue.put((msg, on_done), block=block, timeout=timeout)
+        except queue.Full:
+            metrics.increment('mail_dropped')
+            logger.warning("Fila de e-mail cheia; mensagem '%s' para %s descartada.", msg.subject, msg.recipients)
+            return False
+        metrics.increment('mail_queued')
+        return True
+
+    def join(self):
+        """Espera até todas as mensagens da fila terem sido enviadas (ou falhado)."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                item = self._queue.get()
+                try:
+                    with mail.connect() as conn:
+                        while item is not None:
+                            self._send(conn, *item)
+                            self._queue.task_done()
+                            try:
+                                item = self._queue.get(timeout=self.idle_timeout)
+                            except queue.Empty:
+                                item = None
+                except Exception as e:
+                    # Falha ao abrir/fechar a ligação: a mensagem em curso conta como falhada.
+                    logger.warning("Falha na ligação SMTP: %s", e)
+                    if item is not None:
+                        metrics.increment('mail_failed')
+                        self._done(item[1], e)
+                        self._queue.task_done()
+
+    def _send(self, conn, msg, on_done):
+        self.limiter.acquire()
         try:
-            mail.send(msg)
+            with metrics.timed('mail_send'):
+                conn.send(msg)
+            metrics.increment('mail_sent')
         except Exception as e:
-            print(f"FALHA ao enviar e-mail em segundo plano: {e}")
+            metrics.increment('mail_failed')
+            logger.warning("FALHA ao enviar e-mail '%s' para %s: %s", msg.subject, msg.recipients, e)
+            self._done(on_done, e)
+        else:
+            self._done(on_done, None)
+
+    def _done(self, on_done, error):
+        if on_done is not None:
+            try:
+                on_done(error)
+            except Exception:
+                logger.exception("Erro no callback de envio de e-mail.")
+
+mail_dispatcher = MailDispatcher()
+
+def enqueue_email(msg):
+    """Grava a mensagem no outbox; é enviada pelo worker depois do commit da transação atual."""
+    return outbox.enqueue('email', message_payload(msg))
+
+def message_payload(msg):
+    return {'subject': msg.subject, 'sender': msg.sender, 'recipients': list(msg.recipients), 'html': msg.html}
+
+@outbox.handler('email', batch=True)
+def send_email_jobs(payloads):
+    """Envia um lote de e-mails do outbox pelo mail_dispatcher (ligações reaproveitadas, com limite de ritmo)."""
+    errors = [None] * len(payloads)
+    def on_done(n):
+        return lambda error: errors.__setitem__(n, error)
+    for n, payload in enumerate(payloads):
+        msg = Message(payload['subject'], sender=tuple(payload['sender']) if isinstance(payload['sender'], list) else payload['sender'],
+                      recipients=payload['recipients'], html=payload['html'])
+        mail_dispatcher.submit(msg, on_done=on_done(n))
+    mail_dispatcher.join()
+    return errors
 
 def send_cost_alert_email(user, ingredient, old_price, old_unit, new_price, new_unit, increase_percentage):
     """Monta e envia o e-mail de alerta de custo para o usuário."""
@@ -21,24 +160,19 @@ def send_cost_alert_email(user, ingredient, old_price, old_unit, new_price, new_
                                old_price=old_price, old_unit=old_unit,
                                new_price=new_price, new_unit=new_unit,
                                increase_percentage=increase_percentage)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    # O pedido só grava o job; o envio fica a cargo do worker.
+    return enqueue_email(msg)
+
+def build_weekly_report_message(app, user, top_receitas, top_ingredientes):
+    """Monta a mensagem do relatório semanal (sem enviar). Precisa de um contexto da aplicação ativo."""
+    subject = "LucroNaMesa: O seu resumo de desempenho da semana"
+    msg = Message(subject, sender=('LucroNaMesa', app.config['MAIL_USERNAME']), recipients=[user.email])
+    msg.html = render_template('email/relatorio_semanal.html',
+                               user=user,
+                               top_receitas=top_receitas,
+                               top_ingredientes=top_ingredientes)
+    return msg
 
-# --- NOVA FUNÇÃO ADICIONADA AQUI ---
 def send_weekly_report_email(app, user, top_receitas, top_ingredientes):
-    """Monta e envia o e-mail de relatório semanal."""
-    with app.app_context():
-        subject = "LucroNaMesa: O seu resumo de desempenho da semana"
-        msg = Message(subject, sender=('LucroNaMesa', app.config['MAIL_USERNAME']), recipients=[user.email])
-        msg.html = render_template('email/relatorio_semanal.html',
-                                   user=user,
-                                   top_receitas=top_receitas,
-                                   top_ingredientes=top_ingredientes)
-        # Para relatórios, podemos enviá-los de forma assíncrona, mas dentro da mesma thread da tarefa.
-        # Simplifica o processo, já que a tarefa já corre em segundo plano.
-        try:
-            mail.send(msg)
-            print(f"    -> E-mail de relatório enviado com sucesso para {user.email}")
-        except Exception as e:
-            print(f"    -> FALHA ao enviar e-mail de relatório para {user.email}: {e}")
\ No newline at end of file
+    """Monta o e-mail de relatório semanal e grava-o no outbox."""
+    return enqueue_email(build_weekly_report_message(app, user, top_receitas, top_ingredientes))
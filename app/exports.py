@@ -0,0 +1,208 @@
+# Arquivo: app/exports.py
+
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+from app import db
+from app.models import Ingredient, PriceHistory, Recipe
+from app.reports import recipe_order
+
+# Linhas trazidas do cursor do servidor por vez e linhas por bloco enviado ao navegador.
+FETCH_SIZE = 500
+FLUSH_ROWS = 500
+
+# --- RELATÓRIOS ---
+def recipe_rows(user_id, sort='profit_desc'):
+    query = db.session.query(
+        Recipe.name, Recipe.total_cost, Recipe.sale_price, Recipe.profit, Recipe.margin,
+        Recipe.yield_quantity, Recipe.yield_unit, Recipe.cost_per_serving
+    ).filter(Recipe.user_id == user_id).order_by(*recipe_order(sort))
+    for name, cost, sale_price, profit, margin, yield_quantity, yield_unit, cost_per_serving in query.yield_per(FETCH_SIZE):
+        yield (name, cost, sale_price, profit, margin, f"{yield_quantity} {yield_unit}", cost_per_serving)
+
+def ingredient_rows(user_id, sort=None):
+    query = db.session.query(
+        Ingredient.name, Ingredient.package_price, Ingredient.package_quantity, Ingredient.package_unit,
+        Ingredient.base_price, Ingredient.base_unit
+    ).filter(Ingredient.user_id == user_id).order_by(Ingredient.name, Ingredient.id)
+    return query.yield_per(FETCH_SIZE)
+
+def price_history_rows(user_id, sort=None):
+    query = db.session.query(
+        Ingredient.name, PriceHistory.recorded_at, PriceHistory.price, PriceHistory.quantity, PriceHistory.unit
+    ).join(Ingredient, PriceHistory.ingredient_id == Ingredient.id).filter(
+        Ingredient.user_id == user_id
+    ).order_by(PriceHistory.recorded_at.desc(), PriceHistory.id.desc())
+    return query.yield_per(FETCH_SIZE)
+
+# Por relatório: nome do ficheiro, colunas (título, tipo) e as linhas, já ordenadas na base de dados.
+# Os tipos escolhem a formatação: 'money' e 'percent' com vírgula decimal, 'price' com 4 casas,
+# 'quantity' sem zeros à direita e 'datetime' como dd/mm/aaaa hh:mm.
+REPORTS = {
+    'recipes': ('relatorio_de_rentabilidade', [
+        ('Nome da Receita', 'text'), ('Custo Total (R$)', 'money'), ('Preco de Venda (R$)', 'money'),
+        ('Lucro (R$)', 'money'), ('Margem (%)', 'percent'), ('Rendimento', 'text'),
+        ('Custo por Porcao (R$)', 'money'),
+    ], recipe_rows),
+    'ingredients': ('ingredientes', [
+        ('Ingrediente', 'text'), ('Preco da Embalagem (R$)', 'money'), ('Quantidade da Embalagem', 'quantity'),
+        ('Unidade da Embalagem', 'text'), ('Preco Base (R$)', 'price'), ('Unidade Base', 'text'),
+    ], ingredient_rows),
+    'price_history': ('historico_de_precos', [
+        ('Ingrediente', 'text'), ('Data', 'datetime'), ('Preco (R$)', 'money'), ('Quantidade', 'quantity'),
+        ('Unidade', 'text'),
+    ], price_history_rows),
+}
+
+def filename(report, extension):
+    return f"{REPORTS[report][0]}.{extension}"
+
+# --- CSV ---
+def _format(value, kind):
+    if kind == 'money':
+        return f"{value or 0:.2f}".replace('.', ',')
+    if kind == 'percent':
+        return f"{value or 0:.1f}".replace('.', ',')
+    if kind == 'price':
+        return f"{value or 0:.4f}".replace('.', ',')
+    if kind == 'quantity':
+        return f"{value or 0:g}".replace('.', ',')
+    if kind == 'datetime':
+        return value.strftime('%d/%m/%Y %H:%M') if value else ''
+    return '' if value is None else value
+
+def stream_csv(report, user_id, sort=None):
+    """
+    Gera o CSV em blocos de FLUSH_ROWS linhas, à medida que as linhas chegam do cursor: a memória usada
+    não depende do número de receitas e o download começa logo.
+    """
+    _, columns, rows = REPORTS[report]
+    kinds = [kind for _, kind in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([title for title, _ in columns])
+    for n, row in enumerate(rows(user_id, sort), start=1):
+        writer.writerow([_format(value, kind) for value, kind in zip(row, kinds)])
+        if n % FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+# --- XLSX ---
+# Folha de cálculo mínima (SpreadsheetML) escrita diretamente num zip em streaming: as células vão
+# para o zip à medida que as linhas chegam e os bytes comprimidos são enviados bloco a bloco.
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>')
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>')
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets></workbook>')
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>')
+# Estilos por índice: 0 normal, 1 cabeçalho, 2 dinheiro, 3 percentagem, 4 preço base, 5 data, 6 quantidade.
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="3"><numFmt numFmtId="164" formatCode="0.0000"/><numFmt numFmtId="165" formatCode="dd/mm/yyyy hh:mm"/>'
+    '<numFmt numFmtId="166" formatCode="0.0"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="7"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="166" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>')
+_XLSX_STYLE = {'money': 2, 'percent': 3, 'price': 4, 'datetime': 5, 'quantity': 6}
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+class _Chunks:
+    """Destino do zip sem seek: guarda os bytes escritos até serem enviados."""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _cell(ref, value, kind, style=0):
+    if value is None:
+        return ''
+    if kind in _XLSX_STYLE:
+        if isinstance(value, datetime):
+            value = (value - _EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c r="{ref}" s="{_XLSX_STYLE[kind]}"><v>{float(value)!r}</v></c>'
+    text = escape(_INVALID_XML.sub('', str(value)))
+    style = f' s="{style}"' if style else ''
+    return f'<c r="{ref}" t="inlineStr"{style}><is><t xml:space="preserve">{text}</t></is></c>'
+
+def stream_xlsx(report, user_id, sort=None):
+    """XLSX com as mesmas linhas do CSV, gerado em memória constante: números e datas ficam como valores do Excel."""
+    name, columns, rows = REPORTS[report]
+    letters = [_column_letter(i) for i in range(len(columns))]
+    kinds = [kind for _, kind in columns]
+    sink = _Chunks()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(name[:31])))
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        archive.writestr('xl/styles.xml', _STYLES)
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            header = ''.join(_cell(f'{letter}1', title, 'text', style=1) for letter, (title, _) in zip(letters, columns))
+            sheet.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                         f'<row r="1">{header}</row>').encode())
+            lines = []
+            for n, row in enumerate(rows(user_id, sort), start=2):
+                cells = ''.join(_cell(f'{letter}{n}', value, kind) for letter, value, kind in zip(letters, row, kinds))
+                lines.append(f'<row r="{n}">{cells}</row>')
+                if len(lines) == FLUSH_ROWS:
+                    sheet.write(''.join(lines).encode())
+                    lines = []
+                    yield sink.drain()
+            sheet.write((''.join(lines) + '</sheetData></worksheet>').encode())
+    yield sink.drain()
@@ -2,8 +2,20 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, SelectField, FloatField, TextAreaField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Optional, NumberRange
 from app.models import User
+from app.text import normalize_phone
 from flask_login import current_user
 
+# Telefone opcional, mas se informado tem de ser um número válido e não pode pertencer a outra conta
+def validate_phone_number(form, field):
+    if not field.data:
+        return
+    phone = normalize_phone(field.data)
+    if not phone:
+        raise ValidationError('Telefone inválido. Use o DDD e o número, por exemplo (11) 98765-4321.')
+    user = User.query.filter_by(phone_e164=phone).first()
+    if user and not (current_user.is_authenticated and user.id == current_user.id):
+        raise ValidationError('Este telefone já está associado a outra conta.')
+
 # Validador customizado para aceitar números com vírgula ou ponto
 def validate_decimal(form, field):
     if field.data:
@@ -22,7 +34,7 @@ class RegistrationForm(FlaskForm):
         ('Hamburgueria', 'Hamburgueria'), ('Restaurante', 'Restaurante'), ('Lanchonete', 'Lanchonete'),
         ('Food Truck', 'Food Truck'), ('Outro', 'Outro')
     ], validators=[DataRequired()])
-    phone = StringField('Telefone / WhatsApp', validators=[Optional()])
+    phone = StringField('Telefone / WhatsApp', validators=[Optional(), validate_phone_number])
     password = PasswordField('Senha', validators=[DataRequired(), Length(min=6)])
     confirm_password = PasswordField('Confirmar Senha', validators=[DataRequired(), EqualTo('password', message='As senhas devem ser iguais.')])
     submit = SubmitField('Criar Conta e Começar')
@@ -45,6 +57,8 @@ class IngredientForm(FlaskForm):
         ('kg', 'Quilograma (kg)'), ('g', 'Grama (g)'), ('l', 'Litro (l)'), 
         ('ml', 'Mililitro (ml)'), ('un', 'Unidade (un)')
     ], validators=[DataRequired()])
+    density = StringField('Densidade (g/ml)', validators=[Optional(), validate_decimal])
+    unit_weight_g = StringField('Peso por Unidade (g)', validators=[Optional(), validate_decimal])
     submit = SubmitField('Salvar Ingrediente')
     
 class RecipeForm(FlaskForm):
@@ -70,7 +84,7 @@ class UpdateProfileForm(FlaskForm):
         ('Hamburgueria', 'Hamburgueria'), ('Restaurante', 'Restaurante'), ('Lanchonete', 'Lanchonete'),
         ('Food Truck', 'Food Truck'), ('Outro', 'Outro')
     ], validators=[DataRequired()])
-    phone = StringField('Telefone / WhatsApp', validators=[Optional()])
+    phone = StringField('Telefone / WhatsApp', validators=[Optional(), validate_phone_number])
     submit = SubmitField('Salvar Alterações')
 
     def validate_email(self, email):
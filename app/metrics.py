@@ -0,0 +1,50 @@
+# Arquivo: app/metrics.py
+
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def observe(name, seconds):
+    """Regista uma duração: contagem, soma e máximo, por processo."""
+    with _lock:
+        count, total, maximum = _timings.get(name, (0, 0.0, 0.0))
+        _timings[name] = (count + 1, total + seconds, max(maximum, seconds))
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def snapshot():
+    """Cópia dos contadores e tempos atuais, no formato {'counters': {...}, 'timings': {nome: {...}}}."""
+    with _lock:
+        counters = dict(_counters)
+        timings = {name: {'count': count, 'sum': total, 'max': maximum}
+                   for name, (count, total, maximum) in _timings.items()}
+    return {'counters': counters, 'timings': timings}
+
+def render_text():
+    """Métricas em texto no formato de exposição do Prometheus."""
+    data = snapshot()
+    lines = [f"{name}_total {value}" for name, value in sorted(data['counters'].items())]
+    for name, timing in sorted(data['timings'].items()):
+        lines.append(f"{name}_seconds_count {timing['count']}")
+        lines.append(f"{name}_seconds_sum {timing['sum']:.6f}")
+        lines.append(f"{name}_seconds_max {timing['max']:.6f}")
+    return "\n".join(lines) + "\n"
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
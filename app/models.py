@@ -1,16 +1,27 @@
 from app import db # Apenas o 'db' é necessário aqui
 from flask_login import UserMixin
+from sqlalchemy import case, literal_column
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import validates
 from datetime import datetime
+from app.text import normalize_name, normalize_phone
 
 # A função @login_manager.user_loader foi REMOVIDA daqui.
 
 class RecipeIngredient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id'), nullable=False)
-    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredient.id'), nullable=False)
+    # Cada linha aponta para um ingrediente OU para outra receita usada como sub-receita (massa, creme, molho...).
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredient.id'), nullable=True, index=True)
+    sub_recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id'), nullable=True, index=True)
     quantity = db.Column(db.Float, nullable=False)
     unit_used = db.Column(db.String(20), nullable=False)
     ingredient = db.relationship('Ingredient')
+    sub_recipe = db.relationship('Recipe', foreign_keys=[sub_recipe_id])
+
+    @property
+    def component_name(self):
+        return self.sub_recipe.name if self.sub_recipe_id else self.ingredient.name
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -19,6 +30,8 @@ class User(db.Model, UserMixin):
     business_name = db.Column(db.String(100), nullable=False)
     business_type = db.Column(db.String(50), nullable=False)
     phone = db.Column(db.String(20), nullable=True)
+    # Telefone em E.164 ('+5511987654321'), usado para identificar o remetente no WhatsApp.
+    phone_e164 = db.Column(db.String(16), nullable=True, unique=True, index=True)
     password = db.Column(db.String(60), nullable=False)
     plan_type = db.Column(db.String(50), nullable=False, default='Trial')
     subscription_status = db.Column(db.String(50), nullable=False, default='trialing')
@@ -27,9 +40,15 @@ class User(db.Model, UserMixin):
     onboarding_complete = db.Column(db.Boolean, default=False)
     has_created_ingredient = db.Column(db.Boolean, default=False)
     has_created_recipe = db.Column(db.Boolean, default=False)
+    dashboard_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     ingredients = db.relationship('Ingredient', backref='author', lazy=True, cascade="all, delete-orphan")
     recipes = db.relationship('Recipe', backref='author', lazy=True, cascade="all, delete-orphan")
 
+    @validates('phone')
+    def set_phone_e164(self, key, phone):
+        self.phone_e164 = normalize_phone(phone)
+        return phone
+
     @property
     def is_subscription_active(self):
         if self.subscription_status == 'active': return True
@@ -49,12 +68,18 @@ class Ingredient(db.Model):
     package_unit = db.Column(db.String(10), nullable=False)
     base_price = db.Column(db.Float, nullable=False)
     base_unit = db.Column(db.String(10), nullable=False)
+    density = db.Column(db.Float, nullable=True)
+    unit_weight_g = db.Column(db.Float, nullable=True)
     price_history = db.relationship('PriceHistory', backref='ingredient', lazy=True, cascade="all, delete-orphan")
+    supplier_products = db.relationship('SupplierProduct', backref='ingredient', lazy=True, cascade="all, delete-orphan")
     last_alerted_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         return f"Ingredient('{self.name}', '{self.package_price}')"
 
+db.Index('ix_ingredient_user_id_base_price', Ingredient.user_id, Ingredient.base_price, Ingredient.id)
+db.Index('ix_ingredient_user_id_name', Ingredient.user_id, Ingredient.name, Ingredient.id)
+
 class PriceHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredient.id'), nullable=False)
@@ -63,12 +88,16 @@ class PriceHistory(db.Model):
     unit = db.Column(db.String(10), nullable=False)
     recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_price_history_ingredient_id_recorded_at', 'ingredient_id', 'recorded_at'),)
+
     def __repr__(self):
         return f"PriceHistory(Ingredient ID: {self.ingredient_id}, Price: {self.price}, Date: {self.recorded_at})"
 
 class Recipe(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
+    # Nome sem acentos e em minúsculas, para a procura por nome (WhatsApp); mantido por set_normalized_name.
+    normalized_name = db.Column(db.String(100), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     yield_quantity = db.Column(db.Float, nullable=True)
@@ -79,8 +108,173 @@ class Recipe(db.Model):
     cost_per_serving = db.Column(db.Float, nullable=True)
     profit_margin = db.Column(db.Float, nullable=True)
     sale_price = db.Column(db.Float, nullable=True)
-    ingredients = db.relationship('RecipeIngredient', backref='recipe', lazy='dynamic', cascade="all, delete-orphan")
+    ingredients = db.relationship('RecipeIngredient', backref='recipe', lazy='dynamic', cascade="all, delete-orphan",
+                                  foreign_keys='RecipeIngredient.recipe_id')
     preparation_steps = db.Column(db.Text, nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_recipe_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_recipe_user_id_normalized_name', 'user_id', 'normalized_name'),
+    )
+
+    @validates('name')
+    def set_normalized_name(self, key, name):
+        self.normalized_name = normalize_name(name)
+        return name
+
+    # Lucro e margem valem tanto no objeto como em SQL (ORDER BY, índices): receitas sem preço de venda contam 0.
+    # As constantes vão como literais, e não como parâmetros, para a expressão ser igual à dos índices.
+    @hybrid_property
+    def profit(self):
+        return self.sale_price - self.total_cost if self.sale_price else 0
+
+    @profit.expression
+    def profit(cls):
+        return case((cls.sale_price != literal_column('0'), cls.sale_price - cls.total_cost),
+                    else_=literal_column('0.0'))
+
+    @hybrid_property
+    def margin(self):
+        return self.profit / self.sale_price * 100 if self.sale_price and self.sale_price > 0 else 0
+
+    @margin.expression
+    def margin(cls):
+        return case((cls.sale_price > literal_column('0'), cls.profit / cls.sale_price * literal_column('100')),
+                    else_=literal_column('0.0'))
+
+    def __repr__(self):
+        return f"Recipe('{self.name}', 'Cost: {self.total_cost}')"
+
+# Índices dos relatórios: cada ordenação (custo, lucro, margem) lê só as linhas da página, na ordem do índice,
+# percorrido de trás para a frente nas ordenações decrescentes.
+db.Index('ix_recipe_user_id_total_cost', Recipe.user_id, Recipe.total_cost, Recipe.id)
+db.Index('ix_recipe_user_id_profit', Recipe.user_id, Recipe.profit, Recipe.id)
+db.Index('ix_recipe_user_id_margin', Recipe.user_id, Recipe.margin, Recipe.id)
+
+class OutboxJob(db.Model):
+    """Efeito colateral (e-mail, WhatsApp, relatório) gravado na mesma transação e executado pelo worker."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_outbox_job_status_run_at', 'status', 'run_at'),)
+
+    def __repr__(self):
+        return f"OutboxJob({self.id}, '{self.kind}', '{self.status}')"
+
+class JobRun(db.Model):
+    """
+    Uma execução de uma tarefa agendada. A restrição UNIQUE (name, scheduled_for) garante que, com vários
+    processos a agendar, só um fica com cada execução; os shards registam aqui o seu progresso.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    scheduled_for = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='scheduled')
+    shards_total = db.Column(db.Integer, nullable=False, default=1)
+    shards_done = db.Column(db.Integer, nullable=False, default=0)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    lag_seconds = db.Column(db.Float, nullable=True)
+    duration_seconds = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (db.UniqueConstraint('name', 'scheduled_for', name='uq_job_run_name_scheduled_for'),)
+
+    def __repr__(self):
+        return f"JobRun('{self.name}', {self.scheduled_for}, '{self.status}')"
+
+class JobRunShard(db.Model):
+    """
+    Shard concluído de uma execução. É gravado no mesmo commit que os e-mails do shard; a restrição UNIQUE
+    (run_id, shard) faz com que um shard repetido pelo outbox (reclamado por outro worker) não os grave outra vez.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('job_run.id'), nullable=False)
+    shard = db.Column(db.Integer, nullable=False)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    finished_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('run_id', 'shard', name='uq_job_run_shard_run_id_shard'),)
+
+    def __repr__(self):
+        return f"JobRunShard({self.run_id}, {self.shard})"
+
+class SupplierProduct(db.Model):
+    """Produto de um fornecedor (CNPJ do emitente + código na NF-e) que o utilizador já associou a um ingrediente."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    supplier_cnpj = db.Column(db.String(14), nullable=False)
+    product_code = db.Column(db.String(60), nullable=False)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredient.id'), nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'supplier_cnpj', 'product_code',
+                                          name='uq_supplier_product_user_supplier_code'),)
+
+    def __repr__(self):
+        return f"SupplierProduct('{self.supplier_cnpj}', '{self.product_code}', {self.ingredient_id})"
+
+class NFeBatch(db.Model):
+    """
+    Importação em lote de notas fiscais (lista de chaves ou zip de XMLs), processada pelo worker.
+    Guarda o progresso e o tempo de cada etapa para a página de acompanhamento.
+    """
+    __tablename__ = 'nfe_batch'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    source = db.Column(db.String(10), nullable=False)
+    # Chaves (uma por linha) ou o zip enviado; o zip é apagado quando o lote termina.
+    keys = db.Column(db.Text, nullable=True)
+    upload = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    duplicates = db.Column(db.Integer, nullable=False, default=0)
+    lines_applied = db.Column(db.Integer, nullable=False, default=0)
+    lines_unmapped = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text, nullable=True)
+    timings = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"NFeBatch({self.id}, '{self.status}', {self.processed}/{self.total})"
+
+class ImportedInvoice(db.Model):
+    """Nota fiscal já aplicada aos preços de um utilizador, para não a importar duas vezes."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    access_key = db.Column(db.String(44), nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey('nfe_batch.id'), nullable=True)
+    imported_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'access_key', name='uq_imported_invoice_user_access_key'),)
+
+    def __repr__(self):
+        return f"ImportedInvoice('{self.access_key}')"
+
+class StagedInvoice(db.Model):
+    """
+    NF-e lida e ainda por importar, entre a busca e a confirmação das associações. Fica no servidor para a
+    sessão (cookie) só levar o identificador; as linhas expiradas são apagadas nas novas gravações.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(32), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
     def __repr__(self):
-        return f"Recipe('{self.name}', 'Cost: {self.total_cost}')"
\ No newline at end of file
+        return f"StagedInvoice('{self.token}', {self.user_id})"
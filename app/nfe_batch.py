@@ -0,0 +1,260 @@
+# Arquivo: app/nfe_batch.py
+
+import io
+import json
+import logging
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from app import db, metrics, outbox
+from app.costing import apply_purchase_prices, purchase_unit_error
+from app.dashboard import invalidate_dashboard
+from app.models import ImportedInvoice, Ingredient, NFeBatch, SupplierProduct
+from app.nfe_client import buscar_nfe_por_chave, get_provider
+from app.nfe_matching import supplier_cnpj
+from app.nfe_xml import NFeXMLError, parse_nfe_xml, purchase_line
+
+logger = logging.getLogger(__name__)
+
+# Estados do lote, pela ordem das etapas.
+PENDING, READING, MATCHING, WRITING, DONE, FAILED = 'pending', 'reading', 'matching', 'writing', 'done', 'failed'
+FINISHED = (DONE, FAILED)
+
+MAX_INVOICES = 500
+MAX_XML_BYTES = 10 * 1024 * 1024
+MAX_ERRORS = 100
+BATCH_PROCESSES = 2
+BATCH_THREADS = 8
+BATCH_CHUNK_SIZE = 20
+
+def parse_access_keys(text):
+    """
+    Chaves de acesso (44 dígitos) de um texto colado pelo utilizador: uma por linha ou separadas por vírgula,
+    com ou sem espaços e pontos pelo meio. Devolve (chaves na ordem, sem repetições; linhas inválidas).
+    """
+    keys, invalid = [], []
+    for part in re.split(r'[,;\n]', str(text or '')):
+        if not part.strip():
+            continue
+        key = ''.join(c for c in part if c.isdigit())
+        if len(key) != 44:
+            invalid.append(part.strip())
+        elif key not in keys:
+            keys.append(key)
+    return keys, invalid
+
+def create_batch(user_id, keys=None, upload=None):
+    """
+    Grava o lote e o job do outbox que o processa, na sessão atual (o commit fica a cargo de quem chama).
+    O pedido web só guarda os dados; a leitura das notas e a gravação dos preços correm no worker.
+    """
+    batch = NFeBatch(user_id=user_id, status=PENDING, source='zip' if upload is not None else 'chaves',
+                     keys='\n'.join(keys or []) or None, upload=upload, total=len(keys or []))
+    db.session.add(batch)
+    db.session.flush()
+    outbox.enqueue('nfe_lote', {'batch_id': batch.id}, max_attempts=3)
+    metrics.increment('nfe_batch_created')
+    return batch
+
+def batch_errors(batch):
+    return json.loads(batch.errors) if batch.errors else []
+
+def batch_timings(batch):
+    return json.loads(batch.timings) if batch.timings else {}
+
+# --- LEITURA ---
+def _parse_xml_bytes(entry):
+    """Corre num processo do pool: recebe (nome, conteúdo) e devolve (nome, nota, erro)."""
+    name, data = entry
+    try:
+        return name, parse_nfe_xml(io.BytesIO(data)), None
+    except NFeXMLError as e:
+        return name, None, str(e)
+
+def read_zip(upload, processes=BATCH_PROCESSES):
+    """
+    Lê os XMLs de um zip em paralelo num pool de processos (a interpretação do XML ocupa o CPU e não
+    beneficia de threads). Devolve [(nome, nota ou None, erro ou None)] pela ordem do zip.
+    """
+    with zipfile.ZipFile(io.BytesIO(upload)) as archive:
+        entries = [info for info in archive.infolist()
+                   if not info.is_dir() and info.filename.lower().endswith('.xml')][:MAX_INVOICES]
+        results, readable = [], []
+        for info in entries:
+            if info.file_size > MAX_XML_BYTES:
+                results.append((info.filename, None, "Ficheiro demasiado grande para ser uma NF-e."))
+            else:
+                readable.append((info.filename, archive.read(info)))
+    if processes > 1 and len(readable) > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, len(readable))) as executor:
+            results += executor.map(_parse_xml_bytes, readable, chunksize=max(1, len(readable) // (processes * 4)))
+    else:
+        results += map(_parse_xml_bytes, readable)
+    return results
+
+def fetch_keys(app, keys, threads=BATCH_THREADS):
+    """
+    Busca as notas das chaves em paralelo, com várias threads a partilhar o pool de ligações e a cache do
+    fornecedor (a espera é quase toda de rede). Devolve [(chave, nota ou None, erro ou None)] pela ordem das chaves.
+    """
+    get_provider()
+
+    def fetch(key):
+        with app.app_context():
+            resultado = buscar_nfe_por_chave(key)
+        if resultado.get('sucesso'):
+            return key, resultado['dados'], None
+        return key, None, resultado.get('erro')
+
+    if threads > 1 and len(keys) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(keys))) as executor:
+            return list(executor.map(fetch, keys))
+    return [fetch(key) for key in keys]
+
+# --- PROCESSAMENTO ---
+class _Stages:
+    """Tempo de cada etapa do lote, gravado no próprio lote e nas métricas (nfe_batch_<etapa>)."""
+    def __init__(self, batch):
+        self.batch = batch
+        self.timings = batch_timings(batch)
+
+    def start(self, status):
+        self.batch.status = status
+        self._status, self._start = status, time.perf_counter()
+        db.session.commit()
+
+    def stop(self):
+        elapsed = time.perf_counter() - self._start
+        self.timings[self._status] = round(self.timings.get(self._status, 0) + elapsed, 3)
+        self.batch.timings = json.dumps(self.timings)
+        metrics.observe(f'nfe_batch_{self._status}', elapsed)
+
+@outbox.handler('nfe_lote')
+def processar_lote_nfe(payload):
+    """
+    Processa um lote de NF-e no worker: lê as notas (pool de processos para XMLs, threads para chaves),
+    descarta as repetidas e as já importadas, associa os produtos pelo mapa de fornecedor e grava os preços
+    em transações de NFE_BATCH_CHUNK_SIZE notas. Cada transação regista as notas importadas, por isso um lote
+    interrompido retoma de onde parou sem aplicar a mesma nota duas vezes.
+    Os erros ficam no próprio lote (status 'failed'); o job do outbox não volta a ser tentado.
+    """
+    batch = NFeBatch.query.get(payload.get('batch_id'))
+    if batch is None or batch.status in FINISHED:
+        return
+    if batch.started_at is None:
+        batch.started_at = datetime.utcnow()
+    try:
+        _process(current_app._get_current_object(), batch)
+    except Exception as e:
+        logger.exception("Falha no lote de NF-e %s.", batch.id)
+        db.session.rollback()
+        batch.status = FAILED
+        batch.errors = json.dumps(batch_errors(batch) + [{'nota': None, 'erro': f"Erro inesperado: {e}"}])
+        batch.finished_at = datetime.utcnow()
+        batch.upload = None
+        metrics.increment('nfe_batch_failed')
+
+def _process(app, batch):
+    config = app.config
+    stages = _Stages(batch)
+    errors = []
+
+    stages.start(READING)
+    if batch.source == 'zip':
+        lidas = read_zip(batch.upload, config.get('NFE_BATCH_PROCESSES', BATCH_PROCESSES))
+        batch.total = len(lidas)
+        invoices = []
+        for name, nfe, error in lidas:
+            key = ''.join(c for c in str((nfe or {}).get('chave') or '') if c.isdigit())
+            if nfe is not None and len(key) != 44:
+                error = "XML sem a chave de acesso da nota."
+            if error:
+                errors.append({'nota': name, 'erro': error})
+            else:
+                invoices.append((key, nfe))
+    else:
+        keys = (batch.keys or '').split()
+        batch.total = len(keys)
+        invoices = []
+        for key, nfe, error in fetch_keys(app, keys, config.get('NFE_BATCH_THREADS', BATCH_THREADS)):
+            if error:
+                errors.append({'nota': key, 'erro': error})
+            else:
+                invoices.append((key, nfe))
+    stages.stop()
+
+    stages.start(MATCHING)
+    # Repetidas dentro do lote e notas já importadas antes (uma consulta para todas as chaves).
+    unique = {}
+    for key, nfe in invoices:
+        unique.setdefault(key, nfe)
+    imported = {key for (key,) in db.session.query(ImportedInvoice.access_key).filter(
+        ImportedInvoice.user_id == batch.user_id, ImportedInvoice.access_key.in_(unique.keys()))} if unique else set()
+    batch.duplicates = len(invoices) - len(unique) + len(imported)
+    invoices = [(key, nfe) for key, nfe in unique.items() if key not in imported]
+    # Pela data de emissão: numa sequência de compras do mesmo ingrediente, fica o preço da mais recente.
+    invoices.sort(key=lambda item: str(item[1].get('dataEmissao') or ''))
+
+    mappings = remembered_mappings(batch.user_id, {supplier_cnpj(nfe) for _, nfe in invoices})
+    planned = []
+    unreadable = len(errors)
+    batch.lines_unmapped = 0
+    for key, nfe in invoices:
+        by_code = mappings.get(supplier_cnpj(nfe), {})
+        lines = []
+        for produto in nfe.get('produtos') or []:
+            code = str(produto.get('codigo'))
+            if code not in by_code:
+                batch.lines_unmapped += 1
+                continue
+            line = purchase_line(by_code[code], produto)
+            # Uma unidade sem conversão (SC, LATA...) fica registada no lote e não impede as outras linhas.
+            error = purchase_unit_error(line[3])
+            if error:
+                errors.append({'nota': key, 'erro': f"Produto {code}: {error}"})
+            else:
+                lines.append(line)
+        # Uma nota sem nenhum produto associado não fica marcada como importada: pode ser aplicada mais tarde.
+        if lines:
+            planned.append((key, lines))
+    batch.processed = unreadable + batch.duplicates + len(invoices) - len(planned)
+    batch.errors = json.dumps(errors[:MAX_ERRORS]) if errors else None
+    stages.stop()
+
+    stages.start(WRITING)
+    chunk_size = config.get('NFE_BATCH_CHUNK_SIZE', BATCH_CHUNK_SIZE)
+    for start in range(0, len(planned), chunk_size):
+        chunk = planned[start:start + chunk_size]
+        batch.lines_applied += apply_purchase_prices(batch.user_id, [line for _, lines in chunk for line in lines])
+        now = datetime.utcnow()
+        db.session.bulk_insert_mappings(ImportedInvoice, [
+            {'user_id': batch.user_id, 'access_key': key, 'batch_id': batch.id, 'imported_at': now}
+            for key, _ in chunk])
+        batch.processed += len(chunk)
+        invalidate_dashboard(batch.user_id)
+        db.session.commit()
+    stages.stop()
+
+    batch.status = DONE
+    batch.finished_at = datetime.utcnow()
+    batch.upload = None
+    metrics.increment('nfe_batch_invoices', len(planned))
+    logger.info("Lote de NF-e %s concluído: %d notas importadas, %d repetidas, %d com erro, %d linhas aplicadas.",
+                batch.id, len(planned), batch.duplicates, len(errors), batch.lines_applied)
+
+def remembered_mappings(user_id, cnpjs):
+    """{cnpj: {código do produto: ingredient_id}} das associações guardadas para estes fornecedores, numa consulta."""
+    cnpjs = {cnpj for cnpj in cnpjs if cnpj}
+    mappings = {}
+    if not cnpjs:
+        return mappings
+    for cnpj, code, ingredient_id in db.session.query(
+        SupplierProduct.supplier_cnpj, SupplierProduct.product_code, SupplierProduct.ingredient_id
+    ).join(Ingredient, SupplierProduct.ingredient_id == Ingredient.id).filter(
+        SupplierProduct.user_id == user_id, SupplierProduct.supplier_cnpj.in_(cnpjs), Ingredient.user_id == user_id
+    ):
+        mappings.setdefault(cnpj, {})[code] = ingredient_id
+    return mappings
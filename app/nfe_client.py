@@ -1,32 +1,195 @@
 # Arquivo: app/nfe_client.py
 
 import json
+import logging
 import os
+import tempfile
+import threading
+from collections import OrderedDict
+import requests
 from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app import metrics
+from app.nfe_xml import NFeXMLError, convert_pack, parse_nfe_xml
 
-def buscar_nfe_por_chave(chave_acesso):
+logger = logging.getLogger(__name__)
+
+class NFeNotFound(Exception):
+    pass
+
+class MockNFeProvider:
     """
-    Busca os dados de uma NF-e.
-    ATUALMENTE: Lê um ficheiro de exemplo local para simular a resposta da API.
-    FUTURAMENTE: Irá fazer uma chamada real à API do NFe.io.
+    Lê a nota de um ficheiro de exemplo local (por padrão static/mock_data/nfe_example.json).
+    O ficheiro é lido e interpretado uma única vez por processo.
     """
-    print(f"A 'buscar' dados para a chave de acesso: {chave_acesso}")
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._lock = threading.Lock()
 
-    try:
-        # Constrói o caminho para o nosso ficheiro de exemplo
-        caminho_ficheiro = os.path.join(current_app.root_path, 'static', 'mock_data', 'nfe_example.json')
+    def fetch(self, chave_acesso):
+        with self._lock:
+            if self._data is None:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+        return self._data
+
+class HttpNFeProvider:
+    """
+    Busca a nota num serviço HTTP (GET {base_url}/{chave}) que responde JSON no formato do ficheiro de exemplo
+    ou o XML oficial da NF-e, lido em streaming. Uma única sessão por processo, com pool de ligações, tempo limite
+    e novas tentativas para erros temporários.
+    """
+    def __init__(self, base_url, api_key=None, timeout=10, retries=3, pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers['Authorization'] = api_key
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=('GET',), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, chave_acesso):
+        response = self.session.get(f'{self.base_url}/{chave_acesso}', timeout=self.timeout, stream=True)
+        with response:
+            if response.status_code == 404:
+                raise NFeNotFound(chave_acesso)
+            response.raise_for_status()
+            if 'xml' in response.headers.get('Content-Type', ''):
+                response.raw.decode_content = True
+                return parse_nfe_xml(response.raw)
+            return response.json()
+
+class NFeCache:
+    """
+    Cache das notas já obtidas: LRU em memória e uma cópia em disco (um JSON por chave), partilhada entre
+    processos e reinícios. Uma nota emitida não muda, por isso as entradas não expiram.
+    """
+    def __init__(self, directory=None, max_size=256):
+        self.directory = directory
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                logger.warning("Cache de NF-e em disco desativada (%s): %s", directory, e)
+                self.directory = None
+
+    def _path(self, chave_acesso):
+        return os.path.join(self.directory, f'{chave_acesso}.json')
+
+    def get(self, chave_acesso):
+        with self._lock:
+            data = self._entries.get(chave_acesso)
+            if data is not None:
+                self._entries.move_to_end(chave_acesso)
+                return data
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(chave_acesso), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        self._remember(chave_acesso, data)
+        return data
+
+    def set(self, chave_acesso, data):
+        self._remember(chave_acesso, data)
+        if self.directory:
+            # Escreve num ficheiro temporário e troca de nome, para outro processo nunca ler um JSON a meio.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(chave_acesso))
 
-        with open(caminho_ficheiro, 'r', encoding='utf-8') as f:
-            dados_nfe = json.load(f)
-        
-        print("Dados do ficheiro de exemplo lidos com sucesso.")
+    def _remember(self, chave_acesso, data):
+        with self._lock:
+            self._entries[chave_acesso] = data
+            self._entries.move_to_end(chave_acesso)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+_provider = None
+_cache = None
+_setup_lock = threading.Lock()
+
+def get_provider():
+    """
+    Fornecedor do processo, criado na primeira utilização. NFE_PROVIDER escolhe 'http' (NFE_API_URL)
+    ou 'mock' (ficheiro de exemplo); sem configuração, usa 'http' apenas se NFE_API_URL estiver definido.
+    """
+    global _provider, _cache
+    if _provider is None:
+        with _setup_lock:
+            if _provider is None:
+                config = current_app.config
+                kind = config.get('NFE_PROVIDER') or ('http' if config.get('NFE_API_URL') else 'mock')
+                if kind == 'http':
+                    provider = HttpNFeProvider(config['NFE_API_URL'], config.get('NFE_API_KEY'),
+                                               timeout=config.get('NFE_TIMEOUT', 10),
+                                               retries=config.get('NFE_RETRIES', 3))
+                else:
+                    provider = MockNFeProvider(
+                        os.path.join(current_app.root_path, 'static', 'mock_data', 'nfe_example.json'))
+                _cache = NFeCache(config.get('NFE_CACHE_DIR') or os.path.join(current_app.instance_path, 'nfe_cache'),
+                                  config.get('NFE_CACHE_SIZE', 256))
+                _provider = provider
+    return _provider
+
+def buscar_nfe_por_chave(chave_acesso):
+    """
+    Busca os dados de uma NF-e pela chave de acesso, primeiro na cache e depois no fornecedor configurado.
+    Devolve {"sucesso": True, "dados": {...}} ou {"sucesso": False, "erro": "..."}.
+    """
+    chave_acesso = ''.join(c for c in str(chave_acesso or '') if c.isdigit())
+    if not chave_acesso:
+        return {"sucesso": False, "erro": "Chave de acesso inválida."}
+
+    provider = get_provider()
+    dados_nfe = _cache.get(chave_acesso)
+    if dados_nfe is not None:
+        metrics.increment('nfe_cache_hit')
         return {"sucesso": True, "dados": dados_nfe}
 
+    metrics.increment('nfe_cache_miss')
+    try:
+        with metrics.timed('nfe_fetch'):
+            dados_nfe = provider.fetch(chave_acesso)
+    except NFeNotFound:
+        return {"sucesso": False, "erro": "NF-e não encontrada para esta chave de acesso."}
+    except NFeXMLError as e:
+        logger.warning("NF-e %s com XML inválido: %s", chave_acesso, e)
+        return {"sucesso": False, "erro": str(e)}
     except FileNotFoundError:
-        erro_msg = "Ficheiro de simulação nfe_example.json não encontrado."
-        print(f"ERRO: {erro_msg}")
-        return {"sucesso": False, "erro": erro_msg}
+        logger.error("Ficheiro de simulação da NF-e não encontrado.")
+        return {"sucesso": False, "erro": "Ficheiro de simulação nfe_example.json não encontrado."}
+    except requests.RequestException as e:
+        logger.warning("Falha ao buscar a NF-e %s: %s", chave_acesso, e)
+        return {"sucesso": False, "erro": "Não foi possível consultar a NF-e agora. Tente novamente em instantes."}
     except Exception as e:
-        erro_msg = f"Ocorreu um erro inesperado ao ler o ficheiro de simulação: {e}"
-        print(f"ERRO: {erro_msg}")
-        return {"sucesso": False, "erro": erro_msg}
\ No newline at end of file
+        logger.exception("Erro inesperado ao buscar a NF-e %s.", chave_acesso)
+        return {"sucesso": False, "erro": f"Ocorreu um erro inesperado ao buscar a NF-e: {e}"}
+
+    dados_nfe = dict(dados_nfe, produtos=[convert_pack(p) for p in dados_nfe.get('produtos', [])])
+    # A nota de exemplo é igual para todas as chaves: não vale a pena guardá-la.
+    if not isinstance(provider, MockNFeProvider):
+        try:
+            _cache.set(chave_acesso, dados_nfe)
+        except OSError as e:
+            logger.warning("Não foi possível gravar a NF-e %s na cache em disco: %s", chave_acesso, e)
+    return {"sucesso": True, "dados": dados_nfe}
+
+def ler_nfe_xml(ficheiro):
+    """Lê uma NF-e enviada em XML. Devolve o mesmo formato de buscar_nfe_por_chave."""
+    try:
+        with metrics.timed('nfe_parse_xml'):
+            return {"sucesso": True, "dados": parse_nfe_xml(ficheiro)}
+    except NFeXMLError as e:
+        return {"sucesso": False, "erro": str(e)}
@@ -0,0 +1,166 @@
+# Arquivo: app/nfe_matching.py
+
+import re
+from datetime import datetime
+import numpy as np
+from scipy import sparse
+from app import db
+from app.models import Ingredient, SupplierProduct
+from app.search import NameIndexCache, trigrams
+from app.text import normalize_name
+
+# Acima disto o ingrediente já vem selecionado; entre as duas só é mostrado como sugestão.
+AUTO_MATCH_THRESHOLD = 0.75
+SUGGESTION_THRESHOLD = 0.45
+# Palavras que não ajudam a distinguir produtos ("farinha DE trigo").
+STOPWORDS = {'de', 'da', 'do', 'das', 'dos', 'com', 'e', 'em', 'a', 'o', 'p', 'c'}
+
+def tokens(normalized):
+    """Palavras significativas, no singular simples ('ovos' -> 'ovo')."""
+    words = set()
+    for word in re.findall(r'[a-z0-9]+', normalized):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s'):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+class IngredientMatcher:
+    """
+    Índice dos ingredientes de um utilizador para associar linhas de NF-e em lote. Cada nome vira um vetor binário
+    de trigramas e outro de palavras; uma nota inteira é comparada com todos os ingredientes com dois produtos de
+    matrizes (esparsa para os ingredientes, densa para as linhas da nota). A pontuação é o maior valor entre o coeficiente de Dice dos trigramas e a fração das palavras
+    do ingrediente presentes na descrição ("FARINHA DE TRIGO TIPO 1 SOL" contém "Farinha de Trigo").
+    """
+    def __init__(self, entries):
+        self.ids, self.names = [], []
+        self.gram_vocab, self.token_vocab = {}, {}
+        gram_rows, token_rows = [], []
+        for ingredient_id, name in entries:
+            normalized = normalize_name(name)
+            self.ids.append(ingredient_id)
+            self.names.append(name)
+            gram_rows.append([self.gram_vocab.setdefault(g, len(self.gram_vocab)) for g in trigrams(normalized)])
+            token_rows.append([self.token_vocab.setdefault(t, len(self.token_vocab)) for t in tokens(normalized)])
+        self.grams = self._matrix(gram_rows, len(self.gram_vocab))
+        self.gram_sizes = np.array([len(row) for row in gram_rows], dtype=np.float32)
+        self.tokens = self._matrix(token_rows, len(self.token_vocab))
+        self.token_sizes = np.array([len(row) for row in token_rows], dtype=np.float32)
+
+    @staticmethod
+    def _matrix(rows, width):
+        indptr = np.cumsum([0] + [len(row) for row in rows])
+        indices = np.fromiter((i for row in rows for i in row), dtype=np.int32, count=int(indptr[-1]))
+        return sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(len(rows), width))
+
+    @staticmethod
+    def _query(texts, vocab, extract):
+        """Matriz densa (vocabulário x textos) das características dos textos e o número de características de cada um."""
+        matrix = np.zeros((len(vocab), len(texts)), dtype=np.float32)
+        sizes = np.zeros(len(texts), dtype=np.float32)
+        for column, text in enumerate(texts):
+            features = extract(normalize_name(text))
+            sizes[column] = len(features)
+            matrix[[vocab[f] for f in features if f in vocab], column] = 1
+        return matrix, sizes
+
+    def scores(self, descriptions):
+        """Matriz (linhas da nota x ingredientes) com a pontuação de cada par, entre 0 e 1."""
+        if not self.ids or not descriptions:
+            return np.zeros((len(descriptions), len(self.ids)))
+        query, sizes = self._query(descriptions, self.gram_vocab, trigrams)
+        shared = (self.grams @ query).T
+        dice = 2 * shared / np.maximum(sizes[:, None] + self.gram_sizes[None, :], 1)
+        query, _ = self._query(descriptions, self.token_vocab, tokens)
+        shared = (self.tokens @ query).T
+        contained = shared / np.maximum(self.token_sizes[None, :], 1)
+        # Só conta como semelhança forte se o ingrediente tiver todas as palavras na descrição; entre esses, ganha
+        # o mais específico ("Leite Condensado" antes de "Leite" para "LEITE CONDENSADO MOCOCA").
+        specific = 0.9 + 0.01 * np.minimum(self.token_sizes, 5)[None, :]
+        contained = np.where(contained >= 1, specific, contained * 0.6)
+        return np.maximum(dice, contained)
+
+    def match(self, descriptions, limit=3):
+        """Para cada descrição, [(id, nome, pontuação)] dos `limit` ingredientes mais parecidos."""
+        scores = self.scores(descriptions)
+        results = []
+        for row in scores:
+            best = np.argpartition(-row, limit - 1)[:limit] if len(row) > limit else np.arange(len(row))
+            best = best[np.argsort(-row[best], kind='stable')]
+            results.append([(self.ids[i], self.names[i], float(row[i])) for i in best if row[i] > 0])
+        return results
+
+ingredient_matchers = NameIndexCache(
+    lambda user_id: db.session.query(Ingredient.id, Ingredient.name).filter(Ingredient.user_id == user_id).all(),
+    build=IngredientMatcher)
+
+def supplier_cnpj(nfe):
+    return ''.join(c for c in str((nfe.get('emitente') or {}).get('cnpj') or '') if c.isdigit())
+
+def match_invoice(user, nfe):
+    """
+    Sugere um ingrediente para cada produto da nota. Os produtos que o utilizador já associou antes
+    (mesmo CNPJ e código) vêm do mapa de fornecedor numa consulta; os restantes, do índice de nomes.
+    Devolve, por produto, {'ingredient_id', 'name', 'score', 'source'} com source 'fornecedor', 'nome' ou None.
+    """
+    produtos = nfe.get('produtos') or []
+    cnpj = supplier_cnpj(nfe)
+    codes = {str(p.get('codigo')) for p in produtos if p.get('codigo')}
+    remembered = {}
+    if cnpj and codes:
+        remembered = {code: (ingredient_id, name) for code, ingredient_id, name in db.session.query(
+            SupplierProduct.product_code, Ingredient.id, Ingredient.name
+        ).join(Ingredient, SupplierProduct.ingredient_id == Ingredient.id).filter(
+            SupplierProduct.user_id == user.id, SupplierProduct.supplier_cnpj == cnpj,
+            SupplierProduct.product_code.in_(codes), Ingredient.user_id == user.id)}
+
+    pending = [i for i, p in enumerate(produtos) if str(p.get('codigo')) not in remembered]
+    by_line = {}
+    if pending:
+        matches = ingredient_matchers.get(user).match([produtos[i].get('descricao', '') for i in pending])
+        by_line = dict(zip(pending, matches))
+
+    results = []
+    for i, produto in enumerate(produtos):
+        code = str(produto.get('codigo'))
+        if code in remembered:
+            ingredient_id, name = remembered[code]
+            results.append({'ingredient_id': ingredient_id, 'name': name, 'score': 1.0, 'source': 'fornecedor'})
+            continue
+        candidates = by_line.get(i) or []
+        best = candidates[0] if candidates else None
+        # Dois ingredientes empatados não são associados automaticamente.
+        tied = len(candidates) > 1 and candidates[1][2] >= best[2]
+        if best and best[2] >= SUGGESTION_THRESHOLD:
+            source = 'nome' if best[2] >= AUTO_MATCH_THRESHOLD and not tied else None
+            results.append({'ingredient_id': best[0] if source else None, 'name': best[1], 'score': best[2],
+                            'source': source})
+        else:
+            results.append({'ingredient_id': None, 'name': None, 'score': 0.0, 'source': None})
+    return results
+
+def remember_supplier_products(user_id, cnpj, associations):
+    """
+    Guarda as associações (código do produto -> ingrediente) feitas numa importação, para que a próxima nota
+    do mesmo fornecedor já venha associada. Atualiza as existentes e insere as novas em lote.
+    O commit fica a cargo de quem chama.
+    """
+    associations = {str(code): ingredient_id for code, ingredient_id in associations.items() if code}
+    if not cnpj or not associations:
+        return 0
+    now = datetime.utcnow()
+    existing = {code: (row_id, ingredient_id) for row_id, code, ingredient_id in db.session.query(
+        SupplierProduct.id, SupplierProduct.product_code, SupplierProduct.ingredient_id
+    ).filter(SupplierProduct.user_id == user_id, SupplierProduct.supplier_cnpj == cnpj,
+             SupplierProduct.product_code.in_(associations.keys()))}
+    db.session.bulk_update_mappings(SupplierProduct, [
+        {'id': existing[code][0], 'ingredient_id': ingredient_id, 'updated_at': now}
+        for code, ingredient_id in associations.items() if code in existing and existing[code][1] != ingredient_id
+    ])
+    db.session.bulk_insert_mappings(SupplierProduct, [
+        {'user_id': user_id, 'supplier_cnpj': cnpj, 'product_code': code, 'ingredient_id': ingredient_id,
+         'updated_at': now}
+        for code, ingredient_id in associations.items() if code not in existing
+    ])
+    return len(associations)
@@ -0,0 +1,40 @@
+# Arquivo: app/nfe_staging.py
+
+import json
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db, metrics
+from app.models import StagedInvoice
+
+STAGING_TTL_MINUTES = 60
+
+def stage_invoice(user_id, data):
+    """
+    Guarda a nota lida (produtos, fornecedor...) no servidor e devolve o identificador a pôr na sessão.
+    Aproveita a escrita para apagar as notas expiradas de todos os utilizadores (um DELETE pelo índice
+    de expires_at). O commit fica a cargo de quem chama.
+    """
+    now = datetime.utcnow()
+    ttl = timedelta(minutes=current_app.config.get('NFE_STAGING_TTL_MINUTES', STAGING_TTL_MINUTES))
+    purged = StagedInvoice.query.filter(StagedInvoice.expires_at < now).delete(synchronize_session=False)
+    if purged:
+        metrics.increment('nfe_staging_expired', purged)
+    token = uuid.uuid4().hex
+    db.session.add(StagedInvoice(token=token, user_id=user_id, data=json.dumps(data, ensure_ascii=False),
+                                 created_at=now, expires_at=now + ttl))
+    return token
+
+def load_staged(user_id, token):
+    """A nota guardada com este identificador, ou None se não existir, tiver expirado ou for de outro utilizador."""
+    if not token:
+        return None
+    row = db.session.query(StagedInvoice.data).filter(
+        StagedInvoice.token == token, StagedInvoice.user_id == user_id,
+        StagedInvoice.expires_at >= datetime.utcnow()).first()
+    return json.loads(row.data) if row else None
+
+def discard_staged(user_id, token):
+    """Apaga a nota guardada (depois de importada ou substituída). O commit fica a cargo de quem chama."""
+    if token:
+        StagedInvoice.query.filter_by(token=token, user_id=user_id).delete(synchronize_session=False)
@@ -0,0 +1,135 @@
+# Arquivo: app/nfe_xml.py
+
+import re
+import xml.etree.ElementTree as ET
+from app.units import UNITS, normalize_unit
+
+# Unidades comerciais que são embalagens: a quantidade real está na unidade tributável ou na descrição.
+PACK_UNITS = {'cx', 'caixa', 'fd', 'fardo', 'pct', 'pacote', 'emb', 'bandeja', 'bdj'}
+# "CX C/ 30", "CAIXA COM 12 UN", "FD 1X12", "CX 27UN"
+_PACK_SIZE = re.compile(r'(?:c/|com|x|cx|caixa|fd|fardo|pct|pacote)\s*(\d+)\s*(?:un|und|unid|unidades)?\b')
+
+class NFeXMLError(ValueError):
+    pass
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _children(elem):
+    return {_local(child.tag): (child.text or '').strip() for child in elem}
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def convert_pack(produto, unidade_tributavel=None, quantidade_tributavel=None):
+    """
+    Converte linhas compradas em dúzias ou embalagens (caixa, fardo, pacote...) para a quantidade real:
+    2 DZ passam a 24 UN e 3 CX com 30 ovos a 90 UN, com o preço unitário recalculado a partir do total.
+    Para embalagens, usa a unidade tributável da nota quando é uma unidade real (g, kg, l, un...) ou o tamanho
+    escrito na descrição ("CX C/ 30"). Sem nenhum dos dois, cada embalagem conta como uma unidade.
+    Devolve um novo dicionário; as linhas noutras unidades são devolvidas sem alterações.
+    """
+    unidade = normalize_unit(produto.get('unidade'))
+    if unidade in UNITS and unidade != 'dz':
+        return produto
+    quantidade = _float(produto.get('quantidade'))
+    total = _float(produto.get('valorTotal')) or quantidade * _float(produto.get('valorUnitario'))
+
+    nova_unidade, nova_quantidade = 'UN', quantidade
+    if unidade == 'dz':
+        nova_quantidade = quantidade * 12
+    elif unidade in PACK_UNITS:
+        tributavel = normalize_unit(unidade_tributavel)
+        tamanho = _PACK_SIZE.search(str(produto.get('descricao', '')).lower())
+        if tributavel in UNITS and _float(quantidade_tributavel) > 0 and tributavel not in PACK_UNITS:
+            nova_unidade, nova_quantidade = tributavel.upper(), _float(quantidade_tributavel)
+            if tributavel == 'dz':
+                nova_unidade, nova_quantidade = 'UN', nova_quantidade * 12
+        elif tamanho and int(tamanho.group(1)) > 0:
+            nova_quantidade = quantidade * int(tamanho.group(1))
+    else:
+        return produto
+
+    convertido = dict(produto, unidade=nova_unidade, quantidade=nova_quantidade,
+                      unidadeComercial=produto.get('unidade'), quantidadeComercial=quantidade)
+    if nova_quantidade > 0:
+        convertido['valorUnitario'] = total / nova_quantidade
+    convertido['valorTotal'] = total
+    return convertido
+
+def _product(det):
+    prod = next((child for child in det if _local(child.tag) == 'prod'), None)
+    if prod is None:
+        raise NFeXMLError(f"Item {det.get('nItem')} da NF-e sem o grupo <prod>.")
+    campos = _children(prod)
+    produto = {
+        'numeroItem': det.get('nItem'),
+        'descricao': campos.get('xProd', ''),
+        'codigo': campos.get('cProd', ''),
+        'ncm': campos.get('NCM', ''),
+        'cfop': campos.get('CFOP', ''),
+        'unidade': campos.get('uCom', ''),
+        'quantidade': _float(campos.get('qCom')),
+        'valorUnitario': _float(campos.get('vUnCom')),
+        'valorTotal': _float(campos.get('vProd')),
+    }
+    return convert_pack(produto, campos.get('uTrib'), campos.get('qTrib'))
+
+def iter_nfe_xml(source, header=None):
+    """
+    Lê uma NF-e no XML oficial (nfeProc/NFe/infNFe) de forma incremental e gera os produtos (grupos <det>) à medida
+    que aparecem, no mesmo formato da API JSON. Cada elemento já processado é retirado da árvore, por isso a memória
+    não cresce com o tamanho da nota. Os dados do cabeçalho (número, emitente, destinatário, total) são gravados
+    em `header`. `source` é um caminho ou um objeto de ficheiro binário.
+    """
+    header = {} if header is None else header
+    parents = []
+    try:
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            tag = _local(elem.tag)
+            if tag == 'det':
+                yield _product(elem)
+            elif tag == 'ide':
+                campos = _children(elem)
+                header.update(numero=campos.get('nNF', ''), serie=campos.get('serie', ''),
+                              dataEmissao=campos.get('dhEmi') or campos.get('dEmi', ''))
+            elif tag in ('emit', 'dest'):
+                campos = _children(elem)
+                header['emitente' if tag == 'emit' else 'destinatario'] = {
+                    'nome': campos.get('xNome', ''), 'cnpj': campos.get('CNPJ') or campos.get('CPF', '')}
+            elif tag == 'ICMSTot':
+                header['valorTotal'] = _float(_children(elem).get('vNF'))
+            elif tag == 'infNFe':
+                header['chave'] = (elem.get('Id') or '').replace('NFe', '')
+            else:
+                continue
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+    except ET.ParseError as e:
+        raise NFeXMLError(f"XML da NF-e inválido: {e}")
+
+def parse_nfe_xml(source):
+    """NF-e completa (cabeçalho e lista de produtos) no formato da API JSON."""
+    header = {}
+    produtos = list(iter_nfe_xml(source, header))
+    if not header.get('emitente') and not produtos:
+        raise NFeXMLError("O ficheiro não parece ser uma NF-e.")
+    return dict(header, produtos=produtos)
+
+def purchase_line(ingredient_id, produto):
+    """
+    Linha (ingredient_id, preço, quantidade, unidade) para costing.apply_purchase_prices: a linha inteira da nota é
+    a embalagem comprada, ou seja, o preço total pela quantidade total (já convertida por convert_pack).
+    """
+    produto = convert_pack(produto)
+    quantidade = _float(produto.get('quantidade'))
+    preco = _float(produto.get('valorTotal')) or _float(produto.get('valorUnitario')) * quantidade
+    return (ingredient_id, preco, quantidade, str(produto.get('unidade')).lower())
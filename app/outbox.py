@@ -0,0 +1,183 @@
+# Arquivo: app/outbox.py
+
+import json
+import logging
+import random
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from app import db, metrics
+from app.models import OutboxJob
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+# Um job 'running' há mais tempo do que isto pertencia a um worker que morreu e volta a ser reclamável.
+LEASE_TIMEOUT = timedelta(minutes=10)
+
+_handlers = {}
+
+def handler(kind, batch=False):
+    """
+    Regista a função que executa os jobs de um tipo. Com batch=True a função recebe a lista de payloads
+    reclamados juntos e devolve uma lista com None (sucesso) ou o erro de cada um.
+    A entrega é "pelo menos uma vez": um job cujo worker morreu (ou que passou de LEASE_TIMEOUT a correr) volta
+    a ser executado por outro worker, por isso o handler tem de poder repetir o mesmo payload sem efeitos em dobro.
+    """
+    def decorator(f):
+        _handlers[kind] = (f, batch)
+        return f
+    return decorator
+
+def enqueue(kind, payload=None, run_at=None, max_attempts=5):
+    """Adiciona um job à sessão atual; é gravado no commit da própria escrita que o originou."""
+    job = OutboxJob(kind=kind, payload=json.dumps(payload or {}), status=PENDING,
+                    run_at=run_at or datetime.utcnow(), max_attempts=max_attempts)
+    db.session.add(job)
+    metrics.increment('outbox_enqueued')
+    return job
+
+def enqueue_many(kind, payloads, max_attempts=5):
+    """Insere vários jobs do mesmo tipo num único INSERT em lote."""
+    now = datetime.utcnow()
+    rows = [dict(kind=kind, payload=json.dumps(payload), status=PENDING, attempts=0, max_attempts=max_attempts,
+                 run_at=now, created_at=now) for payload in payloads]
+    if rows:
+        db.session.bulk_insert_mappings(OutboxJob, rows)
+        metrics.increment('outbox_enqueued', len(rows))
+    return len(rows)
+
+def claim_jobs(limit=50, now=None):
+    """
+    Reclama até `limit` jobs prontos com SELECT ... FOR UPDATE SKIP LOCKED, para que vários workers
+    possam correr ao mesmo tempo sem pegar no mesmo job.
+    """
+    now = now or datetime.utcnow()
+    ready = and_(OutboxJob.status == PENDING, OutboxJob.run_at <= now)
+    abandoned = and_(OutboxJob.status == RUNNING, OutboxJob.locked_at < now - LEASE_TIMEOUT)
+    jobs = OutboxJob.query.filter(or_(ready, abandoned)).order_by(
+        OutboxJob.run_at, OutboxJob.id
+    ).limit(limit).with_for_update(skip_locked=True).all()
+    for job in jobs:
+        job.status = RUNNING
+        job.locked_at = now
+        job.attempts += 1
+    db.session.commit()
+    return jobs
+
+def renew_leases(jobs, claimed_at, now=None):
+    """
+    Renova o lease dos jobs imediatamente antes de os executar, para que o tempo passado à espera na fila do
+    lote não conte para LEASE_TIMEOUT. Só ficam os jobs que ainda têm o lease desta reclamação (`claimed_at`);
+    os que outro worker já reclamou como abandonados são devolvidos à parte e não devem ser executados.
+    Devolve (jobs renovados, jobs perdidos).
+    """
+    now = now or datetime.utcnow()
+    ids = [job.id for job in jobs]
+    owned = {job_id for (job_id,) in db.session.query(OutboxJob.id).filter(
+        OutboxJob.id.in_(ids), OutboxJob.status == RUNNING, OutboxJob.locked_at == claimed_at
+    ).with_for_update(skip_locked=True)}
+    if owned:
+        OutboxJob.query.filter(OutboxJob.id.in_(owned)).update({OutboxJob.locked_at: now}, synchronize_session=False)
+    db.session.commit()
+    return [job for job in jobs if job.id in owned], [job for job in jobs if job.id not in owned]
+
+def backoff(attempts):
+    """Espera exponencial (30s, 1min, 2min... até 1h) com um pouco de jitter."""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+def finish(job, error=None):
+    now = datetime.utcnow()
+    job.locked_at = None
+    if error is None:
+        job.status, job.completed_at, job.last_error = DONE, now, None
+        metrics.increment('outbox_done')
+    elif job.attempts >= job.max_attempts:
+        job.status, job.completed_at, job.last_error = FAILED, now, str(error)
+        metrics.increment('outbox_failed')
+        logger.error("Job %s (%s) falhou definitivamente após %d tentativas: %s", job.id, job.kind, job.attempts, error)
+    else:
+        job.status, job.run_at, job.last_error = PENDING, now + backoff(job.attempts), str(error)
+        metrics.increment('outbox_retried')
+        logger.warning("Job %s (%s) falhou (tentativa %d), nova tentativa às %s: %s",
+                       job.id, job.kind, job.attempts, job.run_at, error)
+
+def process_batch(limit=50):
+    """
+    Reclama e executa um lote de jobs. Devolve quantos foram processados.
+    Os jobs correm um a um e cada um renova o lease ao começar (renew_leases): um job no fim de um lote lento
+    não é dado como abandonado enquanto espera pela sua vez.
+    """
+    claimed_at = datetime.utcnow()
+    jobs = claim_jobs(limit, claimed_at)
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+
+    for kind, group in by_kind.items():
+        entry = _handlers.get(kind)
+        if entry is None:
+            for job in group:
+                finish(job, f"Tipo de job desconhecido: '{kind}'.")
+            db.session.commit()
+            continue
+
+        func, batch = entry
+        if batch:
+            group = _owned(group, claimed_at)
+            if not group:
+                continue
+            with metrics.timed(f'outbox_{kind}'):
+                try:
+                    errors = func([json.loads(job.payload) for job in group])
+                except Exception as e:
+                    db.session.rollback()
+                    errors = [e] * len(group)
+            for job, error in zip(group, errors):
+                finish(job, error)
+            db.session.commit()
+        else:
+            for job in group:
+                if not _owned([job], claimed_at):
+                    continue
+                # O que o handler gravar na sessão é confirmado no mesmo commit que marca o job como feito.
+                with metrics.timed(f'outbox_{kind}'):
+                    try:
+                        func(json.loads(job.payload))
+                        error = None
+                    except Exception as e:
+                        logger.exception("Erro no job %s (%s).", job.id, kind)
+                        db.session.rollback()
+                        error = e
+                finish(job, error)
+                db.session.commit()
+    return len(jobs)
+
+def _owned(jobs, claimed_at):
+    owned, lost = renew_leases(jobs, claimed_at)
+    for job in lost:
+        metrics.increment('outbox_lease_lost')
+        logger.warning("Job %s (%s) foi reclamado por outro worker antes de começar; não é executado aqui.",
+                       job.id, job.kind)
+    return owned
+
+def run_worker(app, stop_event=None, poll_interval=2.0, batch_size=50):
+    """Ciclo principal do worker: processa lotes enquanto houver trabalho e dorme quando a fila está vazia."""
+    stop_event = stop_event or threading.Event()
+    logger.info("Worker do outbox iniciado (lotes de %d, intervalo %.1fs).", batch_size, poll_interval)
+    while not stop_event.is_set():
+        with app.app_context():
+            try:
+                processed = process_batch(batch_size)
+            except Exception:
+                logger.exception("Erro ao processar o outbox.")
+                db.session.rollback()
+                processed = 0
+            finally:
+                db.session.remove()
+        if not processed:
+            stop_event.wait(poll_interval)
+    logger.info("Worker do outbox terminado.")
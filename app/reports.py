@@ -0,0 +1,57 @@
+# Arquivo: app/reports.py
+
+from app import db
+from app.dashboard import keyset_page
+from app.models import Ingredient, Recipe
+
+RECIPES_PER_PAGE = 25
+CHART_DEFAULT, CHART_MAX = 5, 50
+
+# Ordenação -> (chave, decrescente). O desempate pelo id segue o mesmo sentido, para o ORDER BY ser
+# exatamente o dos índices (user_id, chave, id) e a base de dados ler só as linhas pedidas.
+RECIPE_SORTS = {
+    'cost_desc': (Recipe.total_cost, True),
+    'cost_asc': (Recipe.total_cost, False),
+    'profit_desc': (Recipe.profit, True),
+    'margin_desc': (Recipe.margin, True),
+}
+
+def recipe_order(sort):
+    key, descending = RECIPE_SORTS.get(sort, RECIPE_SORTS['cost_desc'])
+    return (key.desc(), Recipe.id.desc()) if descending else (key.asc(), Recipe.id.asc())
+
+def ingredient_order(sort):
+    if sort == 'desc':
+        return (Ingredient.base_price.desc(), Ingredient.id.desc())
+    return (Ingredient.base_price.asc(), Ingredient.id.asc())
+
+def parse_limit(value, default=CHART_DEFAULT):
+    """Número de itens de um gráfico ('5', '10'...), sempre entre 1 e CHART_MAX."""
+    value = str(value or '')
+    return max(1, min(int(value), CHART_MAX)) if value.isdigit() else default
+
+def recipe_chart(user_id, sort, limit):
+    """(nomes, custos, preços de venda) das `limit` primeiras receitas na ordenação escolhida."""
+    rows = db.session.query(Recipe.name, Recipe.total_cost, Recipe.sale_price).filter(
+        Recipe.user_id == user_id).order_by(*recipe_order(sort)).limit(limit).all()
+    return ([name for name, _, _ in rows], [round(cost or 0, 2) for _, cost, _ in rows],
+            [round(sale_price or 0, 2) for _, _, sale_price in rows])
+
+def ingredient_chart(user_id, sort, limit):
+    """(nomes, preços base) dos `limit` primeiros ingredientes por preço base."""
+    rows = db.session.query(Ingredient.name, Ingredient.base_price).filter(
+        Ingredient.user_id == user_id).order_by(*ingredient_order(sort)).limit(limit).all()
+    return [name for name, _ in rows], [round(base_price, 4) if base_price else 0 for _, base_price in rows]
+
+def recipe_page(user_id, sort, after=None, per_page=RECIPES_PER_PAGE):
+    """
+    Receitas de uma página da tabela, só com as colunas mostradas, a começar depois do cursor `after`.
+    A página segue o índice (user_id, chave, id) da ordenação, por isso custa o mesmo em qualquer posição.
+    Devolve (linhas, cursor da página seguinte ou None).
+    """
+    key, descending = RECIPE_SORTS.get(sort, RECIPE_SORTS['cost_desc'])
+    query = db.session.query(
+        Recipe.id, Recipe.name, Recipe.total_cost, Recipe.sale_price,
+        Recipe.profit.label('profit'), Recipe.margin.label('margin'), key.label('sort_key')
+    ).filter(Recipe.user_id == user_id)
+    return keyset_page(query, Recipe, key, descending, after, per_page)
@@ -1,20 +1,31 @@
 import stripe
-from flask import render_template, redirect, url_for, flash, request, Blueprint, abort, session, current_app, Response
+from flask import render_template, redirect, url_for, flash, request, Blueprint, abort, session, current_app, Response, jsonify, stream_with_context
 from app import db, bcrypt
-from app.models import User, Ingredient, Recipe, PriceHistory, RecipeIngredient
+from app.models import User, Ingredient, Recipe, PriceHistory, RecipeIngredient, NFeBatch
 from app.forms import RegistrationForm, LoginForm, IngredientForm, RecipeForm, UpdateProfileForm, ChangePasswordForm
 from app.email import send_cost_alert_email
-from app.nfe_client import buscar_nfe_por_chave
+from app.nfe_client import buscar_nfe_por_chave, ler_nfe_xml
+from app.nfe_xml import purchase_line
+from app.nfe_matching import match_invoice, remember_supplier_products, supplier_cnpj
+from app.nfe_staging import discard_staged, load_staged, stage_invoice
+from app.simulator import PriceScenarioMatrix, parse_scenarios
+from app.search import recipe_name_indexes
+from app.dashboard import (LIST_MAX_PAGE_SIZE, LIST_PAGE_SIZE, dashboard_snapshot, ingredient_list_page,
+                           invalidate_dashboard, recent_cost_alerts, recipe_list_page)
+from app.reports import ingredient_chart, parse_limit, recipe_chart, recipe_page
+from app import exports, metrics, nfe_batch, whatsapp
+from app.costing import (apply_purchase_prices, calculate_base_price, ingredient_cost_basis, parse_recipe_form_lines,
+                         price_recipe_lines, propagate_price_changes, purchase_unit_error, recipe_cost_state,
+                         recipe_line_cost, save_recipe_costing)
+from app.units import UnitConversionError
 from flask_login import login_user, logout_user, login_required, current_user
-from sqlalchemy import func
 import re
 import json
 import os
 from datetime import datetime, timedelta
 from functools import wraps
 import io
-import csv
-from twilio.rest import Client
+import zipfile
 
 main = Blueprint('main', __name__)
 
@@ -54,78 +65,19 @@ def subscription_required(f):
 def whatsapp_webhook():
     remetente = request.form.get('From')
     mensagem_recebida = request.form.get('Body', '').lower().strip()
-    resposta = ""
 
-    print(f"--- MENSAGEM DO WHATSAPP RECEBIDA ---\nDe: {remetente}\nMensagem: {mensagem_recebida}\n------------------------------------")
+    current_app.logger.debug("Mensagem do WhatsApp recebida de %s: %s", remetente, mensagem_recebida)
 
-    numero_telefone = remetente.split(':')[-1] if ':' in remetente else remetente
-    user = User.query.filter_by(phone=numero_telefone).first()
+    user = whatsapp.resolve_sender(remetente)
 
     if not user:
         resposta = "Olá! Não consegui encontrar o seu utilizador. Verifique se o número de telemóvel está registado corretamente no seu perfil LucroNaMesa."
     else:
-        # --- LÓGICA DE MÚLTIPLOS COMANDOS ---
-        if mensagem_recebida.startswith('custo '):
-            nome_receita = mensagem_recebida.replace('custo ', '').strip()
-            receita = Recipe.query.filter(func.lower(Recipe.name) == func.lower(nome_receita), Recipe.user_id == user.id).first()
-            if receita:
-                resposta = (f"Olá, {user.full_name.split()[0]}!\n\n"
-                            f"O custo total da sua receita *'{receita.name}'* é de *R$ {receita.total_cost:.2f}*.")
-            else:
-                resposta = f"Desculpe, não encontrei a receita com o nome '{nome_receita}'. Por favor, verifique o nome exato."
-
-        elif mensagem_recebida.startswith('venda '):
-            nome_receita = mensagem_recebida.replace('venda ', '').strip()
-            receita = Recipe.query.filter(func.lower(Recipe.name) == func.lower(nome_receita), Recipe.user_id == user.id).first()
-            if receita:
-                resposta = (f"Olá, {user.full_name.split()[0]}!\n\n"
-                            f"O preço de venda sugerido para *'{receita.name}'* é de *R$ {receita.sale_price:.2f}*.")
-            else:
-                resposta = f"Desculpe, não encontrei a receita com o nome '{nome_receita}'. Por favor, verifique o nome exato."
-
-        elif mensagem_recebida.startswith('lucro '):
-            nome_receita = mensagem_recebida.replace('lucro ', '').strip()
-            receita = Recipe.query.filter(func.lower(Recipe.name) == func.lower(nome_receita), Recipe.user_id == user.id).first()
-            if receita:
-                lucro = (receita.sale_price or 0) - (receita.total_cost or 0)
-                resposta = (f"Olá, {user.full_name.split()[0]}!\n\n"
-                            f"O lucro estimado para *'{receita.name}'* é de *R$ {lucro:.2f}*.")
-            else:
-                resposta = f"Desculpe, não encontrei a receita com o nome '{nome_receita}'. Por favor, verifique o nome exato."
-
-        elif mensagem_recebida.startswith('ingredientes '):
-            nome_receita = mensagem_recebida.replace('ingredientes ', '').strip()
-            receita = Recipe.query.filter(func.lower(Recipe.name) == func.lower(nome_receita), Recipe.user_id == user.id).first()
-            if receita:
-                resposta = f"Ingredientes para a receita *'{receita.name}'*:\n\n"
-                for item in receita.ingredients:
-                    resposta += f"- {item.ingredient.name}: {item.quantity} {item.unit_used}\n"
-            else:
-                resposta = f"Desculpe, não encontrei a receita com o nome '{nome_receita}'. Por favor, verifique o nome exato."
-        
-        else:
-            # Mensagem de ajuda atualizada
-            resposta = (f"Olá, {user.full_name.split()[0]}! Comandos disponíveis:\n\n"
-                        "➡️ *custo [nome da receita]*\n"
-                        "➡️ *venda [nome da receita]*\n"
-                        "➡️ *lucro [nome da receita]*\n"
-                        "➡️ *ingredientes [nome da receita]*")
-
-    # Envia a resposta de volta
-    try:
-        account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
-        auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
-        client = Client(account_sid, auth_token)
-        message = client.messages.create(
-                              body=resposta,
-                              from_=request.form.get('To'),
-                              to=remetente
-                          )
-        print(f"Resposta enviada com sucesso! SID: {message.sid}")
-    except Exception as e:
-        print(f"ERRO ao enviar resposta via Twilio: {e}")
+        resposta = whatsapp.handle_message(user, mensagem_recebida)
 
-    return '', 200
+    # Responde na própria resposta HTTP (TwiML): nenhuma chamada de saída à Twilio prende o worker.
+    current_app.logger.debug("Resposta do WhatsApp para %s: %s", remetente, resposta)
+    return Response(whatsapp.twiml_reply(resposta), mimetype='application/xml')
 
 # --- ROTAS DE NF-e ---
 @main.route('/nfe/importar', methods=['GET', 'POST'])
@@ -133,67 +85,74 @@ def whatsapp_webhook():
 @subscription_required
 def importar_nfe():
     resultado = None
+    associacoes = []
     ingredientes_utilizador = Ingredient.query.filter_by(author=current_user).order_by(Ingredient.name).all()
 
     if request.method == 'POST':
         action = request.form.get('action')
 
-        if action == 'buscar_nfe':
-            chave_acesso = request.form.get('chave_acesso')
-            if chave_acesso:
-                resultado = buscar_nfe_por_chave(chave_acesso)
-                if resultado and resultado.get('sucesso'):
-                    session['nfe_produtos'] = resultado['dados']['produtos']
+        if action in ('buscar_nfe', 'enviar_xml'):
+            if action == 'buscar_nfe':
+                chave_acesso = request.form.get('chave_acesso')
+                if chave_acesso:
+                    resultado = buscar_nfe_por_chave(chave_acesso)
+                else:
+                    flash('Por favor, insira uma chave de acesso.', 'warning')
             else:
-                flash('Por favor, insira uma chave de acesso.', 'warning')
+                arquivo_xml = request.files.get('arquivo_xml')
+                if arquivo_xml and arquivo_xml.filename:
+                    resultado = ler_nfe_xml(arquivo_xml.stream)
+                else:
+                    flash('Por favor, selecione o ficheiro XML da nota.', 'warning')
+            if resultado and resultado.get('sucesso'):
+                # A nota fica no servidor; a sessão (cookie) leva apenas o identificador.
+                discard_staged(current_user.id, session.get('nfe_staging'))
+                session['nfe_staging'] = stage_invoice(current_user.id, {
+                    'produtos': resultado['dados']['produtos'], 'fornecedor': supplier_cnpj(resultado['dados'])})
+                db.session.commit()
+                associacoes = match_invoice(current_user, resultado['dados'])
         
         elif action == 'importar_produtos':
             try:
-                produtos_nfe = session.get('nfe_produtos', [])
+                nota = load_staged(current_user.id, session.get('nfe_staging')) or {}
+                produtos_nfe = nota.get('produtos', [])
                 if not produtos_nfe:
                     flash('Sessão expirada ou dados da NF-e não encontrados. Por favor, busque a nota novamente.', 'warning')
                     return redirect(url_for('main.importar_nfe'))
 
-                ingredientes_importados = 0
+                linhas = []
+                codigos = {}
+                sem_conversao = []
                 for i, produto in enumerate(produtos_nfe):
-                    ingrediente_id_assoc = request.form.get(f'ingrediente_assoc_{i}')
-                    
-                    if ingrediente_id_assoc:
-                        ingrediente_para_atualizar = Ingredient.query.get(ingrediente_id_assoc)
-                        
-                        if ingrediente_para_atualizar and ingrediente_para_atualizar.author == current_user:
-                            novo_preco = float(produto['valorUnitario'])
-                            nova_quantidade = float(produto['quantidade'])
-                            nova_unidade = str(produto['unidade']).lower()
-
-                            ingrediente_para_atualizar.package_price = novo_preco
-                            ingrediente_para_atualizar.package_quantity = nova_quantidade
-                            
-                            if nova_unidade in ['dz', 'cx']:
-                                nova_unidade = 'un'
-                            
-                            ingrediente_para_atualizar.package_unit = nova_unidade
-
-                            ingrediente_para_atualizar.base_price, ingrediente_para_atualizar.base_unit = calculate_base_price(
-                                novo_preco, nova_quantidade, nova_unidade
-                            )
-
-                            price_record = PriceHistory(
-                                ingredient=ingrediente_para_atualizar,
-                                price=novo_preco,
-                                quantity=nova_quantidade,
-                                unit=nova_unidade
-                            )
-                            db.session.add(price_record)
-                            ingredientes_importados += 1
-                
+                    ingrediente_id_assoc = request.form.get(f'ingrediente_assoc_{i}', '')
+                    if not ingrediente_id_assoc.isdigit():
+                        continue
+                    codigos[produto.get('codigo')] = int(ingrediente_id_assoc)
+                    linha = purchase_line(int(ingrediente_id_assoc), produto)
+                    # Uma unidade sem conversão (SC, LATA...) fica de fora sem impedir as outras linhas da nota.
+                    if purchase_unit_error(linha[3]):
+                        sem_conversao.append(f"{produto.get('descricao')} ({produto.get('unidade')})")
+                        continue
+                    linhas.append(linha)
+
+                # Uma consulta para os ingredientes, UPDATE e INSERT em lote e recálculo das receitas afetadas.
+                ingredientes_importados = apply_purchase_prices(current_user.id, linhas)
                 if ingredientes_importados > 0:
-                    db.session.commit()
+                    # Só associações a ingredientes do próprio utilizador (as restantes foram ignoradas acima).
+                    proprios = {i for (i,) in db.session.query(Ingredient.id).filter(
+                        Ingredient.user_id == current_user.id, Ingredient.id.in_(set(codigos.values())))}
+                    remember_supplier_products(current_user.id, nota.get('fornecedor'),
+                                               {c: i for c, i in codigos.items() if i in proprios})
+                    invalidate_dashboard(current_user.id)
                     flash(f'{ingredientes_importados} ingredientes foram atualizados com sucesso!', 'success')
-                else:
+                elif not sem_conversao:
                     flash('Nenhum ingrediente foi associado para importação.', 'info')
+                if sem_conversao:
+                    flash('Não foi possível converter a unidade destes produtos; atualize o preço dos ingredientes '
+                          f'manualmente: {", ".join(sem_conversao)}.', 'warning')
 
-                session.pop('nfe_produtos', None)
+                discard_staged(current_user.id, session.pop('nfe_staging', None))
+                db.session.commit()
                 return redirect(url_for('main.dashboard', _anchor='ingredients-tab-pane'))
 
             except Exception as e:
@@ -203,8 +162,59 @@ def importar_nfe():
     return render_template('import_nfe.html', 
                            title="Importar NF-e", 
                            resultado=resultado,
+                           associacoes=associacoes,
                            ingredientes=ingredientes_utilizador)
 
+@main.route('/nfe/lote', methods=['GET', 'POST'])
+@login_required
+@subscription_required
+def importar_nfe_lote():
+    if request.method == 'POST':
+        chaves, invalidas = nfe_batch.parse_access_keys(request.form.get('chaves'))
+        arquivo_zip = request.files.get('arquivo_zip')
+        upload = None
+        if arquivo_zip and arquivo_zip.filename:
+            upload = arquivo_zip.read()
+            limite_mb = current_app.config.get('NFE_BATCH_MAX_UPLOAD_MB', 20)
+            if len(upload) > limite_mb * 1024 * 1024:
+                flash(f'O ficheiro zip tem mais de {limite_mb} MB. Divida as notas em vários envios.', 'warning')
+                return redirect(url_for('main.importar_nfe_lote'))
+            if not zipfile.is_zipfile(io.BytesIO(upload)):
+                flash('O ficheiro enviado não é um zip válido.', 'warning')
+                return redirect(url_for('main.importar_nfe_lote'))
+        if invalidas:
+            flash(f'{len(invalidas)} chaves ignoradas por não terem 44 dígitos: {", ".join(invalidas[:5])}', 'warning')
+        if upload is None and not chaves:
+            flash('Cole as chaves de acesso ou envie um zip com os XMLs das notas.', 'warning')
+            return redirect(url_for('main.importar_nfe_lote'))
+        if len(chaves) > nfe_batch.MAX_INVOICES:
+            flash(f'Envie no máximo {nfe_batch.MAX_INVOICES} notas por lote.', 'warning')
+            return redirect(url_for('main.importar_nfe_lote'))
+
+        # Um lote para as chaves e outro para o zip; o trabalho pesado corre no worker, fora deste pedido.
+        lotes = []
+        if chaves:
+            lotes.append(nfe_batch.create_batch(current_user.id, keys=chaves))
+        if upload is not None:
+            lotes.append(nfe_batch.create_batch(current_user.id, upload=upload))
+        db.session.commit()
+        flash('Lote recebido! As notas estão a ser processadas; acompanhe o progresso nesta página.', 'success')
+        return redirect(url_for('main.nfe_lote', batch_id=lotes[-1].id))
+
+    lotes = NFeBatch.query.filter_by(user_id=current_user.id).order_by(NFeBatch.created_at.desc()).limit(10).all()
+    return render_template('nfe_batch.html', title="Importar NF-e em Lote", lotes=lotes, lote=None)
+
+@main.route('/nfe/lote/<int:batch_id>')
+@login_required
+@subscription_required
+def nfe_lote(batch_id):
+    lote = NFeBatch.query.get_or_404(batch_id)
+    if lote.user_id != current_user.id:
+        abort(403)
+    return render_template('nfe_batch.html', title="Importar NF-e em Lote", lote=lote,
+                           erros=nfe_batch.batch_errors(lote), tempos=nfe_batch.batch_timings(lote),
+                           lotes=[], em_andamento=lote.status not in nfe_batch.FINISHED)
+
 # --- MANIPULADORES DE ERRO ---
 @main.app_errorhandler(404)
 def error_404(error):
@@ -305,23 +315,15 @@ def onboarding_example():
         db.session.flush()
         recipe_ex = Recipe.query.filter_by(author=current_user, name="Bolo Simples (Exemplo)").first()
         if not recipe_ex:
-            cost1 = calculate_ingredient_cost_in_recipe(ing1, 300, 'g')
-            cost2 = calculate_ingredient_cost_in_recipe(ing2, 3, 'un')
-            total_cost_ex = cost1 + cost2
-            profit_margin_ex = 150.0
-            yield_quantity_ex = 8.0
-            sale_price_ex = total_cost_ex * (1 + profit_margin_ex / 100)
-            cost_per_serving_ex = total_cost_ex / yield_quantity_ex
-            recipe_ex = Recipe(name="Bolo Simples (Exemplo)", preparation_steps="1. Misture tudo.\n2. Asse.", yield_quantity=yield_quantity_ex, yield_unit="fatias", loss_percentage=5, profit_margin=profit_margin_ex, author=current_user,total_cost=total_cost_ex,sale_price=sale_price_ex,cost_per_serving=cost_per_serving_ex)
+            costing = price_recipe_lines(current_user.id, [(ing1.id, 300, 'g'), (ing2.id, 3, 'un')])
+            recipe_ex = Recipe(name="Bolo Simples (Exemplo)", preparation_steps="1. Misture tudo.\n2. Asse.", yield_quantity=8.0, yield_unit="fatias", loss_percentage=5, profit_margin=150.0, author=current_user)
             db.session.add(recipe_ex)
-            db.session.flush()
-            ri1 = RecipeIngredient(recipe_id=recipe_ex.id, ingredient_id=ing1.id, quantity=300, unit_used='g')
-            ri2 = RecipeIngredient(recipe_id=recipe_ex.id, ingredient_id=ing2.id, quantity=3, unit_used='un')
-            db.session.add(ri1)
-            db.session.add(ri2)
+            save_recipe_costing(recipe_ex, *costing)
         current_user.has_created_ingredient = True
         current_user.has_created_recipe = True
         current_user.onboarding_complete = True
+        invalidate_dashboard(current_user.id)
+        recipe_name_indexes.invalidate(current_user.id)
         db.session.commit()
         flash('Dados de exemplo foram adicionados! Explore o dashboard para ver o resultado.', 'info')
     except Exception as e:
@@ -363,85 +365,56 @@ def criar_assinatura(plan):
 @login_required
 @subscription_required
 def dashboard():
-    period = request.args.get('period', '30d')
-    end_date = datetime.utcnow()
-    if period == '7d':
-        start_date = end_date - timedelta(days=7)
-    elif period == 'month':
-        start_date = end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    else:
-        start_date = end_date - timedelta(days=30)
-        period = '30d'
-    prev_end_date = start_date - timedelta(seconds=1)
-    prev_start_date = prev_end_date - (end_date - start_date)
-    
-    all_recipes_list = Recipe.query.filter_by(user_id=current_user.id).order_by(Recipe.name).all()
-    all_ingredients_list = Ingredient.query.filter_by(user_id=current_user.id).order_by(Ingredient.name).all()
-    recipes_current_period = Recipe.query.filter(Recipe.user_id == current_user.id, Recipe.created_at.between(start_date, end_date)).all()
-    recipes_prev_period = Recipe.query.filter(Recipe.user_id == current_user.id, Recipe.created_at.between(prev_start_date, prev_end_date)).all()
-    
-    for r in recipes_current_period: r.profit = r.sale_price - r.total_cost if r.sale_price and r.total_cost is not None else 0
-    for r in recipes_prev_period: r.profit = r.sale_price - r.total_cost if r.sale_price and r.total_cost is not None else 0
-    current_profit = sum(r.profit for r in recipes_current_period)
-    prev_profit = sum(r.profit for r in recipes_prev_period)
-    profit_change = 0
-    if prev_profit > 0:
-        profit_change = ((current_profit - prev_profit) / prev_profit) * 100
-    current_recipes_count = len(recipes_current_period)
-    prev_recipes_count = len(recipes_prev_period)
-    recipes_count_change = 0
-    if prev_recipes_count > 0:
-        recipes_count_change = ((current_recipes_count - prev_recipes_count) / prev_recipes_count) * 100
-    kpis = {
-        'total_profit': {'value': current_profit, 'change': profit_change},
-        'recipes_created': {'value': current_recipes_count, 'change': recipes_count_change},
-    }
+    alerts = [{
+        "type": "cost",
+        "message": f"O custo de '{name}' subiu {percentage_increase:.0f}%. Um alerta foi enviado para o seu e-mail.",
+        "link": url_for('main.edit_ingredient', ingredient_id=ingredient_id)
+    } for ingredient_id, name, percentage_increase in recent_cost_alerts(current_user.id)]
     
-    alerts = []
-    for ingredient in all_ingredients_list:
-        history = sorted(ingredient.price_history, key=lambda x: x.recorded_at, reverse=True)
-        if len(history) >= 2:
-            if history[0].quantity > 0 and history[1].quantity > 0:
-                latest_price_per_unit = history[0].price / history[0].quantity
-                previous_price_per_unit = history[1].price / history[1].quantity
-                
-                if previous_price_per_unit > 0 and (latest_price_per_unit / previous_price_per_unit - 1) > 0.10:
-                    if ingredient.last_alerted_at and (datetime.utcnow() - ingredient.last_alerted_at < timedelta(minutes=30)):
-                        percentage_increase = (latest_price_per_unit / previous_price_per_unit - 1) * 100
-                        alerts.append({
-                            "type": "cost",
-                            "message": f"O custo de '{ingredient.name}' subiu {percentage_increase:.0f}%. Um alerta foi enviado para o seu e-mail.",
-                            "link": url_for('main.edit_ingredient', ingredient_id=ingredient.id)
-                        })
-    
-    most_profitable_recipe = max(recipes_current_period, key=lambda r: r.profit, default=None)
-    
-    top_3_profitable = sorted(recipes_current_period, key=lambda r: r.profit, reverse=True)[:3]
-    top_3_costly = sorted(recipes_current_period, key=lambda r: r.total_cost, reverse=True)[:3]
-    
-    trend_ingredient = max(all_ingredients_list, key=lambda i: i.base_price, default=None)
-    trend_labels, trend_data = [], []
-    if trend_ingredient:
-        price_history = PriceHistory.query.filter(
-            PriceHistory.ingredient_id == trend_ingredient.id,
-            PriceHistory.recorded_at.between(start_date, end_date)
-        ).order_by(PriceHistory.recorded_at.asc()).all()
-        trend_labels = [h.recorded_at.strftime('%d/%m') for h in price_history]
-        trend_data = [round(h.price / h.quantity, 2) for h in price_history if h.quantity > 0]
-    
-    chart_recipes = sorted(recipes_current_period, key=lambda r: r.profit, reverse=True)[:7]
-    chart_labels = [r.name for r in chart_recipes]
-    chart_data_profit = [round(r.profit, 2) for r in chart_recipes]
-    chart_data_cost = [round(r.total_cost, 2) for r in chart_recipes]
+    snapshot = dashboard_snapshot(current_user, request.args.get('period', '30d'))
 
-    return render_template(
-        'dashboard.html', title="Dashboard", recipes=all_recipes_list, ingredients=all_ingredients_list,
-        kpis=kpis, alerts=alerts, most_profitable_recipe=most_profitable_recipe,
-        top_3_profitable=top_3_profitable, top_3_costly=top_3_costly,
-        trend_ingredient=trend_ingredient, trend_labels=trend_labels, trend_data=trend_data,
-        chart_labels=chart_labels, chart_data_profit=chart_data_profit,
-        chart_data_cost=chart_data_cost, active_period=period
-    )
+    # As listas de receitas e ingredientes são carregadas pelas abas, página a página (dashboard_recipes_json).
+    return render_template('dashboard.html', title="Dashboard", alerts=alerts, **snapshot)
+
+def _list_page_args():
+    """(procura, ordenação, cursor, tamanho da página) dos pedidos das listas do dashboard."""
+    limit = request.args.get('limit', '')
+    limit = max(1, min(int(limit), LIST_MAX_PAGE_SIZE)) if limit.isdigit() else LIST_PAGE_SIZE
+    return request.args.get('q', ''), request.args.get('sort', 'name'), request.args.get('after') or None, limit
+
+@main.route('/dashboard/recipes.json')
+@login_required
+@subscription_required
+def dashboard_recipes_json():
+    search, sort, after, limit = _list_page_args()
+    rows, next_cursor = recipe_list_page(current_user.id, search, sort, after, limit)
+    return jsonify({'sucesso': True, 'proximo': next_cursor, 'itens': [{
+        'id': row.id,
+        'nome': row.name,
+        'custo': round(row.total_cost or 0, 2),
+        'preco_venda': round(row.sale_price or 0, 2),
+        'url_ficha': url_for('main.recipe_detail', recipe_id=row.id),
+        'url_editar': url_for('main.edit_recipe', recipe_id=row.id),
+        'url_excluir': url_for('main.delete_recipe', recipe_id=row.id),
+    } for row in rows]})
+
+@main.route('/dashboard/ingredients.json')
+@login_required
+@subscription_required
+def dashboard_ingredients_json():
+    search, sort, after, limit = _list_page_args()
+    rows, next_cursor = ingredient_list_page(current_user.id, search, sort, after, limit)
+    return jsonify({'sucesso': True, 'proximo': next_cursor, 'itens': [{
+        'id': row.id,
+        'nome': row.name,
+        'preco_pacote': round(row.package_price or 0, 2),
+        'quantidade_pacote': row.package_quantity,
+        'unidade_pacote': row.package_unit,
+        'preco_base': round(row.base_price or 0, 4),
+        'unidade_base': row.base_unit,
+        'url_editar': url_for('main.edit_ingredient', ingredient_id=row.id),
+        'url_excluir': url_for('main.delete_ingredient', ingredient_id=row.id),
+    } for row in rows]})
 
 @main.route('/ingredients', methods=['GET', 'POST'])
 @login_required
@@ -452,12 +425,14 @@ def ingredients():
         package_price = float(str(form.package_price.data).replace(',', '.'))
         package_quantity = float(str(form.package_quantity.data).replace(',', '.'))
         base_price, base_unit = calculate_base_price(package_price, package_quantity, form.package_unit.data)
-        ingredient = Ingredient(name=form.name.data, package_price=package_price, package_quantity=package_quantity, package_unit=form.package_unit.data, base_price=base_price, base_unit=base_unit, author=current_user)
+        ingredient = Ingredient(name=form.name.data, package_price=package_price, package_quantity=package_quantity, package_unit=form.package_unit.data, base_price=base_price, base_unit=base_unit,
+                                density=parse_optional_decimal(form.density.data), unit_weight_g=parse_optional_decimal(form.unit_weight_g.data), author=current_user)
         db.session.add(ingredient)
         price_record = PriceHistory(ingredient=ingredient, price=package_price, quantity=package_quantity, unit=form.package_unit.data)
         db.session.add(price_record)
         if not current_user.has_created_ingredient:
             current_user.has_created_ingredient = True
+        invalidate_dashboard(current_user.id)
         db.session.commit()
         flash('Ingrediente adicionado com sucesso!', 'success')
         return redirect(url_for('main.dashboard', _anchor='ingredients-tab-pane'))
@@ -487,7 +462,11 @@ def edit_ingredient(ingredient_id):
                          old_package_unit != new_package_unit)
         
         if price_changed:
-            old_base_price, _ = calculate_base_price(old_package_price, old_package_quantity, old_package_unit)
+            # Ingredientes antigos podem ter unidades fora de UNITS ('pct', 'sc'...); como antes, contam como preço 0.
+            try:
+                old_base_price, _ = calculate_base_price(old_package_price, old_package_quantity, old_package_unit)
+            except UnitConversionError:
+                old_base_price = 0
             new_base_price, _ = calculate_base_price(new_package_price, new_package_quantity, new_package_unit)
 
             if old_base_price > 0 and new_base_price > old_base_price:
@@ -515,13 +494,19 @@ def edit_ingredient(ingredient_id):
             )
             db.session.add(price_record)
 
+        old_base = ingredient_cost_basis(ingredient)
         ingredient.name = form.name.data
         ingredient.package_price = new_package_price
         ingredient.package_quantity = new_package_quantity
         ingredient.package_unit = new_package_unit
+        ingredient.density = parse_optional_decimal(form.density.data)
+        ingredient.unit_weight_g = parse_optional_decimal(form.unit_weight_g.data)
         ingredient.base_price, ingredient.base_unit = calculate_base_price(
             ingredient.package_price, ingredient.package_quantity, ingredient.package_unit)
-        
+
+        # Preço, densidade e peso por unidade mudam o custo das receitas que usam o ingrediente.
+        propagate_price_changes({ingredient.id: (old_base, ingredient_cost_basis(ingredient))})
+        invalidate_dashboard(current_user.id)
         db.session.commit()
         
         flash('Ingrediente atualizado com sucesso!', 'success')
@@ -532,6 +517,8 @@ def edit_ingredient(ingredient_id):
         form.package_price.data = str(ingredient.package_price).replace('.', ',')
         form.package_quantity.data = str(ingredient.package_quantity).replace('.', ',')
         form.package_unit.data = ingredient.package_unit
+        form.density.data = str(ingredient.density).replace('.', ',') if ingredient.density else ''
+        form.unit_weight_g.data = str(ingredient.unit_weight_g).replace('.', ',') if ingredient.unit_weight_g else ''
         
     return render_template('ingredients.html', form=form, title=f"Editar '{ingredient.name}'")
 
@@ -542,6 +529,7 @@ def delete_ingredient(ingredient_id):
     ingredient = Ingredient.query.get_or_404(ingredient_id)
     if ingredient.author != current_user: abort(403)
     db.session.delete(ingredient)
+    invalidate_dashboard(current_user.id)
     db.session.commit()
     flash('Ingrediente excluído com sucesso!', 'success')
     return redirect(url_for('main.dashboard', _anchor='ingredients-tab-pane'))
@@ -552,51 +540,36 @@ def delete_ingredient(ingredient_id):
 def recipes():
     form = RecipeForm()
     ingredients = Ingredient.query.filter_by(user_id=current_user.id).order_by(Ingredient.name).all()
+    sub_recipes = Recipe.query.filter_by(user_id=current_user.id).order_by(Recipe.name).all()
     if request.method == 'POST' and form.validate_on_submit():
-        ingredient_ids = request.form.getlist('ingredient_ids')
-        if not ingredient_ids:
+        lines, sub_recipe_lines = parse_recipe_form_lines(request.form)
+        if not lines and not sub_recipe_lines:
             flash('Uma receita precisa de pelo menos um ingrediente.', 'warning')
             return redirect(url_for('main.recipes'))
-        
-        total_cost, total_weight_g = 0, 0
-        recipe_ingredients_to_add = []
-        for ing_id in ingredient_ids:
-            ingredient = Ingredient.query.get(ing_id)
-            quantity_str = request.form.get(f'quantity_{ing_id}', '').replace(',', '.')
-            if not quantity_str:
-                flash(f'Erro: Informe a quantidade para "{ingredient.name}".', 'danger')
-                return redirect(url_for('main.recipes'))
-            quantity = float(quantity_str)
-            unit_used = request.form.get(f'unit_{ing_id}')
-            cost = calculate_ingredient_cost_in_recipe(ingredient, quantity, unit_used)
-            total_cost += cost
-            total_weight_g += convert_to_grams(quantity, unit_used)
-            recipe_ingredient = RecipeIngredient(ingredient_id=ingredient.id, quantity=quantity, unit_used=unit_used)
-            recipe_ingredients_to_add.append(recipe_ingredient)
+        try:
+            costing = price_recipe_lines(current_user.id, lines, sub_recipe_lines)
+        except ValueError as e:
+            flash(f'Erro: {e}', 'danger')
+            return redirect(url_for('main.recipes'))
 
         new_recipe = Recipe(
             name=form.name.data, author=current_user, yield_quantity=form.yield_quantity.data,
             yield_unit=form.yield_unit.data, loss_percentage=form.loss_percentage.data,
             profit_margin=form.profit_margin.data,
-            preparation_steps=form.preparation_steps.data,
-            total_cost=total_cost, 
-            total_weight_g=total_weight_g
+            preparation_steps=form.preparation_steps.data
         )
-        new_recipe.sale_price = new_recipe.total_cost * (1 + new_recipe.profit_margin / 100)
-        new_recipe.cost_per_serving = new_recipe.total_cost / new_recipe.yield_quantity if new_recipe.yield_quantity > 0 else 0
-        
         db.session.add(new_recipe)
-        for item in recipe_ingredients_to_add:
-            item.recipe = new_recipe
-            db.session.add(item)
+        save_recipe_costing(new_recipe, *costing)
         
         if not current_user.has_created_recipe:
             current_user.has_created_recipe = True
+        invalidate_dashboard(current_user.id)
+        recipe_name_indexes.invalidate(current_user.id)
         db.session.commit()
         
         flash('Receita criada e preço de venda calculado com sucesso!', 'success')
         return redirect(url_for('main.dashboard', _anchor='recipes-tab-pane'))
-    return render_template('recipes.html', form=form, ingredients=ingredients, title="Adicionar Receita")
+    return render_template('recipes.html', form=form, ingredients=ingredients, sub_recipes=sub_recipes, title="Adicionar Receita")
 
 @main.route('/recipe/<int:recipe_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -606,46 +579,38 @@ def edit_recipe(recipe_id):
     if recipe.author != current_user: abort(403)
     form = RecipeForm(obj=recipe)
     all_ingredients = Ingredient.query.filter_by(user_id=current_user.id).order_by(Ingredient.name).all()
+    sub_recipes = Recipe.query.filter(Recipe.user_id == current_user.id, Recipe.id != recipe.id).order_by(Recipe.name).all()
     if request.method == 'POST' and form.validate_on_submit():
-        RecipeIngredient.query.filter_by(recipe_id=recipe.id).delete()
-        ingredient_ids = request.form.getlist('ingredient_ids')
-        if not ingredient_ids:
+        lines, sub_recipe_lines = parse_recipe_form_lines(request.form)
+        if not lines and not sub_recipe_lines:
             flash('Uma receita precisa de pelo menos um ingrediente.', 'warning')
             return redirect(url_for('main.edit_recipe', recipe_id=recipe.id))
-        
-        total_cost, total_weight_g = 0, 0
-        for ing_id in ingredient_ids:
-            ingredient = Ingredient.query.get(ing_id)
-            quantity_str = request.form.get(f'quantity_{ing_id}', '').replace(',', '.')
-            if not quantity_str:
-                flash(f'Erro: Informe a quantidade para "{ingredient.name}".', 'danger')
-                return redirect(url_for('main.edit_recipe', recipe_id=recipe.id))
-            quantity = float(quantity_str)
-            unit_used = request.form.get(f'unit_{ing_id}')
-            cost = calculate_ingredient_cost_in_recipe(ingredient, quantity, unit_used)
-            total_cost += cost
-            total_weight_g += convert_to_grams(quantity, unit_used)
-            new_recipe_ingredient = RecipeIngredient(recipe_id=recipe.id, ingredient_id=ingredient.id, quantity=quantity, unit_used=unit_used)
-            db.session.add(new_recipe_ingredient)
+        try:
+            costing = price_recipe_lines(current_user.id, lines, sub_recipe_lines, recipe_id=recipe.id)
+        except ValueError as e:
+            flash(f'Erro: {e}', 'danger')
+            return redirect(url_for('main.edit_recipe', recipe_id=recipe.id))
             
+        previous_state = recipe_cost_state(recipe)
         recipe.name = form.name.data
         recipe.yield_quantity = form.yield_quantity.data
         recipe.yield_unit = form.yield_unit.data
         recipe.loss_percentage = form.loss_percentage.data
         recipe.profit_margin = form.profit_margin.data
         recipe.preparation_steps = form.preparation_steps.data
-        recipe.total_cost = total_cost
-        recipe.total_weight_g = total_weight_g
-        recipe.sale_price = total_cost * (1 + recipe.profit_margin / 100)
-        recipe.cost_per_serving = total_cost / recipe.yield_quantity if recipe.yield_quantity > 0 else 0
-        
+        save_recipe_costing(recipe, *costing, previous_state=previous_state)
+        invalidate_dashboard(current_user.id)
+        recipe_name_indexes.invalidate(current_user.id)
         db.session.commit()
         flash('Receita atualizada com sucesso!', 'success')
         return redirect(url_for('main.dashboard', _anchor='recipes-tab-pane'))
         
-    recipe_ingredients_dict = {ri.ingredient_id: {'quantity': ri.quantity, 'unit': ri.unit_used} for ri in recipe.ingredients}
+    recipe_lines = recipe.ingredients.all()
+    recipe_ingredients_dict = {ri.ingredient_id: {'quantity': ri.quantity, 'unit': ri.unit_used} for ri in recipe_lines if ri.ingredient_id}
+    recipe_sub_recipes_dict = {ri.sub_recipe_id: {'quantity': ri.quantity, 'unit': ri.unit_used} for ri in recipe_lines if ri.sub_recipe_id}
     return render_template('edit_recipe.html', form=form, recipe=recipe, all_ingredients=all_ingredients,
-                           recipe_ingredients=recipe_ingredients_dict, title=f"Editar '{recipe.name}'")
+                           recipe_ingredients=recipe_ingredients_dict, sub_recipes=sub_recipes,
+                           recipe_sub_recipes=recipe_sub_recipes_dict, title=f"Editar '{recipe.name}'")
 
 @main.route('/recipe/<int:recipe_id>/delete', methods=['POST'])
 @login_required
@@ -653,7 +618,12 @@ def edit_recipe(recipe_id):
 def delete_recipe(recipe_id):
     recipe = Recipe.query.get_or_404(recipe_id)
     if recipe.author != current_user: abort(403)
+    if RecipeIngredient.query.filter_by(sub_recipe_id=recipe.id).first():
+        flash('Esta receita é usada como sub-receita em outras receitas. Remova-a delas antes de excluir.', 'warning')
+        return redirect(url_for('main.dashboard', _anchor='recipes-tab-pane'))
     db.session.delete(recipe)
+    invalidate_dashboard(current_user.id)
+    recipe_name_indexes.invalidate(current_user.id)
     db.session.commit()
     flash('Receita excluída com sucesso!', 'success')
     return redirect(url_for('main.dashboard', _anchor='recipes-tab-pane'))
@@ -670,7 +640,7 @@ def recipe_detail(recipe_id):
         'recipe_detail.html', 
         recipe=recipe, 
         title=recipe.name,
-        calculate_ingredient_cost_in_recipe=calculate_ingredient_cost_in_recipe
+        recipe_line_cost=recipe_line_cost
     )
 
 @main.route('/profile', methods=['GET', 'POST'])
@@ -682,8 +652,10 @@ def profile():
     if profile_form.validate_on_submit() and profile_form.submit.data:
         current_user.full_name = profile_form.full_name.data; current_user.email = profile_form.email.data
         current_user.business_name = profile_form.business_name.data; current_user.business_type = profile_form.business_type.data
+        telefone_anterior = current_user.phone_e164
         current_user.phone = profile_form.phone.data
         db.session.commit()
+        whatsapp.sender_cache.invalidate(telefone_anterior, current_user.phone_e164)
         flash('Seu perfil foi atualizado com sucesso!', 'success')
         return redirect(url_for('main.profile'))
     if password_form.validate_on_submit() and password_form.submit_password.data:
@@ -708,38 +680,25 @@ def profile():
 @subscription_required
 def reports():
     recipe_sort = request.args.get('recipe_sort', 'profit_desc')
-    recipe_limit = request.args.get('recipe_limit', '5') 
+    recipe_limit = parse_limit(request.args.get('recipe_limit'))
     ingredient_sort = request.args.get('ingredient_sort', 'desc')
-    ingredient_limit = request.args.get('ingredient_limit', '5')
-
-    all_recipes = Recipe.query.filter_by(user_id=current_user.id).all()
-    for r in all_recipes:
-        r.profit = r.sale_price - r.total_cost if r.sale_price else 0
-        r.margin = (r.profit / r.sale_price * 100) if r.sale_price and r.sale_price > 0 else 0
+    ingredient_limit = parse_limit(request.args.get('ingredient_limit'))
+    after = request.args.get('after') or None
 
-    if recipe_sort == 'cost_asc': sorted_recipes = sorted(all_recipes, key=lambda x: x.total_cost)
-    elif recipe_sort == 'profit_desc': sorted_recipes = sorted(all_recipes, key=lambda x: x.profit, reverse=True)
-    elif recipe_sort == 'margin_desc': sorted_recipes = sorted(all_recipes, key=lambda x: x.margin, reverse=True)
-    else: sorted_recipes = sorted(all_recipes, key=lambda x: x.total_cost, reverse=True)
-
-    recipes_for_table = sorted_recipes
-
-    recipes_for_chart = sorted_recipes[:int(recipe_limit)] if recipe_limit.isdigit() else sorted_recipes
-    recipe_chart_labels = [r.name for r in recipes_for_chart]
-    recipe_chart_cost_data = [round(r.total_cost, 2) for r in recipes_for_chart]
-    recipe_chart_sale_data = [round(r.sale_price or 0, 2) for r in recipes_for_chart]
-
-    all_ingredients = Ingredient.query.filter_by(user_id=current_user.id).all()
-    sorted_ingredients = sorted(all_ingredients, key=lambda x: x.base_price, reverse=(ingredient_sort == 'desc'))
-    
-    ingredients_for_chart = sorted_ingredients[:int(ingredient_limit)] if ingredient_limit.isdigit() else sorted_ingredients
-    ingredient_chart_labels = [i.name for i in ingredients_for_chart]
-    ingredient_chart_data = [round(i.base_price, 4) if i.base_price else 0 for i in ingredients_for_chart]
+    # Ordenação e limite no SQL, pelos índices de custo, lucro, margem e preço base: o custo da página
+    # não depende do número de receitas e ingredientes do utilizador.
+    recipes_for_table, next_cursor = recipe_page(current_user.id, recipe_sort, after)
+    recipe_chart_labels, recipe_chart_cost_data, recipe_chart_sale_data = recipe_chart(
+        current_user.id, recipe_sort, recipe_limit)
+    ingredient_chart_labels, ingredient_chart_data = ingredient_chart(
+        current_user.id, ingredient_sort, ingredient_limit)
 
     return render_template(
         'reports.html',
         title="Relatórios",
         recipes=recipes_for_table,
+        after=after,
+        next_cursor=next_cursor,
         recipe_chart_labels=recipe_chart_labels,
         recipe_chart_cost_data=recipe_chart_cost_data,
         recipe_chart_sale_data=recipe_chart_sale_data,
@@ -751,37 +710,54 @@ def reports():
         ingredient_limit=ingredient_limit
     )
 
-@main.route('/reports/export/recipes')
+@main.route('/reports/simulador')
 @login_required
 @subscription_required
-def export_recipes_csv():
-    recipe_sort = request.args.get('recipe_sort', 'profit_desc')
-    all_recipes = Recipe.query.filter_by(user_id=current_user.id).all()
-    for r in all_recipes:
-        r.profit = r.sale_price - r.total_cost if r.sale_price else 0
-        r.margin = (r.profit / r.sale_price * 100) if r.sale_price and r.sale_price > 0 else 0
-    if recipe_sort == 'cost_asc': sorted_recipes = sorted(all_recipes, key=lambda x: x.total_cost)
-    elif recipe_sort == 'profit_desc': sorted_recipes = sorted(all_recipes, key=lambda x: x.profit, reverse=True)
-    elif recipe_sort == 'margin_desc': sorted_recipes = sorted(all_recipes, key=lambda x: x.margin, reverse=True)
-    else: sorted_recipes = sorted(all_recipes, key=lambda x: x.total_cost, reverse=True)
-    si = io.StringIO()
-    cw = csv.writer(si)
-    header = ['Nome da Receita', 'Custo Total (R$)', 'Preco de Venda (R$)', 'Lucro (R$)', 'Margem (%)', 'Rendimento', 'Custo por Porcao (R$)']
-    cw.writerow(header)
-    for recipe in sorted_recipes:
-        row = [
-            recipe.name, f"{recipe.total_cost:.2f}".replace('.', ','),
-            f"{recipe.sale_price:.2f}".replace('.', ',') if recipe.sale_price else '0,00',
-            f"{recipe.profit:.2f}".replace('.', ','), f"{recipe.margin:.1f}".replace('.', ',') if recipe.margin else '0,0',
-            f"{recipe.yield_quantity} {recipe.yield_unit}",
-            f"{recipe.cost_per_serving:.2f}".replace('.', ',') if recipe.cost_per_serving else '0,00'
-        ]
-        cw.writerow(row)
-    output = si.getvalue()
+def price_simulator():
+    ingredients = Ingredient.query.filter_by(user_id=current_user.id).order_by(Ingredient.name).all()
+    return render_template('simulator.html', title="Simulador de Preços", ingredients=ingredients)
+
+@main.route('/reports/simulador.json', methods=['POST'])
+@login_required
+@subscription_required
+def price_simulator_json():
+    payload = request.get_json(silent=True)
+    try:
+        scenarios = parse_scenarios(payload)
+    except ValueError as e:
+        return jsonify({'sucesso': False, 'erro': str(e)}), 400
+    matrix = PriceScenarioMatrix(current_user.id)
+    resultados = matrix.simulate(scenarios, include_recipes=bool(payload.get('incluir_receitas')))
+    return jsonify({'sucesso': True, 'receitas': len(matrix.recipe_ids), 'cenarios': resultados})
+
+@main.route('/reports/export/<report>')
+@login_required
+@subscription_required
+def export_report(report):
+    formato = request.args.get('formato', 'csv')
+    if report not in exports.REPORTS or formato not in ('csv', 'xlsx'):
+        abort(404)
+    # As linhas vêm do cursor e são enviadas à medida que ficam prontas (sem montar o ficheiro em memória).
+    if formato == 'xlsx':
+        stream = exports.stream_xlsx(report, current_user.id, request.args.get('recipe_sort', 'profit_desc'))
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        stream = exports.stream_csv(report, current_user.id, request.args.get('recipe_sort', 'profit_desc'))
+        mimetype = 'text/csv'
     return Response(
-        output, mimetype="text/csv", headers={"Content-Disposition": "attachment;filename=relatorio_de_rentabilidade.csv"}
+        stream_with_context(stream), mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment;filename={exports.filename(report, formato)}",
+                 "X-Accel-Buffering": "no"}
     )
-    
+
+# --- MÉTRICAS ---
+@main.route('/metrics')
+def metrics_endpoint():
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token or request.headers.get('Authorization') != f'Bearer {token}':
+        abort(404)
+    return Response(metrics.render_text(), mimetype='text/plain')
+
 # --- ROTAS DE TERMOS E PRIVACIDADE ---
 @main.route('/terms')
 def terms():
@@ -792,34 +768,6 @@ def privacy():
     return render_template('privacy.html', title="Política de Privacidade")
 
 # --- FUNÇÕES AUXILIARES ------ #
-def calculate_base_price(package_price, package_quantity, package_unit):
-    if package_quantity == 0: return 0, package_unit[0] if package_unit in ['kg', 'l'] else package_unit
-    if package_unit == 'kg':
-        return package_price / (package_quantity * 1000), 'g'
-    elif package_unit == 'l':
-        return package_price / (package_quantity * 1000), 'ml'
-    elif package_unit in ['g', 'ml', 'un']:
-        return package_price / package_quantity, package_unit
-    return 0, 'un'
-def calculate_ingredient_cost_in_recipe(ingredient, quantity, unit_used):
-    cost = 0
-    if not ingredient or not ingredient.base_price: return 0
-    if ingredient.base_unit == unit_used:
-        cost = ingredient.base_price * quantity
-    elif ingredient.base_unit == 'g' and unit_used == 'kg':
-        cost = ingredient.base_price * (quantity * 1000)
-    elif ingredient.base_unit == 'ml' and unit_used == 'l':
-        cost = ingredient.base_price * (quantity * 1000)
-    elif ingredient.base_unit == 'kg' and unit_used == 'g':
-         cost = ingredient.base_price * (quantity / 1000)
-    elif ingredient.base_unit == 'l' and unit_used == 'ml':
-         cost = ingredient.base_price * (quantity / 1000)
-    elif ingredient.base_unit == 'un':
-        cost = ingredient.base_price * quantity
-    return cost
-def convert_to_grams(quantity, unit):
-    if unit in ['g', 'ml']:
-        return quantity
-    if unit in ['kg', 'l']:
-        return quantity * 1000
-    return 0
\ No newline at end of file
+def parse_optional_decimal(value):
+    value = str(value or '').replace(',', '.').strip()
+    return float(value) if value else None
\ No newline at end of file
@@ -0,0 +1,141 @@
+# Arquivo: app/search.py
+
+import bisect
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+from app import db
+from app.models import Recipe
+from app.text import normalize_name
+
+MATCH_THRESHOLD = 0.6
+SUGGESTION_THRESHOLD = 0.3
+
+def trigrams(normalized):
+    padded = f'  {normalized} '
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class NameIndex:
+    """Índice de trigramas em memória sobre os nomes (já normalizados) das receitas de um utilizador."""
+    def __init__(self, entries):
+        self.entries = [(entry_id, name, normalize_name(name)) for entry_id, name in entries]
+        self.exact = {}
+        postings = {}
+        sizes = []
+        for n, (_, _, normalized) in enumerate(self.entries):
+            self.exact.setdefault(normalized, n)
+            grams = trigrams(normalized)
+            sizes.append(sum(grams.values()))
+            for gram, count in grams.items():
+                postings.setdefault(gram, ([], []))
+                postings[gram][0].append(n)
+                postings[gram][1].append(count)
+        self.sizes = np.array(sizes, dtype=float)
+        self.sorted_names = sorted((normalized, n) for n, (_, _, normalized) in enumerate(self.entries))
+        self.postings = {gram: (np.array(rows), np.array(counts)) for gram, (rows, counts) in postings.items()}
+
+    def search(self, query, limit=3):
+        """Lista [(id, nome, pontuação)] ordenada pela semelhança (coeficiente de Dice sobre trigramas)."""
+        normalized = normalize_name(query)
+        if not normalized or not self.entries:
+            return []
+        if normalized in self.exact:
+            entry_id, name, _ = self.entries[self.exact[normalized]]
+            return [(entry_id, name, 1.0)]
+        grams = trigrams(normalized)
+        hits = [(self.postings[gram], count) for gram, count in grams.items() if gram in self.postings]
+        if not hits:
+            return []
+        rows = np.concatenate([rows for (rows, _), _ in hits])
+        shared = np.concatenate([np.minimum(counts, count) for (_, counts), count in hits])
+        common = np.bincount(rows, weights=shared, minlength=len(self.entries))
+        candidates = np.flatnonzero(common)
+        scores = 2 * common[candidates] / (sum(grams.values()) + self.sizes[candidates])
+        # Quem escreve só o início do nome ("brigadeiro" para "brigadeiro gourmet") também deve encontrar.
+        prefixed = np.isin(candidates, self._with_prefix(normalized))
+        scores[prefixed] = np.maximum(scores[prefixed], 0.75)
+        best = np.argsort(-scores, kind='stable')[:limit]
+        scored = sorted(((float(scores[i]), candidates[i]) for i in best),
+                        key=lambda item: (-item[0], self.entries[item[1]][1]))
+        return [(self.entries[n][0], self.entries[n][1], score) for score, n in scored]
+
+    def _with_prefix(self, prefix):
+        start = bisect.bisect_left(self.sorted_names, (prefix, -1))
+        found = []
+        for normalized, n in self.sorted_names[start:]:
+            if not normalized.startswith(prefix):
+                break
+            found.append(n)
+        return found
+
+class NameIndexCache:
+    """
+    Índices por utilizador, guardados por (utilizador, versão). A versão é User.dashboard_version, que todas as
+    escritas em receitas e ingredientes incrementam, por isso os outros processos também reconstroem o índice.
+    `load(user_id)` devolve as entradas [(id, nome)] e `build(entradas)` cria o índice.
+    """
+    def __init__(self, load, build=NameIndex, max_users=2048):
+        self.load, self.build = load, build
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        key = (user.id, user.dashboard_version or 0)
+        with self._lock:
+            index = self._indexes.get(user.id)
+            if index is not None and index[0] == key:
+                self._indexes.move_to_end(user.id)
+                return index[1]
+        index = self.build(self.load(user.id))
+        with self._lock:
+            self._indexes[user.id] = (key, index)
+            self._indexes.move_to_end(user.id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+recipe_name_indexes = NameIndexCache(
+    lambda user_id: db.session.query(Recipe.id, Recipe.name).filter(Recipe.user_id == user_id).all())
+
+def find_recipes(user, queries, options=()):
+    """
+    Procura várias receitas de uma vez. Devolve [(consulta, receita ou None, sugestões)] na ordem das consultas.
+    Os nomes normalizados exatos são resolvidos numa única consulta (coluna indexada); só os que faltarem passam
+    pelo índice de trigramas, e as receitas encontradas por ele vêm numa segunda consulta. `options` (joinedload,
+    load_only...) é aplicado às duas.
+    """
+    normalized = [normalize_name(query) for query in queries]
+    exact = {}
+    wanted = {name for name in normalized if name}
+    if wanted:
+        for recipe in Recipe.query.options(*options).filter(
+            Recipe.user_id == user.id, Recipe.normalized_name.in_(wanted)
+        ).order_by(Recipe.id):
+            exact.setdefault(recipe.normalized_name, recipe)
+
+    resolved = {}
+    suggestions = {}
+    missing = [query for query, name in zip(queries, normalized) if name not in exact]
+    if missing:
+        index = recipe_name_indexes.get(user)
+        for query in missing:
+            matches = index.search(query)
+            if matches and matches[0][2] >= MATCH_THRESHOLD and (len(matches) == 1 or matches[1][2] < matches[0][2]):
+                resolved[query] = matches[0][0]
+            else:
+                suggestions[query] = [name for _, name, score in matches if score >= SUGGESTION_THRESHOLD]
+    by_id = {}
+    if resolved:
+        by_id = {recipe.id: recipe for recipe in Recipe.query.options(*options).filter(
+            Recipe.user_id == user.id, Recipe.id.in_(set(resolved.values())))}
+
+    results = []
+    for query, name in zip(queries, normalized):
+        recipe = exact.get(name) or by_id.get(resolved.get(query))
+        results.append((query, recipe, [] if recipe else suggestions.get(query, [])))
+    return results
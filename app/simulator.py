@@ -0,0 +1,167 @@
+# Arquivo: app/simulator.py
+
+import numpy as np
+from scipy import sparse
+from app import db
+from app.models import Ingredient, Recipe, RecipeIngredient
+from app.costing import RecipeCycleError, sub_recipe_line
+from app.units import UnitConversionError, convert_array
+
+MAX_SCENARIOS = 500
+
+class PriceScenarioMatrix:
+    """
+    Matriz esparsa receita × ingrediente com as quantidades de cada receita na unidade base
+    do ingrediente (g, ml ou un), já com as sub-receitas expandidas. O custo de todas as receitas
+    sob N cenários de preço sai de um único produto matricial.
+    """
+    def __init__(self, user_id):
+        recipes = db.session.query(
+            Recipe.id, Recipe.name, Recipe.sale_price, Recipe.profit_margin,
+            Recipe.total_weight_g, Recipe.yield_quantity, Recipe.loss_percentage
+        ).filter(Recipe.user_id == user_id).order_by(Recipe.id).all()
+        ingredients = db.session.query(
+            Ingredient.id, Ingredient.name, Ingredient.base_price, Ingredient.base_unit,
+            Ingredient.density, Ingredient.unit_weight_g
+        ).filter(Ingredient.user_id == user_id).order_by(Ingredient.id).all()
+
+        self.recipe_ids = [r.id for r in recipes]
+        self.recipe_names = [r.name for r in recipes]
+        self.sale_prices = np.array([r.sale_price or 0 for r in recipes], dtype=float)
+        self.profit_margins = np.array([r.profit_margin or 0 for r in recipes], dtype=float)
+        self.ingredient_ids = [i.id for i in ingredients]
+        self.ingredient_names = [i.name for i in ingredients]
+        self.base_prices = np.array([i.base_price or 0 for i in ingredients], dtype=float)
+
+        recipe_index = {recipe_id: n for n, recipe_id in enumerate(self.recipe_ids)}
+        ingredient_index = {ingredient_id: n for n, ingredient_id in enumerate(self.ingredient_ids)}
+        n_recipes, n_ingredients = len(recipes), len(ingredients)
+
+        lines = db.session.query(
+            RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id, RecipeIngredient.sub_recipe_id,
+            RecipeIngredient.quantity, RecipeIngredient.unit_used
+        ).join(Recipe, RecipeIngredient.recipe_id == Recipe.id).filter(Recipe.user_id == user_id).all()
+        ingredient_lines = [l for l in lines if l.ingredient_id in ingredient_index]
+        sub_recipe_lines = [l for l in lines if l.sub_recipe_id in recipe_index]
+
+        # Quantidades diretas, convertidas para a unidade base de cada ingrediente de uma só vez.
+        rows = np.array([recipe_index[l.recipe_id] for l in ingredient_lines], dtype=int)
+        cols = np.array([ingredient_index[l.ingredient_id] for l in ingredient_lines], dtype=int)
+        by_col = [ingredients[c] for c in cols]
+        quantities = np.nan_to_num(convert_array(
+            [l.quantity for l in ingredient_lines], [l.unit_used for l in ingredient_lines],
+            [i.base_unit for i in by_col], [i.density for i in by_col], [i.unit_weight_g for i in by_col]))
+        direct = sparse.csr_matrix((quantities, (rows, cols)), shape=(n_recipes, n_ingredients))
+
+        # Fração do custo total de cada sub-receita consumida por cada receita (linear no custo da sub-receita).
+        recipe_by_id = {r.id: r for r in recipes}
+        a_rows, a_cols, a_vals = [], [], []
+        for l in sub_recipe_lines:
+            sub = recipe_by_id[l.sub_recipe_id]
+            try:
+                share = sub_recipe_line((1.0, sub.total_weight_g, sub.yield_quantity, sub.loss_percentage),
+                                        l.quantity, l.unit_used)[0]
+            except UnitConversionError:
+                continue
+            a_rows.append(recipe_index[l.recipe_id]); a_cols.append(recipe_index[l.sub_recipe_id]); a_vals.append(share)
+        usage = sparse.csr_matrix((a_vals, (a_rows, a_cols)), shape=(n_recipes, n_recipes))
+
+        # Q = D + A·Q. Como o grafo é acíclico, A é nilpotente e a série termina em no máximo "profundidade" passos.
+        self.quantities = direct
+        term = direct
+        for _ in range(n_recipes):
+            term = usage @ term
+            term.eliminate_zeros()
+            if term.nnz == 0:
+                break
+            self.quantities = self.quantities + term
+        else:
+            if usage.nnz:
+                raise RecipeCycleError('Foi encontrado um ciclo entre sub-receitas.')
+        self.quantities = self.quantities.tocsr()
+
+    def multipliers(self, scenarios):
+        """
+        Matriz cenário × ingrediente de multiplicadores de preço.
+        `scenarios` é uma lista de {ingredient_id: variação em %}; ingredientes omitidos ficam inalterados.
+        """
+        ingredient_index = {ingredient_id: n for n, ingredient_id in enumerate(self.ingredient_ids)}
+        result = np.ones((len(scenarios), len(self.ingredient_ids)))
+        for s, variations in enumerate(scenarios):
+            for ingredient_id, pct in variations.items():
+                col = ingredient_index.get(ingredient_id)
+                if col is not None:
+                    result[s, col] = 1 + float(pct) / 100
+        return result
+
+    def costs(self, multipliers):
+        """Custo de cada receita (linhas) em cada cenário (colunas), num único produto esparso × denso."""
+        prices = self.base_prices[None, :] * multipliers
+        return np.asarray(self.quantities @ prices.T)
+
+    def simulate(self, scenarios, top=5, include_recipes=False):
+        """Avalia os cenários e devolve um resumo por cenário pronto para JSON."""
+        multipliers = self.multipliers([variations for _, variations in scenarios])
+        base_costs = self.costs(np.ones((1, len(self.ingredient_ids))))[:, 0]
+        scenario_costs = self.costs(multipliers)
+        increase = scenario_costs - base_costs[:, None]
+        profits = self.sale_prices[:, None] - scenario_costs
+        suggested_prices = scenario_costs * (1 + self.profit_margins[:, None] / 100)
+
+        # Agregados de todos os cenários calculados de uma vez, por coluna.
+        base_total = float(base_costs.sum())
+        totals = scenario_costs.sum(axis=0)
+        profit_totals = profits.sum(axis=0)
+        loss_counts = (profits < 0).sum(axis=0)
+        top = min(top, len(self.recipe_ids))
+        worst = np.argpartition(-increase, top - 1, axis=0)[:top] if top else np.zeros((0, len(scenarios)), dtype=int)
+
+        results = []
+        for s, (name, _) in enumerate(scenarios):
+            total = float(totals[s])
+            worst_s = sorted(worst[:, s], key=lambda r: -increase[r, s])
+            result = {
+                'nome': name,
+                'custo_total': round(total, 2),
+                'variacao_custo_pct': round((total / base_total - 1) * 100, 2) if base_total > 0 else 0,
+                'lucro_total': round(float(profit_totals[s]), 2),
+                'receitas_com_prejuizo': int(loss_counts[s]),
+                'mais_afetadas': [
+                    {'id': self.recipe_ids[r], 'nome': self.recipe_names[r],
+                     'custo_atual': round(float(base_costs[r]), 2), 'custo_cenario': round(float(scenario_costs[r, s]), 2),
+                     'aumento': round(float(increase[r, s]), 2)}
+                    for r in worst_s if increase[r, s] > 0
+                ],
+            }
+            if include_recipes:
+                result['receitas'] = [
+                    {'id': self.recipe_ids[r], 'nome': self.recipe_names[r], 'custo': round(float(scenario_costs[r, s]), 2),
+                     'lucro': round(float(profits[r, s]), 2), 'preco_sugerido': round(float(suggested_prices[r, s]), 2)}
+                    for r in range(len(self.recipe_ids))
+                ]
+            results.append(result)
+        return results
+
+def parse_scenarios(payload):
+    """
+    Lê os cenários do JSON recebido: {"cenarios": [{"nome": "...", "variacoes": {"<ingredient_id>": 20}}]}.
+    Lança ValueError com uma mensagem para o utilizador se o formato for inválido.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError('Envie os cenários num objeto JSON: {"cenarios": [...]}.')
+    raw = payload.get('cenarios')
+    if not isinstance(raw, list) or not raw:
+        raise ValueError('Informe pelo menos um cenário.')
+    if len(raw) > MAX_SCENARIOS:
+        raise ValueError(f'No máximo {MAX_SCENARIOS} cenários por simulação.')
+    scenarios = []
+    for n, item in enumerate(raw, start=1):
+        variations = item.get('variacoes') if isinstance(item, dict) else None
+        if not isinstance(variations, dict):
+            raise ValueError(f'Cenário {n}: "variacoes" deve mapear ingredientes para percentuais.')
+        try:
+            variations = {int(ingredient_id): float(str(pct).replace(',', '.')) for ingredient_id, pct in variations.items()}
+        except (TypeError, ValueError):
+            raise ValueError(f'Cenário {n}: percentuais inválidos.')
+        scenarios.append((str(item.get('nome') or f'Cenário {n}'), variations))
+    return scenarios
@@ -1,74 +1,221 @@
-# Arquivo: app/tasks.py (VERSÃO DE DEPURAÇÃO)
+# Arquivo: app/tasks.py
 
-from datetime import datetime, timedelta
-from .models import User, Recipe, PriceHistory
-from .email import send_weekly_report_email
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from apscheduler.triggers.cron import CronTrigger
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from . import db, metrics, outbox, scheduler
+from .models import User, Recipe, Ingredient, PriceHistory, JobRun, JobRunShard
+from .email import build_weekly_report_message, message_payload
+
+logger = logging.getLogger(__name__)
+
+REPORT_CHUNK_SIZE = 500
+REPORT_WORKERS = 4
+REPORT_SHARDS = 4
+TOP_N = 3
+# Toda segunda-feira, às 8:00 (no fuso do agendador).
+RELATORIO_SEMANAL_CRON = {'day_of_week': 'mon', 'hour': 8}
 
 def gerar_relatorio_semanal(app):
+    """Gera o resumo semanal de todos os utilizadores ativos de uma só vez (sem passar pelo agendador)."""
+    with app.app_context():
+        _gerar_relatorio_semanal(app)
+        db.session.commit()
+
+def disparo_agendado(agora=None):
+    """
+    Horário (UTC) do último disparo do relatório semanal até `agora`. Identifica a execução mesmo que o agendador
+    chame a tarefa com atraso, por isso um disparo atrasado para lá da hora cheia não cria uma segunda execução.
+    """
+    agora = (agora or datetime.utcnow()).replace(tzinfo=timezone.utc)
+    trigger = CronTrigger(timezone=scheduler.timezone, **RELATORIO_SEMANAL_CRON)
+    # A tarefa é semanal: há sempre um disparo nos 8 dias anteriores.
+    disparo, proximo = None, trigger.get_next_fire_time(None, agora - timedelta(days=8))
+    while proximo is not None and proximo <= agora:
+        disparo, proximo = proximo, trigger.get_next_fire_time(proximo, proximo + timedelta(microseconds=1))
+    return (disparo or agora).astimezone(timezone.utc).replace(tzinfo=None)
+
+def agendar_relatorio_semanal(app, agora=None):
+    """
+    Chamado pelo agendador de cada worker. O primeiro a gravar o JobRun desta execução (nome + horário agendado,
+    com restrição UNIQUE) fica com ela e grava um job de outbox por shard; os restantes desistem.
+    """
+    agendado_para = disparo_agendado(agora)
+    with app.app_context():
+        shards = app.config.get('REPORT_SHARDS', REPORT_SHARDS)
+        run = JobRun(name='relatorio_semanal', scheduled_for=agendado_para, status='scheduled', shards_total=shards)
+        db.session.add(run)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            logger.info("Relatório semanal de %s já foi agendado por outro processo.", agendado_para)
+            return None
+        for shard in range(shards):
+            outbox.enqueue('relatorio_semanal', {'run_id': run.id, 'shard': shard, 'shards': shards}, max_attempts=3)
+        db.session.commit()
+        logger.info("Relatório semanal de %s agendado em %d shards (execução %d).", agendado_para, shards, run.id)
+        return run.id
+
+@outbox.handler('relatorio_semanal')
+def executar_relatorio_semanal(payload):
+    """
+    Processa um shard da execução (utilizadores com id % shards == shard). Corre no contexto e na sessão do
+    worker: os e-mails gravados, o JobRunShard e o progresso da execução são confirmados no mesmo commit que
+    fecha o job. A linha do JobRun só é tocada em transações curtas (no início e mesmo antes do commit), para
+    que os shards corram em paralelo em vários workers sem esperarem pelo bloqueio dessa linha.
+    Um shard repetido pelo outbox (worker que morreu ou lease expirado) não grava os e-mails duas vezes: o
+    JobRunShard com (run_id, shard) já existe, ou a gravação falha na restrição UNIQUE e tudo é desfeito.
+    """
+    run_id, shard, shards = payload.get('run_id'), payload.get('shard'), payload.get('shards', 1)
+    if run_id:
+        if JobRunShard.query.filter_by(run_id=run_id, shard=shard).first() is not None:
+            logger.info("Shard %s da execução %d do relatório semanal já foi concluído.", shard, run_id)
+            return
+        JobRun.query.filter(JobRun.id == run_id, JobRun.started_at.is_(None)).update(
+            {JobRun.started_at: datetime.utcnow(), JobRun.status: 'running'}, synchronize_session=False)
+        db.session.commit()
+
+    enfileirados = _gerar_relatorio_semanal(current_app._get_current_object(), shard, shards)
+
+    if run_id:
+        db.session.add(JobRunShard(run_id=run_id, shard=shard, items=enfileirados))
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            metrics.increment('weekly_report_duplicate_shards')
+            logger.warning("Shard %s da execução %d do relatório semanal foi concluído por outro worker; "
+                           "os e-mails deste não são gravados.", shard, run_id)
+            return
+        JobRun.query.filter_by(id=run_id).update({
+            JobRun.shards_done: JobRun.shards_done + 1,
+            JobRun.items: JobRun.items + enfileirados,
+        }, synchronize_session=False)
+        run = JobRun.query.get(run_id)
+        db.session.refresh(run)
+        if run.shards_done >= run.shards_total and run.finished_at is None:
+            run.finished_at = datetime.utcnow()
+            run.status = 'done'
+            run.lag_seconds = (run.started_at - run.scheduled_for).total_seconds()
+            run.duration_seconds = (run.finished_at - run.started_at).total_seconds()
+            metrics.observe('job_lag_relatorio_semanal', run.lag_seconds)
+            metrics.observe('job_duration_relatorio_semanal', run.duration_seconds)
+            logger.info("Execução %d do relatório semanal concluída: atraso %.0fs, duração %.0fs, %d e-mails.",
+                        run.id, run.lag_seconds, run.duration_seconds, run.items)
+
+def _gerar_relatorio_semanal(app, shard=None, shards=1):
     """
-    Função de depuração para entender o fluxo do relatório.
+    Os utilizadores (do shard, se indicado) são divididos em lotes processados em paralelo; cada lote faz duas
+    consultas agrupadas (receitas e variações de preço) e monta os e-mails, que são gravados no outbox
+    na sessão atual (o chamador faz o commit). Devolve quantos e-mails foram gravados.
     """
+    inicio = time.perf_counter()
+    uma_semana_atras = datetime.utcnow() - timedelta(days=7)
+    query = db.session.query(User.id).filter(User.subscription_status == 'active')
+    if shard is not None and shards > 1:
+        query = query.filter(User.id % shards == shard)
+    user_ids = [user_id for (user_id,) in query.order_by(User.id)]
+    if not user_ids:
+        logger.info("Relatório semanal: nenhum utilizador ativo (shard %s/%s).", shard, shards)
+        return 0
+
+    chunk_size = app.config.get('REPORT_CHUNK_SIZE', REPORT_CHUNK_SIZE)
+    lotes = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+    logger.info("Relatório semanal (shard %s/%s): %d utilizadores em %d lotes.", shard, shards, len(user_ids), len(lotes))
+
+    enfileirados = 0
+    with ThreadPoolExecutor(max_workers=app.config.get('REPORT_WORKERS', REPORT_WORKERS)) as executor:
+        futures = [executor.submit(_processar_lote, app, lote, uma_semana_atras) for lote in lotes]
+        for concluidos, future in enumerate(as_completed(futures), start=1):
+            enfileirados += outbox.enqueue_many('email', future.result())
+            logger.info("Relatório semanal: %d/%d lotes concluídos (%d e-mails no outbox).",
+                        concluidos, len(lotes), enfileirados)
+
+    duracao = time.perf_counter() - inicio
+    metrics.observe('weekly_report', duracao)
+    metrics.increment('weekly_report_emails_queued', enfileirados)
+    logger.info("Relatório semanal (shard %s/%s) concluído em %.1fs: %d e-mails gravados no outbox.",
+                shard, shards, duracao, enfileirados)
+    return enfileirados
+
+def _processar_lote(app, user_ids, desde):
+    """Calcula os relatórios de um lote de utilizadores e devolve os payloads dos e-mails a enviar."""
     with app.app_context():
-        print(f"\n[{datetime.now()}] --- INÍCIO DA TAREFA DE RELATÓRIO SEMANAL ---")
-
-        users = User.query.filter_by(subscription_status='active').all()
-        if not users:
-            print("  [INFO] Nenhum utilizador ativo encontrado. A encerrar tarefa.")
-        
-        for user in users:
-            print(f"\n  A processar utilizador: {user.email}")
-            
-            uma_semana_atras = datetime.utcnow() - timedelta(days=7)
-
-            # --- Diagnóstico das Receitas ---
-            receitas_da_semana = Recipe.query.filter(
-                Recipe.user_id == user.id,
-                Recipe.created_at >= uma_semana_atras
-            ).all()
-            print(f"    [RECEITAS] Encontradas {len(receitas_da_semana)} receitas nos últimos 7 dias.")
-
-            for receita in receitas_da_semana:
-                lucro = (receita.sale_price or 0) - (receita.total_cost or 0)
-                receita.lucro_calculado = lucro
-            
-            receitas_lucrativas_ordenadas = sorted(receitas_da_semana, key=lambda r: r.lucro_calculado, reverse=True)
-            top_3_receitas = receitas_lucrativas_ordenadas[:3]
-            print(f"    [RECEITAS] Top 3 receitas selecionadas: {[r.name for r in top_3_receitas]}")
-
-
-            # --- Diagnóstico dos Ingredientes ---
-            ingredientes_do_utilizador = user.ingredients
-            variacoes = []
-            print(f"    [INGREDIENTES] A analisar {len(ingredientes_do_utilizador)} ingredientes do utilizador.")
-            
-            for ingrediente in ingredientes_do_utilizador:
-                historico_semanal = PriceHistory.query.filter(
-                    PriceHistory.ingredient_id == ingrediente.id,
-                    PriceHistory.recorded_at >= uma_semana_atras
-                ).order_by(PriceHistory.recorded_at.asc()).all()
-                
-                # Apenas para depuração, vamos ver quantos registos de preço encontramos
-                if len(historico_semanal) > 0:
-                    print(f"      - Para '{ingrediente.name}', encontrados {len(historico_semanal)} registos de preço na semana.")
-
-                if len(historico_semanal) >= 2:
-                    primeiro_registo, ultimo_registo = historico_semanal[0], historico_semanal[-1]
-                    if primeiro_registo.quantity > 0 and ultimo_registo.quantity > 0:
-                        preco_antigo_unitario = primeiro_registo.price / primeiro_registo.quantity
-                        preco_novo_unitario = ultimo_registo.price / ultimo_registo.quantity
-                        if preco_antigo_unitario > 0:
-                            variacao_percentual = ((preco_novo_unitario - preco_antigo_unitario) / preco_antigo_unitario) * 100
-                            variacoes.append({'nome': ingrediente.name, 'variacao': variacao_percentual})
-
-            ingredientes_maior_variacao = sorted(variacoes, key=lambda i: i['variacao'], reverse=True)[:3]
-            print(f"    [INGREDIENTES] Top 3 variações selecionadas: {ingredientes_maior_variacao}")
-
-            # --- Diagnóstico da Decisão de Envio ---
-            print(f"  [DECISÃO] Condição de envio: len(top_3_receitas) > 0 ({len(top_3_receitas) > 0}) OU len(ingredientes_maior_variacao) > 0 ({len(ingredientes_maior_variacao) > 0})")
-            if top_3_receitas or ingredientes_maior_variacao:
-                print("  [AÇÃO] A condição foi cumprida. A chamar a função de envio de e-mail...")
-                send_weekly_report_email(app, user, top_3_receitas, ingredientes_maior_variacao)
-            else:
-                print("  [AÇÃO] A condição NÃO foi cumprida. E-mail não será enviado.")
-            
-        print(f"\n[{datetime.now()}] --- FIM DA TAREFA ---")
\ No newline at end of file
+        inicio = time.perf_counter()
+        try:
+            users = db.session.query(User.id, User.email, User.full_name).filter(User.id.in_(user_ids)).all()
+            receitas = top_receitas_da_semana(user_ids, desde)
+            variacoes = variacoes_de_preco_da_semana(user_ids, desde)
+            payloads = []
+            for user in users:
+                if not (receitas.get(user.id) or variacoes.get(user.id)):
+                    continue
+                try:
+                    payloads.append(message_payload(build_weekly_report_message(
+                        app, user, receitas.get(user.id, []), variacoes.get(user.id, []))))
+                except Exception as e:
+                    logger.warning("Falha ao montar o relatório semanal para %s: %s", user.email, e)
+        finally:
+            db.session.remove()
+
+        metrics.observe('weekly_report_chunk', time.perf_counter() - inicio)
+        return payloads
+
+def top_receitas_da_semana(user_ids, desde, limite=TOP_N):
+    """{user_id: [{'name', 'lucro_calculado'}]} com as receitas mais lucrativas criadas desde `desde`."""
+    lucro = func.coalesce(Recipe.sale_price, 0) - func.coalesce(Recipe.total_cost, 0)
+    ranked = db.session.query(
+        Recipe.user_id, Recipe.name, lucro.label('lucro'),
+        func.row_number().over(partition_by=Recipe.user_id, order_by=(lucro.desc(), Recipe.id)).label('posicao')
+    ).filter(Recipe.user_id.in_(user_ids), Recipe.created_at >= desde).subquery()
+
+    resultado = defaultdict(list)
+    for user_id, name, lucro_calculado in db.session.query(
+        ranked.c.user_id, ranked.c.name, ranked.c.lucro
+    ).filter(ranked.c.posicao <= limite).order_by(ranked.c.user_id, ranked.c.posicao):
+        resultado[user_id].append({'name': name, 'lucro_calculado': lucro_calculado})
+    return resultado
+
+def variacoes_de_preco_da_semana(user_ids, desde, limite=TOP_N):
+    """
+    {user_id: [{'nome', 'variacao'}]} com as maiores variações do preço unitário entre o primeiro e o último
+    registo da semana de cada ingrediente (só ingredientes com pelo menos dois registos).
+    """
+    ordem = (PriceHistory.recorded_at, PriceHistory.id)
+    ranked = db.session.query(
+        PriceHistory.ingredient_id, PriceHistory.price, PriceHistory.quantity,
+        func.row_number().over(partition_by=PriceHistory.ingredient_id, order_by=ordem).label('do_inicio'),
+        func.row_number().over(partition_by=PriceHistory.ingredient_id,
+                               order_by=tuple(c.desc() for c in ordem)).label('do_fim')
+    ).join(Ingredient, PriceHistory.ingredient_id == Ingredient.id).filter(
+        Ingredient.user_id.in_(user_ids), PriceHistory.recorded_at >= desde
+    ).subquery()
+
+    # Em cada ingrediente, a linha com do_inicio = 1 é o primeiro registo e a com do_fim = 1 o último.
+    pontas = db.session.query(
+        ranked.c.ingredient_id,
+        func.max(ranked.c.price).filter(ranked.c.do_inicio == 1).label('preco_inicial'),
+        func.max(ranked.c.quantity).filter(ranked.c.do_inicio == 1).label('quantidade_inicial'),
+        func.max(ranked.c.price).filter(ranked.c.do_fim == 1).label('preco_final'),
+        func.max(ranked.c.quantity).filter(ranked.c.do_fim == 1).label('quantidade_final'),
+    ).filter((ranked.c.do_inicio == 1) | (ranked.c.do_fim == 1)).group_by(
+        ranked.c.ingredient_id
+    ).having(func.count() == 2).subquery()
+
+    resultado = defaultdict(list)
+    for user_id, nome, preco_inicial, quantidade_inicial, preco_final, quantidade_final in db.session.query(
+        Ingredient.user_id, Ingredient.name, pontas.c.preco_inicial, pontas.c.quantidade_inicial,
+        pontas.c.preco_final, pontas.c.quantidade_final
+    ).join(pontas, pontas.c.ingredient_id == Ingredient.id):
+        if quantidade_inicial > 0 and quantidade_final > 0 and preco_inicial > 0:
+            antigo, novo = preco_inicial / quantidade_inicial, preco_final / quantidade_final
+            resultado[user_id].append({'nome': nome, 'variacao': (novo - antigo) / antigo * 100})
+    return {user_id: sorted(itens, key=lambda i: i['variacao'], reverse=True)[:limite]
+            for user_id, itens in resultado.items()}
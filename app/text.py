@@ -0,0 +1,37 @@
+# Arquivo: app/text.py
+
+import unicodedata
+
+def normalize_name(name):
+    """Minúsculas, sem acentos e com espaços simples: 'Pão  de Queijo' -> 'pao de queijo'."""
+    decomposed = unicodedata.normalize('NFKD', str(name or ''))
+    without_accents = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(without_accents.lower().split())
+
+def normalize_phone(phone, default_country_code='55'):
+    """
+    Telefone no formato E.164 ('+5511987654321') ou None se não for um número válido.
+    Aceita o prefixo 'whatsapp:' da Twilio, pontuação, '00' internacional e números nacionais
+    (DDD + número, com ou sem o 0 de longa distância), aos quais junta o código do país.
+    Os celulares brasileiros ficam sempre com o nono dígito: o WhatsApp nem sempre o envia
+    ('+55 11 9 8765-4321' chega às vezes como '+55 11 8765-4321'), e com uma só forma gravada
+    o índice único de phone_e164 cobre as duas.
+    """
+    phone = str(phone or '').strip()
+    if phone.lower().startswith('whatsapp:'):
+        phone = phone[9:].strip()
+    digits = ''.join(c for c in phone if c.isdigit())
+    if phone.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    else:
+        digits = digits.lstrip('0')
+        if len(digits) in (10, 11):
+            digits = default_country_code + digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    # Celular brasileiro sem o nono dígito: DDD + 8 dígitos a começar por 6, 7, 8 ou 9 (os fixos começam por 2 a 5).
+    if digits.startswith('55') and len(digits) == 12 and digits[4] in '6789':
+        digits = digits[:4] + '9' + digits[4:]
+    return '+' + digits
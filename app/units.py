@@ -0,0 +1,125 @@
+# Arquivo: app/units.py
+
+import numpy as np
+
+MASS, VOLUME, COUNT = 0, 1, 2
+
+# Unidade -> (dimensão, fator para a unidade base da dimensão: g, ml ou un)
+UNITS = {
+    'mg': (MASS, 0.001),
+    'g': (MASS, 1.0),
+    'kg': (MASS, 1000.0),
+    'ml': (VOLUME, 1.0),
+    'l': (VOLUME, 1000.0),
+    'un': (COUNT, 1.0),
+    'dz': (COUNT, 12.0),
+}
+BASE_UNITS = {MASS: 'g', VOLUME: 'ml', COUNT: 'un'}
+
+# Grafias comuns em embalagens e notas fiscais.
+ALIASES = {'gr': 'g', 'grs': 'g', 'kgs': 'kg', 'lt': 'l', 'lts': 'l', 'und': 'un', 'unid': 'un', 'pc': 'un', 'pç': 'un'}
+
+# Fatores pré-calculados para todos os pares de unidades da mesma dimensão.
+_FACTORS = {(a, b): fa / fb
+            for a, (dim_a, fa) in UNITS.items()
+            for b, (dim_b, fb) in UNITS.items() if dim_a == dim_b}
+
+# Tabelas indexadas por código de unidade, usadas nas conversões vetorizadas.
+_UNIT_CODES = {unit: code for code, unit in enumerate(UNITS)}
+_UNIT_DIMS = np.array([dim for dim, _ in UNITS.values()] + [-1])
+_UNIT_FACTORS = np.array([factor for _, factor in UNITS.values()] + [np.nan])
+_UNKNOWN = len(UNITS)
+
+class UnitConversionError(ValueError):
+    pass
+
+def normalize_unit(unit):
+    unit = str(unit or '').strip().lower()
+    return ALIASES.get(unit, unit)
+
+def base_unit_for(unit):
+    """Unidade base usada para guardar o preço de um ingrediente comprado em `unit`."""
+    unit = normalize_unit(unit)
+    if unit not in UNITS:
+        raise UnitConversionError(f"Unidade '{unit}' não suportada.")
+    return BASE_UNITS[UNITS[unit][0]]
+
+def _grams_per_base(dim, density, unit_weight_g):
+    """Gramas por unidade base da dimensão (1 ml usa a densidade, 1 un usa o peso por unidade)."""
+    if dim == MASS: return 1.0
+    if dim == VOLUME: return density or None
+    return unit_weight_g or None
+
+def conversion_factor(from_unit, to_unit, density=None, unit_weight_g=None):
+    """
+    Fator que multiplica uma quantidade em `from_unit` para obtê-la em `to_unit`.
+    Entre dimensões diferentes usa a densidade (g/ml) ou o peso por unidade (g) do ingrediente.
+    """
+    from_unit, to_unit = normalize_unit(from_unit), normalize_unit(to_unit)
+    factor = _FACTORS.get((from_unit, to_unit))
+    if factor is not None:
+        return factor
+    if from_unit not in UNITS or to_unit not in UNITS:
+        raise UnitConversionError(f"Não é possível converter '{from_unit}' para '{to_unit}'.")
+
+    (from_dim, from_factor), (to_dim, to_factor) = UNITS[from_unit], UNITS[to_unit]
+    from_grams = _grams_per_base(from_dim, density, unit_weight_g)
+    to_grams = _grams_per_base(to_dim, density, unit_weight_g)
+    if not from_grams or not to_grams:
+        missing = 'a densidade' if VOLUME in (from_dim, to_dim) else 'o peso por unidade'
+        raise UnitConversionError(f"Não é possível converter '{from_unit}' para '{to_unit}' sem {missing} do ingrediente.")
+    return from_factor * from_grams / (to_grams * to_factor)
+
+def convert(quantity, from_unit, to_unit, density=None, unit_weight_g=None):
+    return quantity * conversion_factor(from_unit, to_unit, density, unit_weight_g)
+
+def unit_codes(units):
+    """Códigos numéricos das unidades; as desconhecidas recebem um código sem conversão possível."""
+    units = np.asarray(units, dtype=object)
+    if units.size == 0:
+        return np.zeros(0, dtype=int)
+    distinct, inverse = np.unique(units.astype(str), return_inverse=True)
+    codes = np.array([_UNIT_CODES.get(normalize_unit(u), _UNKNOWN) for u in distinct])
+    return codes[inverse]
+
+def convert_array(quantities, from_units, to_units, density=None, unit_weight_g=None):
+    """
+    Converte vetores de quantidades de uma só vez.
+    `from_units`/`to_units` podem ser vetores ou uma única unidade; `density` e `unit_weight_g`
+    são vetores por linha (None/NaN quando desconhecidos). Pares impossíveis resultam em NaN.
+    """
+    quantities = np.asarray(quantities, dtype=float)
+    n = quantities.shape[0]
+    from_codes = unit_codes(np.broadcast_to(np.asarray(from_units, dtype=object), (n,)))
+    to_codes = unit_codes(np.broadcast_to(np.asarray(to_units, dtype=object), (n,)))
+
+    grams_per_base = np.empty((n, 3))
+    grams_per_base[:, MASS] = 1.0
+    grams_per_base[:, VOLUME] = _as_float_array(density, n)
+    grams_per_base[:, COUNT] = _as_float_array(unit_weight_g, n)
+    grams_per_base[grams_per_base <= 0] = np.nan
+
+    from_dims, to_dims = _UNIT_DIMS[from_codes], _UNIT_DIMS[to_codes]
+    rows = np.arange(n)
+    bridge = np.where(
+        from_dims == to_dims, 1.0,
+        grams_per_base[rows, from_dims.clip(0)] / grams_per_base[rows, to_dims.clip(0)]
+    )
+    bridge[(from_dims < 0) | (to_dims < 0)] = np.nan
+    return quantities * _UNIT_FACTORS[from_codes] * bridge / _UNIT_FACTORS[to_codes]
+
+def to_grams_array(quantities, units, density=None, unit_weight_g=None):
+    """
+    Peso em gramas de cada linha. Líquidos sem densidade cadastrada são pesados como água
+    e unidades sem peso por unidade não entram no total (contam 0).
+    """
+    n = len(quantities)
+    density = _as_float_array(density, n)
+    density = np.where(np.isnan(density), 1.0, density)
+    return np.nan_to_num(convert_array(quantities, units, 'g', density, unit_weight_g))
+
+def _as_float_array(values, n):
+    if values is None:
+        return np.full(n, np.nan)
+    # dtype=float transforma None em NaN.
+    return np.array(np.broadcast_to(np.asarray(values, dtype=float), (n,)))
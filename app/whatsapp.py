@@ -0,0 +1,218 @@
+# Arquivo: app/whatsapp.py
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+from twilio.twiml.messaging_response import MessagingResponse
+from app import db
+from app.dashboard import recent_cost_alerts, top_recipes
+from app.models import Ingredient, Recipe, RecipeIngredient, User
+from app.search import find_recipes
+from app.text import normalize_name, normalize_phone
+
+MAX_RECIPES_PER_MESSAGE = 10
+TOP_DEFAULT, TOP_MAX = 5, 20
+ALERTS_WINDOW = timedelta(days=7)
+
+def twiml_reply(body):
+    """Resposta TwiML: a Twilio entrega a mensagem ao remetente sem nenhuma chamada de saída nossa."""
+    response = MessagingResponse()
+    response.message(body)
+    return str(response)
+
+class SenderCache:
+    """
+    Cache por processo de telefone (E.164) -> id do utilizador, com validade limitada. Números desconhecidos
+    também ficam guardados, mas por pouco tempo, para que quem se registe logo a seguir seja reconhecido.
+    """
+    def __init__(self, max_size=10000, ttl=300, negative_ttl=30):
+        self.max_size, self.ttl, self.negative_ttl = max_size, ttl, negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, phone):
+        """Devolve (encontrado, user_id); user_id pode ser None para um número guardado como desconhecido."""
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry is None:
+                return False, None
+            user_id, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[phone]
+                return False, None
+            self._entries.move_to_end(phone)
+            return True, user_id
+
+    def set(self, phone, user_id):
+        ttl = self.ttl if user_id is not None else self.negative_ttl
+        with self._lock:
+            self._entries[phone] = (user_id, time.monotonic() + ttl)
+            self._entries.move_to_end(phone)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *phones):
+        with self._lock:
+            for phone in phones:
+                self._entries.pop(phone, None)
+
+sender_cache = SenderCache()
+
+def resolve_sender(remetente):
+    """
+    Utilizador dono do número 'whatsapp:+55...' que enviou a mensagem, ou None. Procura pela coluna
+    phone_e164 (índice único) com o número normalizado, que já junta o nono dígito quando o WhatsApp
+    o omite, e guarda o resultado em cache.
+    """
+    phone = normalize_phone(remetente)
+    if not phone:
+        return None
+    found, user_id = sender_cache.get(phone)
+    if found and user_id is not None:
+        user = User.query.get(user_id)
+        # O número pode ter mudado noutro processo; nesse caso a entrada é descartada e volta-se a procurar.
+        if user is not None and user.phone_e164 == phone:
+            return user
+    elif found:
+        return None
+    user = User.query.filter_by(phone_e164=phone).first()
+    sender_cache.set(phone, user.id if user else None)
+    return user
+
+# --- COMANDOS ---
+_commands = {}
+_usages = []
+
+def command(*keywords, usage):
+    """Regista um comando: a primeira palavra da mensagem (sem acentos) escolhe a função, que recebe (user, resto)."""
+    def decorator(f):
+        for keyword in keywords:
+            _commands[normalize_name(keyword)] = f
+        _usages.append(usage)
+        return f
+    return decorator
+
+def parse_command(message):
+    """(função, argumentos) da mensagem; a função é None quando a primeira palavra não é um comando."""
+    keyword, _, args = ' '.join(str(message or '').split()).partition(' ')
+    return _commands.get(normalize_name(keyword)), args
+
+def handle_message(user, message):
+    """Texto da resposta a uma mensagem de um utilizador já identificado."""
+    handler, args = parse_command(message)
+    if handler is None:
+        return help_message(user)
+    return handler(user, args)
+
+def help_message(user):
+    return (f"Olá, {first_name(user)}! Comandos disponíveis:\n\n"
+            + "\n".join(f"➡️ *{usage}*" for usage in _usages))
+
+def first_name(user):
+    return user.full_name.split()[0]
+
+def recipe_names(args):
+    """Nomes separados por vírgula ('custo bolo, torta, pão'), sem repetições."""
+    names = []
+    for name in re.split(r'[,;\n]', args):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names[:MAX_RECIPES_PER_MESSAGE]
+
+def receita_nao_encontrada(nome_receita, sugestoes):
+    resposta = f"Desculpe, não encontrei a receita com o nome '{nome_receita}'."
+    if sugestoes:
+        return resposta + " Quis dizer: " + ", ".join(f"*{nome}*" for nome in sugestoes) + "?"
+    return resposta + " Por favor, verifique o nome exato."
+
+def recipe_components(recipe_ids):
+    """{recipe_id: [(nome, quantidade, unidade)]} dos ingredientes e sub-receitas de várias receitas, numa consulta."""
+    sub_recipe = aliased(Recipe)
+    components = {}
+    for recipe_id, name, quantity, unit in db.session.query(
+        RecipeIngredient.recipe_id, func.coalesce(sub_recipe.name, Ingredient.name),
+        RecipeIngredient.quantity, RecipeIngredient.unit_used
+    ).outerjoin(Ingredient, RecipeIngredient.ingredient_id == Ingredient.id
+    ).outerjoin(sub_recipe, RecipeIngredient.sub_recipe_id == sub_recipe.id
+    ).filter(RecipeIngredient.recipe_id.in_(recipe_ids)).order_by(RecipeIngredient.recipe_id, RecipeIngredient.id):
+        components.setdefault(recipe_id, []).append((name, quantity, unit))
+    return components
+
+def answer_recipes(user, args, describe, with_components=False):
+    """
+    Responde sobre uma ou várias receitas: todas são procuradas de uma vez (find_recipes) e, se pedido,
+    os ingredientes de todas vêm numa única consulta. `describe(receita, ingredientes)` devolve o texto de cada uma.
+    """
+    names = recipe_names(args)
+    if not names:
+        return help_message(user)
+    results = find_recipes(user, names)
+    found = [recipe for _, recipe, _ in results if recipe]
+    components = recipe_components([recipe.id for recipe in found]) if with_components and found else {}
+    parts = []
+    for name, recipe, suggestions in results:
+        if recipe:
+            parts.append(describe(recipe, components.get(recipe.id, [])))
+        else:
+            parts.append(receita_nao_encontrada(name, suggestions))
+    greeting = f"Olá, {first_name(user)}!\n\n" if found else ""
+    return greeting + "\n\n".join(parts)
+
+@command('custo', usage='custo [receita, receita...]')
+def cost_command(user, args):
+    return answer_recipes(user, args, lambda recipe, _: (
+        f"O custo total da sua receita *'{recipe.name}'* é de *R$ {recipe.total_cost:.2f}*."))
+
+@command('venda', usage='venda [receita, receita...]')
+def sale_command(user, args):
+    def describe(recipe, _):
+        if recipe.sale_price is None:
+            return f"A receita *'{recipe.name}'* ainda não tem preço de venda definido."
+        return f"O preço de venda sugerido para *'{recipe.name}'* é de *R$ {recipe.sale_price:.2f}*."
+    return answer_recipes(user, args, describe)
+
+@command('lucro', usage='lucro [receita, receita...]')
+def profit_command(user, args):
+    return answer_recipes(user, args, lambda recipe, _: (
+        f"O lucro estimado para *'{recipe.name}'* é de *R$ {(recipe.sale_price or 0) - (recipe.total_cost or 0):.2f}*."))
+
+@command('ingredientes', usage='ingredientes [receita, receita...]')
+def ingredients_command(user, args):
+    def describe(recipe, components):
+        lines = [f"Ingredientes para a receita *'{recipe.name}'*:"]
+        lines += [f"- {name}: {quantity} {unit}" for name, quantity, unit in components] or ["- (nenhum ingrediente cadastrado)"]
+        return "\n".join(lines)
+    return answer_recipes(user, args, describe, with_components=True)
+
+@command('top', usage='top [quantidade] [lucro | custo | venda]')
+def top_command(user, args):
+    limit, order_by = TOP_DEFAULT, 'profit'
+    for word in normalize_name(args).split():
+        if word.isdigit():
+            limit = max(1, min(int(word), TOP_MAX))
+        else:
+            order_by = {'custo': 'cost', 'venda': 'sale', 'preco': 'sale'}.get(word, order_by)
+    recipes = top_recipes(user.id, order_by=order_by, limit=limit)
+    if not recipes:
+        return f"Olá, {first_name(user)}! Ainda não tem receitas cadastradas."
+    label, value = {
+        'profit': ('maior lucro', lambda r: r.profit),
+        'cost': ('maior custo', lambda r: r.total_cost or 0),
+        'sale': ('maior preço de venda', lambda r: r.sale_price or 0),
+    }[order_by]
+    lines = [f"{position}. *{recipe.name}*: R$ {value(recipe):.2f}" for position, recipe in enumerate(recipes, start=1)]
+    return f"Olá, {first_name(user)}! As suas {len(recipes)} receitas com {label}:\n\n" + "\n".join(lines)
+
+@command('alertas', usage='alertas')
+def alerts_command(user, args):
+    alerts = recent_cost_alerts(user.id, window=ALERTS_WINDOW, by_purchase=True)
+    if not alerts:
+        return f"Olá, {first_name(user)}! Nenhum ingrediente subiu mais de 10% nos últimos {ALERTS_WINDOW.days} dias."
+    lines = [f"- *{name}*: +{increase:.1f}%" for _, name, increase in alerts]
+    return (f"Olá, {first_name(user)}! Ingredientes que subiram de preço nos últimos {ALERTS_WINDOW.days} dias:\n\n"
+            + "\n".join(lines))
@@ -27,4 +27,42 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     
     # Limite para alerta de custo
-    COST_ALERT_THRESHOLD = 15.0
\ No newline at end of file
+    COST_ALERT_THRESHOLD = 15.0
+
+    # Cache do dashboard (por processo) e token para consultar /metrics
+    DASHBOARD_CACHE_SIZE = int(os.environ.get('DASHBOARD_CACHE_SIZE', 1024))
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 300))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Relatório semanal: utilizadores por lote, lotes processados em paralelo e shards (jobs independentes)
+    REPORT_CHUNK_SIZE = int(os.environ.get('REPORT_CHUNK_SIZE', 500))
+    REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 4))
+    REPORT_SHARDS = int(os.environ.get('REPORT_SHARDS', 4))
+
+    # Envio de e-mails: workers (ligações SMTP simultâneas), tamanho da fila, envios por segundo (0 = sem limite)
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', 2))
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE', 1000))
+    MAIL_RATE_LIMIT = float(os.environ.get('MAIL_RATE_LIMIT', 0))
+    MAIL_IDLE_TIMEOUT = float(os.environ.get('MAIL_IDLE_TIMEOUT', 5))
+
+    # Worker do outbox: intervalo entre consultas com a fila vazia e jobs reclamados por vez
+    OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 2))
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+
+    # NF-e: fornecedor ('http' ou 'mock'), endereço e chave da API, tempo limite, novas tentativas e cache
+    NFE_PROVIDER = os.environ.get('NFE_PROVIDER')
+    NFE_API_URL = os.environ.get('NFE_API_URL')
+    NFE_API_KEY = os.environ.get('NFE_API_KEY')
+    NFE_TIMEOUT = float(os.environ.get('NFE_TIMEOUT', 10))
+    NFE_RETRIES = int(os.environ.get('NFE_RETRIES', 3))
+    NFE_CACHE_DIR = os.environ.get('NFE_CACHE_DIR')
+    NFE_CACHE_SIZE = int(os.environ.get('NFE_CACHE_SIZE', 256))
+    # Minutos que uma NF-e lida fica guardada no servidor à espera da confirmação da importação
+    NFE_STAGING_TTL_MINUTES = int(os.environ.get('NFE_STAGING_TTL_MINUTES', 60))
+
+    # Importação de NF-e em lote: processos para ler os XMLs, threads para buscar as chaves,
+    # notas por transação e tamanho máximo do zip enviado (MB)
+    NFE_BATCH_PROCESSES = int(os.environ.get('NFE_BATCH_PROCESSES', 2))
+    NFE_BATCH_THREADS = int(os.environ.get('NFE_BATCH_THREADS', 8))
+    NFE_BATCH_CHUNK_SIZE = int(os.environ.get('NFE_BATCH_CHUNK_SIZE', 20))
+    NFE_BATCH_MAX_UPLOAD_MB = int(os.environ.get('NFE_BATCH_MAX_UPLOAD_MB', 20))
\ No newline at end of file
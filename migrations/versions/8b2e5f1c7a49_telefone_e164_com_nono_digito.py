@@ -0,0 +1,67 @@
+"""Telefone E.164 com nono dígito
+
+Revision ID: 8b2e5f1c7a49
+Revises: 6c1f8a3d5e27
+Create Date: 2026-10-18 11:20:44.915302
+
+"""
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e5f1c7a49'
+down_revision = '6c1f8a3d5e27'
+branch_labels = None
+depends_on = None
+
+
+def with_ninth_digit(e164):
+    # Cópia da regra de app.text.normalize_phone: a migração não deve depender do código da aplicação.
+    digits = e164[1:]
+    if digits.startswith('55') and len(digits) == 12 and digits[4] in '6789':
+        return '+' + digits[:4] + '9' + digits[4:]
+    return e164
+
+
+def upgrade():
+    # Grava todos os celulares brasileiros com o nono dígito, para que o índice único de phone_e164 cubra as
+    # duas formas do mesmo número. Se dois utilizadores tiverem o mesmo número (um com e outro sem o nono
+    # dígito), fica com ele o mais antigo; os outros ficam sem número de WhatsApp até o corrigirem no perfil.
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('phone_e164', sa.String))
+    conn = op.get_bind()
+    owner, changed, dropped = {}, [], []
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.select(user.c.id, user.c.phone_e164)
+                            .where(user.c.id > last_id, user.c.phone_e164.isnot(None))
+                            .order_by(user.c.id).limit(1000)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            phone = with_ninth_digit(row.phone_e164)
+            if phone in owner:
+                logger.warning("O telefone %s do utilizador %s já pertence ao utilizador %s; foi removido.",
+                               row.phone_e164, row.id, owner[phone])
+                dropped.append({'user_id': row.id})
+                continue
+            owner[phone] = row.id
+            if phone != row.phone_e164:
+                changed.append({'user_id': row.id, 'phone_e164': phone})
+        last_id = rows[-1].id
+
+    # Primeiro liberta os números repetidos, depois grava as formas novas (sem colidir no índice único).
+    if dropped:
+        conn.execute(user.update().where(user.c.id == sa.bindparam('user_id')).values(phone_e164=None), dropped)
+    if changed:
+        conn.execute(user.update().where(user.c.id == sa.bindparam('user_id'))
+                     .values(phone_e164=sa.bindparam('phone_e164')), changed)
+    logger.info("Telefones com o nono dígito: %d atualizados, %d removidos por repetição.", len(changed), len(dropped))
+
+
+def downgrade():
+    # A forma sem o nono dígito não é guardada; os números continuam válidos na versão anterior.
+    pass
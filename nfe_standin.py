@@ -0,0 +1,84 @@
+"""
+Servidor local que faz de fornecedor de NF-e, para testes e benchmarks do cliente HTTP.
+
+    python nfe_standin.py --port 8765 --latency 0.2
+    NFE_PROVIDER=http NFE_API_URL=http://127.0.0.1:8765/nfe flask run
+
+GET /nfe/<chave> devolve <fixtures>/<chave>.xml ou <fixtures>/<chave>.json se existir; senão, a nota de exemplo
+com a chave pedida (em JSON, ou no XML oficial com --xml).
+Chaves começadas por '404' respondem 404 e as começadas por '503' respondem 503, para exercitar os erros.
+"""
+import argparse
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'static', 'mock_data')
+
+def make_handler(fixtures_dir, latency=0.0, api_key=None, xml=False):
+    with open(os.path.join(fixtures_dir, 'nfe_example.json'), 'r', encoding='utf-8') as f:
+        example = json.load(f)
+    with open(os.path.join(fixtures_dir, 'nfe_example.xml'), 'rb') as f:
+        example_xml = f.read()
+
+    class NFeHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            parts = self.path.strip('/').split('/')
+            if len(parts) != 2 or parts[0] != 'nfe' or not parts[1].isdigit():
+                return self._reply(404, {'erro': 'Recurso não encontrado.'})
+            if api_key and self.headers.get('Authorization') != api_key:
+                return self._reply(401, {'erro': 'Não autorizado.'})
+            chave = parts[1]
+            if latency:
+                time.sleep(latency)
+            if chave.startswith('404'):
+                return self._reply(404, {'erro': 'NF-e não encontrada.'})
+            if chave.startswith('503'):
+                return self._reply(503, {'erro': 'Serviço indisponível.'})
+            path = os.path.join(fixtures_dir, chave)
+            if os.path.exists(path + '.xml'):
+                with open(path + '.xml', 'rb') as f:
+                    return self._reply(200, f.read(), 'application/xml')
+            if os.path.exists(path + '.json'):
+                with open(path + '.json', 'r', encoding='utf-8') as f:
+                    return self._reply(200, json.load(f))
+            if xml:
+                return self._reply(200, example_xml, 'application/xml')
+            return self._reply(200, dict(example, chave=chave))
+
+        def _reply(self, status, body, content_type='application/json'):
+            data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return NFeHandler
+
+def make_server(host='127.0.0.1', port=8765, fixtures_dir=DEFAULT_FIXTURES, latency=0.0, api_key=None, xml=False):
+    """Cria o servidor (port=0 escolhe uma porta livre); quem chama decide entre serve_forever() e uma thread."""
+    return ThreadingHTTPServer((host, port), make_handler(fixtures_dir, latency, api_key, xml))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fornecedor local de NF-e para testes e benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES)
+    parser.add_argument('--latency', type=float, default=0.0, help='Atraso de cada resposta, em segundos.')
+    parser.add_argument('--api-key', default=None)
+    parser.add_argument('--xml', action='store_true', help='Responde com o XML oficial em vez de JSON.')
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.fixtures, args.latency, args.api_key, args.xml)
+    print(f"Fornecedor de NF-e local em http://{args.host}:{server.server_port}/nfe/<chave>")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
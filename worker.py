@@ -0,0 +1,21 @@
+from dotenv import load_dotenv
+load_dotenv() # Carrega as variáveis do .env APENAS para o ambiente local
+import logging
+import signal
+import threading
+from app import create_app, start_scheduler
+from app.outbox import run_worker
+
+app = create_app()
+
+logging.basicConfig(level=logging.INFO)
+
+if __name__ == '__main__':
+    # Processo separado do web: envia e-mails/WhatsApp do outbox e corre as tarefas agendadas.
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    start_scheduler(app)
+    run_worker(app, stop_event,
+               poll_interval=app.config.get('OUTBOX_POLL_INTERVAL', 2.0),
+               batch_size=app.config.get('OUTBOX_BATCH_SIZE', 50))